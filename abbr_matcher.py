@@ -0,0 +1,252 @@
+# This module finds unencoded abbreviations in an xml string
+# and adds the likely expansions to them, using the
+# abbr_dictionary created by create_abbr_dictionary.py.
+
+# Instead of searching the whole document once for every
+# abbreviation in the dictionary, the abbreviations are put
+# into a character trie once. The text of the document is then
+# scanned once: from each position where a word may start,
+# the trie is followed as far as the text matches it, which
+# gives all abbreviations starting at that position.
+# The markup for all found abbreviations is then inserted
+# while building the new string once.
+
+# Building the trie every time the dictionary is used would
+# be a waste, so create_abbr_dictionary.py also saves it as an
+# index file next to the dictionary. The index starts with a
+# header line containing the format version and the hash of the
+# dictionary it was built from, followed by the pickled trie,
+# the do_not_expand set and the most frequent expansion of each
+# abbreviation (for looking up expansions for abbreviations already
+# encoded as <choice><abbr>).
+# If the dictionary has changed, the index is rebuilt when loaded.
+
+# The same is done for the dictionaries of corrections and
+# regularizations (<choice><orig>/<corr> and <choice><orig>/<reg>)
+# created by create_abbr_dictionary.py: each of them has its own
+# index, and when several of them are used, all their tries are
+# followed during the same scan of the text.
+
+# The dictionary maps each abbreviation to a ranked list of
+# [expansion, count] pairs. A dictionary in the older format,
+# with one expansion per abbreviation and alternatives added
+# as abbr_1 etc., is converted when it's read.
+
+import os
+import re
+import json
+import hashlib
+import pickle
+
+# certain words should only be given expans if they have
+# been encoded as abbrs, otherwise they probably aren't
+# abbrs but just ordinary words that can't be expanded
+# keep these words in this set
+DO_NOT_EXPAND = frozenset(["a.", "adress.", "af", "af.", "afsigt", "allmän", "angelägen", "angelägen.", "art", "B", "B.", "beslut", "beslut.", "bl.", "borg", "borg.", "c.", "d", "D", "D.", "dat", "del", "del.", "des", "E", "E.", "erkände", "f.", "f:", "F.", "fl.", "fr", "Fr", "Fr.", "följ", "Följ", "för", "för.", "föredrag", "förhand", "förhand.", "förord", "först", "först.", "G.", "ge", "ge.", "gen", "gifter", "gång.", "H", "H.", "hand.", "just", "Just", "k.", "K", "K.", "K. F", "K. F.", "kg", "kung", "Kung", "l", "L", "L.", "lämpligt", "lämpligt.", "m", "m.", "M", "M.", "Maj.", "med", "med.", "min", "min.", "mån", "n", "n.", "N", "N.", "nu", "nu.", "ord", "ord.", "period", "period.", "propos", "public", "R", "R.", "redo", "regn", "regn.", "rest", "rest.", "rörde", "s", "s.", "S", "S.", "sammans.", "säg", "Säg", "sigill", "St", "St.", "S<hi rend=\"raised\">t", "S<hi rend=\"raised\">t</hi> Petersburg", "system.", "t.", "tills", "Tills", "tur", "upp", "upp.", "utfärd", "utfärd.", "v.", "verk.", "väg.", "W", "W.", "öfver."])
+# by checking the context of an abbr we can specify
+# what a word should look like and make sure that parts
+# of words or already tagged words don't get tagged
+# an abbr has to be preceded by whitespace, », ” or (
+# (or be at the start of the string)
+LEFT_CONTEXT = "»”("
+# and followed by whitespace, one of these characters
+# or one of these tags
+RIGHT_CONTEXT = ".,?!»”:;)"
+RIGHT_CONTEXT_TAGS = ("<lb/>", "</p>")
+# change this whenever the content of the index changes
+ABBR_INDEX_FORMAT = "3"
+ABBR_INDEX_MAGIC = "ABBRIDX"
+# an alternative expansion in the older dictionary format
+ALTERNATIVE_PATTERN = re.compile(r"^(.*)_\d$")
+# the types of dictionaries and the tags of the <choice>
+# they're harvested from and used for: original, replacement
+CHOICE_TAGS = {
+    "abbr": ("abbr", "expan"),
+    "corr": ("orig", "corr"),
+    "reg": ("orig", "reg")
+}
+
+# do_not_expand only concerns abbreviations
+def get_do_not_expand(choice_type):
+    if choice_type == "abbr":
+        return DO_NOT_EXPAND
+    return frozenset()
+
+# read the dictionary, converting it if it's in the older format
+# the alternatives of an abbr come after it in that format,
+# so they're added after its main expansion with count 0
+def read_abbr_dictionary(dictionary_filename):
+    with open(dictionary_filename, encoding="utf-8-sig") as source_file:
+        abbr_dictionary = json.load(source_file)
+    converted_dictionary = {}
+    for abbreviation, expansions in abbr_dictionary.items():
+        if isinstance(expansions, str):
+            match_string = ALTERNATIVE_PATTERN.match(abbreviation)
+            if match_string and isinstance(abbr_dictionary.get(match_string.group(1)), str):
+                abbreviation = match_string.group(1)
+            expansions = [[expansions, 0]]
+        converted_dictionary.setdefault(abbreviation, []).extend(expansions)
+    return converted_dictionary
+
+# the most frequent, i.e. first, expansion of each abbreviation
+def get_preferred_expansions(abbr_dictionary):
+    preferred_expansions = {}
+    for abbreviation, expansions in abbr_dictionary.items():
+        if len(expansions) > 0:
+            preferred_expansions[abbreviation] = expansions[0][0]
+    return preferred_expansions
+
+# build the trie out of the preferred expansions
+# each node is a dict of characters, and the node where
+# an abbr ends contains the key None with the abbr, its
+# expan and its priority
+# when abbrs overlap in the text, the one that comes first
+# in the dictionary is the one that gets expanded, since
+# that's what happened when the dictionary was gone through
+# one abbr at a time
+def build_abbr_matcher(abbr_dictionary, do_not_expand=DO_NOT_EXPAND):
+    abbr_matcher = {}
+    priority = 0
+    for abbreviation, expansion in abbr_dictionary.items():
+        priority += 1
+        if abbreviation == "" or abbreviation in do_not_expand:
+            continue
+        # an abbr ending inside a tag could only match inside a tag
+        if abbreviation.rfind("<") > abbreviation.rfind(">"):
+            continue
+        node = abbr_matcher
+        for character in abbreviation:
+            node = node.setdefault(character, {})
+        if None not in node:
+            node[None] = (priority, abbreviation, expansion)
+    return abbr_matcher
+
+def is_left_context(xml_string, position):
+    if position == 0:
+        return True
+    character = xml_string[position - 1]
+    return character.isspace() or character in LEFT_CONTEXT
+
+def is_right_context(xml_string, position):
+    if position >= len(xml_string):
+        return False
+    character = xml_string[position]
+    if character.isspace() or character in RIGHT_CONTEXT:
+        return True
+    return xml_string.startswith(RIGHT_CONTEXT_TAGS, position)
+
+# scan the text of the xml string, i.e. everything
+# outside the tags, and return all the abbrs (or other
+# originals) found as (rank, priority, start, end, abbreviation,
+# expansion, tags), where rank is the place of the matcher in
+# the list of (matcher, tags) and tags those of its <choice>
+# an abbr may contain tags (such as <hi>), so once the start
+# of an abbr has been found, the trie is followed over them
+# all the matchers are followed from each position, so the
+# text is scanned only once however many of them there are
+def find_choices(xml_string, choice_matchers):
+    matches = []
+    position = 0
+    string_length = len(xml_string)
+    while position < string_length:
+        # skip tags
+        if xml_string[position] == "<":
+            tag_end = xml_string.find(">", position)
+            if tag_end == -1:
+                break
+            position = tag_end + 1
+            continue
+        rank = 0
+        for abbr_matcher, tags in choice_matchers:
+            rank += 1
+            if xml_string[position] not in abbr_matcher or not is_left_context(xml_string, position):
+                continue
+            node = abbr_matcher
+            end = position
+            while end < string_length:
+                node = node.get(xml_string[end])
+                if node is None:
+                    break
+                end += 1
+                if None in node and is_right_context(xml_string, end):
+                    priority, abbreviation, expansion = node[None]
+                    matches.append((rank, priority, position, end, abbreviation, expansion, tags))
+        position += 1
+    return matches
+
+# add the likely expansions (or corrections etc.) to all
+# untagged abbrs (or originals) found by the matchers
+# overlapping matches are resolved by the order of the
+# matchers and then by priority, and then the new string
+# is built in one go
+def expand_choices(xml_string, choice_matchers):
+    matches = find_choices(xml_string, choice_matchers)
+    if len(matches) == 0:
+        return xml_string
+    matches.sort()
+    taken = bytearray(len(xml_string))
+    accepted_matches = []
+    for rank, priority, start, end, abbreviation, expansion, tags in matches:
+        if any(taken[start:end]):
+            continue
+        taken[start:end] = b"\x01" * (end - start)
+        accepted_matches.append((start, end, abbreviation, expansion, tags))
+    accepted_matches.sort()
+    parts = []
+    position = 0
+    for start, end, abbreviation, expansion, tags in accepted_matches:
+        original_tag, replacement_tag = tags
+        parts.append(xml_string[position:start])
+        parts.append("<choice><" + original_tag + ">" + abbreviation + "</" + original_tag + "><" + replacement_tag + ">" + expansion + "</" + replacement_tag + "></choice>")
+        position = end
+    parts.append(xml_string[position:])
+    return "".join(parts)
+
+# if abbreviations haven't been encoded but we still want to
+# add likely expansions to them: use this function
+def expand_abbreviations(xml_string, abbr_matcher):
+    return expand_choices(xml_string, [(abbr_matcher, CHOICE_TAGS["abbr"])])
+
+# the hash of the dictionary file together with the
+# do_not_expand set, since both of them affect the trie
+def hash_abbr_source(dictionary_filename, choice_type="abbr"):
+    source_hash = hashlib.sha1()
+    with open(dictionary_filename, "rb") as source_file:
+        source_hash.update(source_file.read())
+    source_hash.update("\n".join(sorted(get_do_not_expand(choice_type))).encode("utf-8"))
+    return source_hash.hexdigest()
+
+# build the index out of the dictionary file and save it
+# choice_type is the type of the dictionary, see CHOICE_TAGS
+def write_abbr_index(dictionary_filename, index_filename, choice_type="abbr"):
+    source_hash = hash_abbr_source(dictionary_filename, choice_type)
+    preferred_expansions = get_preferred_expansions(read_abbr_dictionary(dictionary_filename))
+    abbr_index = {
+        "matcher": build_abbr_matcher(preferred_expansions, get_do_not_expand(choice_type)),
+        "do_not_expand": get_do_not_expand(choice_type),
+        "tags": CHOICE_TAGS[choice_type],
+        "lookup": preferred_expansions
+    }
+    header = ABBR_INDEX_MAGIC + " " + ABBR_INDEX_FORMAT + " " + source_hash + "\n"
+    # write via a temporary file, so that a script loading the
+    # index at the same time never reads a half-written file
+    temp_filename = index_filename + "." + str(os.getpid()) + ".tmp"
+    with open(temp_filename, "wb") as output_file:
+        output_file.write(header.encode("ascii"))
+        pickle.dump(abbr_index, output_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_filename, index_filename)
+    print("Index written to file", index_filename)
+    return abbr_index
+
+# load the index: the header line is read and checked first,
+# and the pickle is then loaded straight from the file
+# if the index is missing, has another format version or was
+# built from another version of the dictionary: rebuild it
+def load_abbr_index(dictionary_filename, index_filename, choice_type="abbr"):
+    source_hash = hash_abbr_source(dictionary_filename, choice_type)
+    expected_header = ABBR_INDEX_MAGIC + " " + ABBR_INDEX_FORMAT + " " + source_hash + "\n"
+    if os.path.exists(index_filename) and os.path.getsize(index_filename) > len(expected_header):
+        with open(index_filename, "rb") as index_file:
+            if index_file.readline() == expected_header.encode("ascii"):
+                return pickle.load(index_file)
+    return write_abbr_index(dictionary_filename, index_filename, choice_type)
@@ -0,0 +1,52 @@
+# This module keeps an index of where each abbreviation (and
+# each correction and regularization) occurs in the corpus:
+# the file, line and column of every <choice> found by
+# create_abbr_dictionary.py when harvesting the corpus.
+# So when an expansion in the dictionary is corrected, the files
+# containing the abbreviation can be looked up instead of going
+# through the whole corpus (see reexpand_abbreviations.py).
+
+# The index is a local SQLite database. It's kept up to date by
+# the incremental harvest: the occurrences of a file are replaced
+# whenever the file has changed, and removed with the file.
+
+import sqlite3
+
+# open the index, creating the table if it doesn't exist yet
+# lines and columns start from 1
+def open_occurrence_index(index_filename):
+    connection = sqlite3.connect(index_filename)
+    connection.execute("CREATE TABLE IF NOT EXISTS occurrences (choice_type TEXT, original TEXT, replacement TEXT, file TEXT, line INTEGER, column INTEGER)")
+    connection.execute("CREATE INDEX IF NOT EXISTS occurrences_by_original ON occurrences (choice_type, original, replacement)")
+    connection.execute("CREATE INDEX IF NOT EXISTS occurrences_by_file ON occurrences (file)")
+    return connection
+
+def clear_occurrences(connection):
+    connection.execute("DELETE FROM occurrences")
+
+def remove_file_occurrences(connection, file_path):
+    connection.execute("DELETE FROM occurrences WHERE file = ?", (file_path,))
+
+# replace the occurrences recorded for a file
+# occurrences is a list of [type, original, replacement, line, column]
+def set_file_occurrences(connection, file_path, occurrences):
+    remove_file_occurrences(connection, file_path)
+    connection.executemany("INSERT INTO occurrences VALUES (?, ?, ?, ?, ?, ?)", [(choice_type, original, replacement, file_path, line, column) for choice_type, original, replacement, line, column in occurrences])
+
+# where an abbreviation occurs, optionally only with
+# a certain expansion, as (file, line, column, expansion)
+def find_occurrences(connection, original, replacement=None, choice_type="abbr"):
+    if replacement is None:
+        cursor = connection.execute("SELECT file, line, column, replacement FROM occurrences WHERE choice_type = ? AND original = ? ORDER BY file, line, column", (choice_type, original))
+    else:
+        cursor = connection.execute("SELECT file, line, column, replacement FROM occurrences WHERE choice_type = ? AND original = ? AND replacement = ? ORDER BY file, line, column", (choice_type, original, replacement))
+    return cursor.fetchall()
+
+# which files use an abbreviation, optionally only
+# with a certain expansion
+def find_files(connection, original, replacement=None, choice_type="abbr"):
+    files = []
+    for file_path, line, column, found_replacement in find_occurrences(connection, original, replacement, choice_type):
+        if len(files) == 0 or files[-1] != file_path:
+            files.append(file_path)
+    return files
@@ -12,134 +12,453 @@
 # well-formed (matches contained context that didn't take XML
 # into consideration, so tags/attributes/values were chopped off 
 # right in the middle, or opening/closing tags were missing). 
-# So this script first makes a new XML file containing only
-# matches and well-formed XML.
+# So this script reads the match list a line at a time and
+# picks out only the matches, which are well-formed XML.
 
 # With BeautifulSoup we can then get the contents of <abbr> and <expan>
-# and create the dictionary.
+# and add them to the dictionary. The matches are parsed in batches,
+# so memory use stays the same however long the match list is.
 
-# This script can also easily be modified into e.g. making a
-# dictionary of editors' corrections (in TEI XML encoded as
-# <choice><orig>Docton</orig><corr>Doctor</corr></choice> or
-# <choice><orig>e. g.</orig><reg>e.g.</reg></choice>).
+# The editors' corrections and regularizations (in TEI XML encoded
+# as <choice><orig>Docton</orig><corr>Doctor</corr></choice> and
+# <choice><orig>e. g.</orig><reg>e.g.</reg></choice>) are collected
+# at the same time, in the same pass over the match list or the
+# corpus, into dictionaries of their own. Everything said below about
+# abbreviations and expansions goes for them too. The types of
+# dictionaries are listed in DICTIONARIES (see also CHOICE_TAGS
+# in abbr_matcher.py).
+
+# The dictionary maps each abbreviation to a list of
+# [expansion, count] pairs, the most frequent expansion first.
+# The pairs are counted in a dict of dicts while going through
+# the matches, so adding a pair takes the same time however many
+# expansions an abbreviation has, and none of them are dropped.
+# The expansion used by transform_xml.py is the first one.
 
 # Once the dictionary has been created: if there are multiple
-# expansions for an abbreviation, these should be checked manually.
+# expansions for an abbreviation, these should be checked manually
+# and the right one moved to the top of the list if needed.
 # When that is done, use option UPDATE_DICTIONARY to tidy up
 # the existing dict and create the final product.
 
+# Instead of a match list, the dictionary can be harvested
+# straight from the project's TEI files (option HARVEST_CORPUS):
+# the files in CORPUS_FOLDER and its subfolders are divided
+# between the workers of a process pool, each worker counts the
+# abbreviation - expansion pairs in its files, and the counts
+# are then merged into the dictionary just like for the match list.
+
+# With option INCREMENTAL the pairs found in each file of the
+# corpus are recorded in CONTRIBUTIONS_FILE together with the
+# hash of the file. On the next run only files that have changed
+# (or are new) are harvested again: their old pairs are subtracted
+# from the existing dictionary and the new ones added, and the pairs
+# of removed files are subtracted. So the manual checking done with
+# UPDATE_DICTIONARY is kept: the expansion at the top of the list
+# stays there as long as it's found in the corpus, and alternatives
+# that have been removed only come back if they're found in the
+# changed files more often than before. If there is no
+# contributions file yet, the whole corpus is harvested and
+# the existing dictionary updated with it the same way, so the
+# checked expansions stay first and entries only added while
+# checking are kept. Only a dictionary that doesn't exist
+# yet is built from scratch.
+# The incremental harvest also keeps an index of the file, line and
+# column of every <choice> in OCCURRENCE_INDEX (see abbr_occurrences.py),
+# so the files using an abbreviation can be found without
+# going through the whole corpus.
+
+# Each time a dictionary is written, the compiled index used
+# by transform_xml.py is written too (see abbr_matcher.py).
+
 import re
+import os
+import hashlib
+from pathlib import Path
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from bs4 import BeautifulSoup
 import json
+from abbr_matcher import write_abbr_index, read_abbr_dictionary, CHOICE_TAGS
+from abbr_occurrences import open_occurrence_index, clear_occurrences, remove_file_occurrences, set_file_occurrences
 
 SOURCE_FILE = "documents/abbr/match_list.xml"
-OUTPUT_FILE = "documents/expan/abbr_and_expan.xml"
 ABBR_DICTIONARY = "dictionaries/abbr_dictionary.json"
+# the compiled index used by transform_xml.py
+ABBR_INDEX = "dictionaries/abbr_index.bin"
+CORR_DICTIONARY = "dictionaries/corr_dictionary.json"
+CORR_INDEX = "dictionaries/corr_index.bin"
+REG_DICTIONARY = "dictionaries/reg_dictionary.json"
+REG_INDEX = "dictionaries/reg_index.bin"
+# the type of each dictionary (see CHOICE_TAGS in abbr_matcher.py)
+# and its dictionary and index files
+DICTIONARIES = {
+    "abbr": (ABBR_DICTIONARY, ABBR_INDEX),
+    "corr": (CORR_DICTIONARY, CORR_INDEX),
+    "reg": (REG_DICTIONARY, REG_INDEX)
+}
 UPDATE_DICTIONARY = False
+# if True: harvest the abbreviations and expansions from all
+# the TEI files in CORPUS_FOLDER instead of the match list
+HARVEST_CORPUS = False
+CORPUS_FOLDER = "documents/xml"
+# if True: only harvest files that have changed since the last
+# run and update the existing dictionary with them
+INCREMENTAL = False
+# the pairs found in each file of the corpus
+CONTRIBUTIONS_FILE = "dictionaries/choice_contributions.json"
+# where each abbreviation etc. occurs in the corpus
+OCCURRENCE_INDEX = "dictionaries/choice_occurrences.sqlite"
+WORKERS = os.cpu_count()
+# number of files handled by a worker at a time
+FILES_PER_TASK = 100
+# a <choice> containing two of these elements in either order
+CHOICE_PATTERN = re.compile(r"<choice><(abbr|expan|orig|corr|reg)>.*?</\1><(abbr|expan|orig|corr|reg)>.*?</\2></choice>")
+# number of matches made into a soup object at a time
+MATCHES_PER_BATCH = 1000
 
-# read an xml file and return its content
-# either as a string or as as a soup object
-# depending on what it's going to be used for
-def read_xml(filename):
-    with open (filename, "r", encoding="utf-8-sig") as source_file:
-        file_content = source_file.read()
-        if filename == OUTPUT_FILE:
-            abbr_soup = BeautifulSoup(file_content, "xml")
-            print("We have soup.")
-            return abbr_soup
-        else:
-            return file_content
-
-# find all <choice> containing both <abbr> and <expan>
+# find all <choice> containing e.g. both <abbr> and <expan>
 # in the match list which also contains lots of other stuff
-def find_abbr_and_expan(file_content):
-    search_string = re.compile(r"<choice><abbr>.*?</abbr><expan>.*?</expan></choice>|<choice><expan>.*?</expan><abbr>.*?</abbr></choice>")
-    match_string = re.findall(search_string, file_content)
-    # the result is a list of strings
-    # join them with a newline as separator for each match
-    abbr_string = "\n"
-    return abbr_string.join(match_string)
-
-# create a new xml file containing only
-# all the relevant <choice> elements
-# this is the file we'll use when making the dictionary
-def write_to_file(abbr_string, filename):
-    with open(filename, "w", encoding="utf-8-sig") as output_file:
-        output_file.write("<body>")
-        output_file.write(abbr_string)
-        output_file.write("</body>")
-        output_file.close()
-        print("Abbreviations and expansions written to file", filename)
-
-# create the dictionary of abbreviations and their expansions
-def create_abbr_dictionary(abbr_soup, abbr_dict):
-    # go through each <choice> and its children <abbr> and <expan>
-    choices = abbr_soup.find_all("choice")
-    # just checking that every <choice> in the xml file
-    # is actually used for the dictionary, hence the counter
+# the matches never span several lines, so the file can be
+# read a line at a time and the matches yielded as they're found,
+# together with their line and column (both starting from 1)
+def find_choices(lines):
+    line_number = 0
+    for line in lines:
+        line_number += 1
+        for match_string in CHOICE_PATTERN.finditer(line):
+            yield line_number, match_string.start() + 1, match_string.group()
+
+# get the type of a <choice> and the contents of its
+# original (<abbr> or <orig>) and replacement (<expan>,
+# <corr> or <reg>), or None if it isn't one of the types
+# we can't just use .get_text() for getting the abbr contents,
+# because we need to preserve all the tags inside abbr,
+# such as <hi> (get_text only returns string content)
+# the contents of <expan> etc. contain no tags
+# so just get the string
+def get_choice_pair(choice):
+    children = {child.name: child for child in choice.children if child.name is not None}
+    for choice_type, (original_tag, replacement_tag) in CHOICE_TAGS.items():
+        if choice_type in DICTIONARIES and original_tag in children and replacement_tag in children:
+            return choice_type, children[original_tag].decode_contents(), children[replacement_tag].get_text()
+    return None
+
+# the match list isn't well-formed XML as a whole, but each
+# match is, so the matches are made into a soup object a batch
+# at a time and the (type, original, replacement) triples
+# yielded one by one with the line and column of the match
+# each match is one <choice> directly inside <body>
+def parse_choices(match_list):
+    if len(match_list) == 0:
+        return
+    abbr_soup = BeautifulSoup("<body>" + "\n".join(match_string for line_number, column, match_string in match_list) + "</body>", "xml")
+    choices = abbr_soup.find("body").find_all("choice", recursive=False)
+    for (line_number, column, match_string), choice in zip(match_list, choices):
+        choice_pair = get_choice_pair(choice)
+        if choice_pair is not None:
+            yield choice_pair, line_number, column
+
+# yield all the (type, original, replacement) triples in lines
+# of text, e.g. an open file, and where they occur, without
+# keeping more than a batch of matches in memory at a time
+def iter_choice_occurrences(lines):
+    match_list = []
+    for match in find_choices(lines):
+        match_list.append(match)
+        if len(match_list) == MATCHES_PER_BATCH:
+            yield from parse_choices(match_list)
+            match_list = []
+    yield from parse_choices(match_list)
+
+# the same without the lines and columns
+def iter_choices(lines):
+    for choice_pair, line_number, column in iter_choice_occurrences(lines):
+        yield choice_pair
+
+# add an abbreviation - expansion pair to the counts,
+# which are a dict of abbr -> {expan: count}
+# the same abbr may have several expans, e.g.
+# B.C. = "Before Christ" or "British Columbia"
+# and they are all kept with the number of times they've
+# been found, so they can be checked later in order
+# to decide which of them to keep
+def add_to_abbr_dictionary(abbr_counts, abbr_content, expan_content, count=1):
+    expan_counts = abbr_counts.setdefault(abbr_content, {})
+    expan_counts[expan_content] = expan_counts.get(expan_content, 0) + count
+
+# the counts of all the types of dictionaries are kept in
+# a dict of type -> {abbr: {expan: count}}
+def add_to_choice_counts(choice_counts, choice_type, abbr_content, expan_content, count=1):
+    add_to_abbr_dictionary(choice_counts.setdefault(choice_type, {}), abbr_content, expan_content, count)
+
+# create the dictionaries of abbreviations and their expansions
+# (and the other types), the pairs are added one at a time as they come
+def create_dictionaries(choice_pairs, choice_counts):
+    # just checking that every <choice> in the match list
+    # is actually used for the dictionaries, hence the counter
     i = 0
-    for choice in choices:
-        for child in choice.children:
-            # we can't just use .get_text() for getting the abbr contents,
-            # because we need to preserve all the tags inside abbr,
-            # such as <hi> (get_text only returns string content)
-            # also, we can't use BS methods such as .unwrap() since the
-            # variable abbr is no longer part of the parse tree
-            # but ordinary replacement will do just as well
-            # (just have to convert it from a BS tag object into a string first)
-            # and we end up with the contents of <abbr>, both tags and strings
-            if child.name == "abbr":
-                abbr = child
-                abbr_content = str(abbr)
-                abbr_content = abbr_content.replace("<abbr>", "")
-                abbr_content = abbr_content.replace("</abbr>", "")
-            # the contents of <expan> contain no tags
-            # so just get the string
-            if child.name == "expan":
-                expan_content = child.get_text()
-                expan_content = str(expan_content)
-        # now we have an abbreviation - expansion pair
+    for choice_type, abbr_content, expan_content in choice_pairs:
         i += 1
-        # if this abbreviation already exists in the dictionary:
-        # check if the expansion we just found also exists
-        # if it does, there's nothing to add
-        # else: keep checking the expan, and if our expan
-        # is a new one, add it to the dict
-        # the same abbr may have several expans, e.g.
-        # B.C. = "Before Christ" or "British Columbia"
-        # since abbr is the key, we have to add _1 etc. to it
-        # in order to be able to record new expans for it
-        # these multiple expans should be checked later
-        # in order to decide which of them to keep
-        if abbr_content in abbr_dict.keys():
-            expan = abbr_dict.get(abbr_content)
-            if expan == expan_content:
-                continue
-            else:
-                x = 1
-                while x < 5:
-                    abbr_content = abbr_content + "_" + str(x)
-                    if abbr_content in abbr_dict.keys():
-                        expan = abbr_dict.get(abbr_content)
-                        if expan == expan_content:
-                            break
-                        else:
-                            x += 1
-                            search_string = re.compile(r"_\d")
-                            abbr_content = search_string.sub("", abbr_content)
-                    else:
-                        abbr_dict.update({abbr_content: expan_content})
-                        break
-        # if this abbreviation isn't in the dict: add it
-        else:
-            abbr_dict.update({abbr_content: expan_content})
+        add_to_choice_counts(choice_counts, choice_type, abbr_content, expan_content)
     print(i)
+    return create_dictionaries_from_counts(choice_counts)
+
+# count the (type, original, replacement) triples in some
+# of the files of the corpus, this is what each worker does
+# the same regex as for the match list finds the <choice>
+# elements, so only they have to be parsed, not the whole files
+def count_choices(file_list):
+    pair_counts = Counter()
+    for file_path in file_list:
+        with open(file_path, "r", encoding="utf-8-sig") as source_file:
+            for choice_pair in iter_choices(source_file):
+                pair_counts[choice_pair] += 1
+    return pair_counts
+
+# harvest some of the files of the corpus one by one for the
+# incremental mode, this is what each worker does
+# each file is read once, both for hashing it and for finding
+# the pairs, and its size and modification time are recorded
+# so that unchanged files don't even have to be read next time
+# the occurrences of the pairs go into the occurrence index
+# instead of the record
+def harvest_contributions(file_list):
+    contributions = []
+    for file_path in file_list:
+        file_stat = os.stat(file_path)
+        with open(file_path, "rb") as source_file:
+            file_content = source_file.read()
+        file_hash = hashlib.sha1(file_content).hexdigest()
+        lines = file_content.decode("utf-8-sig").splitlines()
+        pair_counts = Counter()
+        occurrences = []
+        for (choice_type, abbr_content, expan_content), line_number, column in iter_choice_occurrences(lines):
+            pair_counts[(choice_type, abbr_content, expan_content)] += 1
+            occurrences.append([choice_type, abbr_content, expan_content, line_number, column])
+        pairs = [[choice_type, abbr_content, expan_content, count] for (choice_type, abbr_content, expan_content), count in pair_counts.items()]
+        contributions.append((file_path, {"size": file_stat.st_size, "mtime": file_stat.st_mtime_ns, "hash": file_hash, "pairs": pairs}, occurrences))
+    return contributions
+
+# go through the whole corpus with a process pool and merge the
+# counts of the workers into a dict of type -> {abbr: {expan: count}}
+def harvest_corpus():
+    file_list = [str(file_path) for file_path in sorted(Path(CORPUS_FOLDER).rglob("*.xml"))]
+    tasks = [file_list[i:i + FILES_PER_TASK] for i in range(0, len(file_list), FILES_PER_TASK)]
+    pair_counts = Counter()
+    with ProcessPoolExecutor(max_workers=WORKERS) as executor:
+        for task_counts in executor.map(count_choices, tasks):
+            pair_counts.update(task_counts)
+    choice_counts = {}
+    for (choice_type, abbr_content, expan_content), count in pair_counts.items():
+        add_to_choice_counts(choice_counts, choice_type, abbr_content, expan_content, count)
+    print(str(sum(pair_counts.values())) + " choices found in " + str(len(file_list)) + " files.")
+    return choice_counts
+
+# rank the expansions of an abbreviation as [expansion, count]
+# pairs, the most common first (expansions found equally often
+# stay in the order they were found)
+def rank_expansions(expan_counts):
+    expans = sorted(expan_counts.items(), key = lambda item: -item[1])
+    return [[expan_content, count] for expan_content, count in expans]
+
+# create the dictionary out of the counts: each abbr gets
+# its ranked list of expansions, and the first one is the one
+# used, while the others can be checked manually
+def create_abbr_dictionary_from_counts(abbr_counts):
+    abbr_dict = {}
+    for abbr_content, expan_counts in abbr_counts.items():
+        abbr_dict[abbr_content] = rank_expansions(expan_counts)
     # sort dict by key (NB with this method uppercase and lowercase 
     # are sorted separately)
     sorted_abbr_dict = sorted(abbr_dict.items(), key = lambda item: item[0])
     sorted_abbr_dict = dict(sorted_abbr_dict)
     return sorted_abbr_dict
 
+# create the dictionaries out of the counts
+# a type that wasn't found at all only gets an empty dictionary
+# if it doesn't have one yet, e.g. a match list of abbreviations
+# mustn't replace the checked corrections and regularizations
+def create_dictionaries_from_counts(choice_counts):
+    dictionaries = {}
+    for choice_type, (dictionary_file, index_file) in DICTIONARIES.items():
+        if choice_type not in choice_counts and os.path.exists(dictionary_file):
+            print("No pairs of type " + choice_type + " found, " + dictionary_file + " left as it is.")
+            continue
+        dictionaries[choice_type] = create_abbr_dictionary_from_counts(choice_counts.get(choice_type, {}))
+    return dictionaries
+
+# add the pairs of a file to the changes to be made
+# to the dictionaries, or subtract them if sign is -1
+def add_contribution(choice_changes, pairs, sign):
+    for choice_type, abbr_content, expan_content, count in pairs:
+        add_to_choice_counts(choice_changes, choice_type, abbr_content, expan_content, sign * count)
+
+# get the recorded contributions of the files of the corpus
+# if they're missing, or were recorded for another corpus
+# folder or other types of dictionaries, the whole corpus
+# has to be harvested again
+def read_contributions():
+    if not os.path.exists(CONTRIBUTIONS_FILE) or not os.path.exists(OCCURRENCE_INDEX):
+        return None
+    with open(CONTRIBUTIONS_FILE, encoding="utf-8") as source_file:
+        contributions = json.load(source_file)
+    if contributions.get("corpus_folder") != CORPUS_FOLDER or contributions.get("choice_types") != list(DICTIONARIES):
+        return None
+    return contributions
+
+# save the contributions via a temporary file, so that
+# an interrupted run doesn't leave a half-written file
+def write_contributions(contributions):
+    temp_filename = CONTRIBUTIONS_FILE + ".tmp"
+    with open(temp_filename, "w", encoding="utf-8") as output_file:
+        json.dump(contributions, output_file, ensure_ascii=False)
+    os.replace(temp_filename, CONTRIBUTIONS_FILE)
+    print("Contributions written to file", CONTRIBUTIONS_FILE)
+
+# a dictionary built some other way doesn't match the recorded
+# contributions any longer, so the next incremental run has to
+# start from scratch
+def remove_contributions():
+    if os.path.exists(CONTRIBUTIONS_FILE):
+        os.remove(CONTRIBUTIONS_FILE)
+
+# harvest the files that are new or have changed since the last
+# run (according to their size and modification time) with a
+# process pool, and return the changes to the dictionaries as a dict
+# of type -> {abbr: {expan: count change}}, updating the file records
+# a file that has been touched but whose content hasn't changed
+# has the same hash, so its pairs are left as they are
+# the occurrence index is updated along with the records
+def harvest_changed_files(file_records, connection):
+    file_list = [str(file_path) for file_path in sorted(Path(CORPUS_FOLDER).rglob("*.xml"))]
+    choice_changes = {}
+    removed_files = set(file_records) - set(file_list)
+    for file_path in sorted(removed_files):
+        add_contribution(choice_changes, file_records.pop(file_path)["pairs"], -1)
+        remove_file_occurrences(connection, file_path)
+    changed_files = []
+    for file_path in file_list:
+        file_stat = os.stat(file_path)
+        file_record = file_records.get(file_path)
+        if file_record is None or file_record["size"] != file_stat.st_size or file_record["mtime"] != file_stat.st_mtime_ns:
+            changed_files.append(file_path)
+    tasks = [changed_files[i:i + FILES_PER_TASK] for i in range(0, len(changed_files), FILES_PER_TASK)]
+    updated_files = 0
+    with ProcessPoolExecutor(max_workers=WORKERS) as executor:
+        for task_contributions in executor.map(harvest_contributions, tasks):
+            for file_path, new_record, occurrences in task_contributions:
+                old_record = file_records.get(file_path)
+                file_records[file_path] = new_record
+                if old_record is not None and old_record["hash"] == new_record["hash"]:
+                    continue
+                if old_record is not None:
+                    add_contribution(choice_changes, old_record["pairs"], -1)
+                add_contribution(choice_changes, new_record["pairs"], 1)
+                set_file_occurrences(connection, file_path, occurrences)
+                updated_files += 1
+    print(str(updated_files) + " changed and " + str(len(removed_files)) + " removed files out of " + str(len(file_list)) + " files.")
+    return choice_changes
+
+# apply the changes to the expansions of the dictionary
+# the expansion at the top of the list may have been chosen
+# while checking the dictionary, so it stays there as long as
+# it's found at all, and the rest are ranked anew
+# an expansion that isn't in the list any longer (because it
+# was removed while checking) is only added again if the change
+# is positive, and an expansion is only removed when its count
+# drops to 0 because the files it was found in have changed
+# an expansion with the count 0, i.e. one added by hand or read
+# from a dictionary in the old format, has never been found in
+# the corpus, so it's always kept
+# new abbrs are added at the end, since the existing ones
+# may have been sorted by update_dictionary
+def update_abbr_dictionary(abbr_dict, abbr_changes):
+    for abbr_content, expan_changes in abbr_changes.items():
+        expansions = abbr_dict.get(abbr_content, [])
+        expan_counts = {expan_content: count for expan_content, count in expansions}
+        for expan_content, change in expan_changes.items():
+            old_count = expan_counts.get(expan_content)
+            if old_count is None:
+                if change > 0:
+                    expan_counts[expan_content] = change
+            elif old_count > 0 and old_count + change <= 0:
+                del expan_counts[expan_content]
+            else:
+                expan_counts[expan_content] = max(old_count + change, 0)
+        if len(expan_counts) == 0:
+            abbr_dict.pop(abbr_content, None)
+            continue
+        if len(expansions) > 0 and expansions[0][0] in expan_counts:
+            first_expan = expansions[0][0]
+            first_count = expan_counts.pop(first_expan)
+            abbr_dict[abbr_content] = [[first_expan, first_count]] + rank_expansions(expan_counts)
+        else:
+            abbr_dict[abbr_content] = rank_expansions(expan_counts)
+    return abbr_dict
+
+# the counts of all the pairs recorded for the corpus,
+# for building a dictionary that doesn't exist yet
+def count_recorded_pairs(file_records):
+    choice_counts = {}
+    for file_record in file_records.values():
+        add_contribution(choice_counts, file_record["pairs"], 1)
+    return choice_counts
+
+# the changes that give the expansions of an existing dictionary
+# the counts found in the whole corpus, when the contributions
+# are recorded for the first time
+# expansions that aren't found in the corpus are left as they
+# are, since they may have been added while checking
+def get_seed_changes(abbr_dict, abbr_counts):
+    abbr_changes = {}
+    for abbr_content, expan_counts in abbr_counts.items():
+        old_counts = {expan_content: count for expan_content, count in abbr_dict.get(abbr_content, [])}
+        abbr_changes[abbr_content] = {expan_content: count - old_counts.get(expan_content, 0) for expan_content, count in expan_counts.items()}
+    return abbr_changes
+
+# update the dictionaries with the files that have changed
+# since the last run
+# without any recorded contributions the whole corpus is
+# harvested and the existing dictionaries updated with it,
+# so the manual checking isn't lost
+# a dictionary that doesn't exist is built from scratch
+def harvest_corpus_incrementally(contributions, connection):
+    seeding = contributions is None
+    if seeding:
+        print("No contributions recorded, harvesting the whole corpus.")
+        contributions = {"corpus_folder": CORPUS_FOLDER, "choice_types": list(DICTIONARIES), "files": {}}
+        clear_occurrences(connection)
+    choice_changes = harvest_changed_files(contributions["files"], connection)
+    dictionaries = {}
+    for choice_type, (dictionary_file, index_file) in DICTIONARIES.items():
+        if not os.path.exists(dictionary_file):
+            choice_counts = count_recorded_pairs(contributions["files"])
+            dictionaries[choice_type] = create_abbr_dictionary_from_counts(choice_counts.get(choice_type, {}))
+            continue
+        abbr_dict = read_abbr_dictionary(dictionary_file)
+        abbr_changes = choice_changes.get(choice_type, {})
+        if seeding:
+            abbr_changes = get_seed_changes(abbr_dict, abbr_changes)
+        dictionaries[choice_type] = update_abbr_dictionary(abbr_dict, abbr_changes)
+    return dictionaries, contributions
+
+# the whole incremental update: the dictionaries, their indexes,
+# the contributions and the occurrence index
+# the occurrences are committed before the contributions are
+# written, since replacing the occurrences of a file again
+# on the next run does no harm
+def update_dictionaries_from_corpus():
+    contributions = read_contributions()
+    connection = open_occurrence_index(OCCURRENCE_INDEX)
+    try:
+        dictionaries, contributions = harvest_corpus_incrementally(contributions, connection)
+        write_dictionaries(dictionaries)
+        connection.commit()
+        write_contributions(contributions)
+    finally:
+        connection.close()
+
 # save dictionary as a file
 def write_dict_to_file(dictionary, filename):
     json_dict = json.dumps(dictionary, ensure_ascii=False)
@@ -147,51 +466,66 @@ def write_dict_to_file(dictionary, filename):
         output_file.write(json_dict)
         print("Dictionary written to file", filename)
 
-# get dictionary content from file
-def read_dict_from_file(filename):
-    with open(filename, encoding="utf-8-sig") as source_file:
-        json_content = json.load(source_file)
-        return json_content
-
-# remove entries containing underscore + a digit
-# they represent alternative expansions for an abbreviation
-# and were added when the dict was originally created
-# but if they have been checked there's no need to keep them
-# in the dictionary any longer
+# save the dictionaries and their indexes, the types
+# missing from dictionaries are left as they are
+def write_dictionaries(dictionaries):
+    for choice_type, (dictionary_file, index_file) in DICTIONARIES.items():
+        if choice_type not in dictionaries:
+            continue
+        write_dict_to_file(dictionaries[choice_type], dictionary_file)
+        write_abbr_index(dictionary_file, index_file, choice_type)
+
+# keep only the first expansion of each abbreviation
+# the others are alternative expansions which were added
+# when the dict was originally created, but if they have
+# been checked there's no need to keep them in the
+# dictionary any longer
+# abbreviations whose expansions have all been removed
+# while checking are left out
 def update_dictionary(dictionary_to_update):
-    max_digit = 4
-    for digit in range(1, max_digit + 1):
-            char_to_check = f"_{digit}"
-            keys_to_remove = [key for key in dictionary_to_update if char_to_check in key]
-            for key in keys_to_remove:
-                del dictionary_to_update[key]
+    for abbr_content in list(dictionary_to_update):
+        expansions = dictionary_to_update[abbr_content]
+        if len(expansions) == 0:
+            del dictionary_to_update[abbr_content]
+        else:
+            dictionary_to_update[abbr_content] = expansions[:1]
     # sort dict by key, ignore case
     sorted_updated_dict = sorted(dictionary_to_update.items(), key = lambda item: item[0].casefold())
     sorted_updated_dict = dict(sorted_updated_dict)
     return sorted_updated_dict
 
 def main():
-    # create a dictionary of abbreviations and expansions
+    # create the dictionaries of abbreviations and expansions etc.
     # afterwards: go through alternative expansions manually
     # and decide which of them to keep
-    if not UPDATE_DICTIONARY:
-        # read the match list
-        file_content = read_xml(SOURCE_FILE)
-        # find the abbreviations and their expansions
-        abbr_string = find_abbr_and_expan(file_content)
-        # save the abbr - expan pairs
-        write_to_file(abbr_string, OUTPUT_FILE)
-        # make the newly created file into a soup object
-        abbr_soup = read_xml(OUTPUT_FILE)
-        abbr_dict = {}
-        # create and sort the dictionary
-        sorted_abbr_dict = create_abbr_dictionary(abbr_soup, abbr_dict)
-        write_dict_to_file(sorted_abbr_dict, ABBR_DICTIONARY)
-    # tidy up and sort the dictionary anew once it's been manually checked
+    if not UPDATE_DICTIONARY and HARVEST_CORPUS and INCREMENTAL:
+        update_dictionaries_from_corpus()
+    elif not UPDATE_DICTIONARY and HARVEST_CORPUS:
+        choice_counts = harvest_corpus()
+        dictionaries = create_dictionaries_from_counts(choice_counts)
+        write_dictionaries(dictionaries)
+        remove_contributions()
+    elif not UPDATE_DICTIONARY:
+        # read the match list a line at a time, find the
+        # abbreviations and their expansions etc. and create
+        # and sort the dictionaries
+        choice_counts = {}
+        with open(SOURCE_FILE, "r", encoding="utf-8-sig") as source_file:
+            dictionaries = create_dictionaries(iter_choices(source_file), choice_counts)
+        write_dictionaries(dictionaries)
+        remove_contributions()
+    # tidy up and sort the dictionaries anew once they've been manually checked
     else:
-        dictionary_to_update = read_dict_from_file(ABBR_DICTIONARY)
-        # create and sort the new and updated dictionary
-        sorted_updated_dict = update_dictionary(dictionary_to_update)
-        write_dict_to_file(sorted_updated_dict, ABBR_DICTIONARY)
+        for choice_type, (dictionary_file, index_file) in DICTIONARIES.items():
+            if not os.path.exists(dictionary_file):
+                continue
+            dictionary_to_update = read_abbr_dictionary(dictionary_file)
+            # create and sort the new and updated dictionary
+            sorted_updated_dict = update_dictionary(dictionary_to_update)
+            write_dict_to_file(sorted_updated_dict, dictionary_file)
+            write_abbr_index(dictionary_file, index_file, choice_type)
 
-main()
\ No newline at end of file
+# the guard is needed by the process pool on platforms
+# where worker processes import this module anew
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+# This script exports the whole edition as a machine-readable
+# corpus for NLP research: one JSON record per paragraph
+# (or per sentence) in JSONL files, with the publication id,
+# language, text type ("est" or "ms"), the path of the <div>
+# the paragraph belongs to and the page number from <pb/>.
+
+# The text of the records is produced by the same rules as
+# the downloadable TXT (transform_downloadable_txt.py), but
+# instead of flattening the whole document into one string,
+# paragraph boundaries and page breaks are kept track of.
+# This is done by inserting markers into the document before
+# the TXT transformation and splitting the result at them.
+
+# The files are divided into shards of SHARD_SIZE files, and
+# each shard is transformed by a process pool worker and written
+# as its own JSONL file. A manifest records the finished shards
+# and the size and modification time of their files, so an
+# interrupted export can just be run again and will only redo
+# the shards that are missing or whose files have changed.
+# The files that failed are listed in the manifest too, and
+# their shards aren't marked as finished, so they're retried.
+
+# Just like transform_downloadable_txt.py, this script is meant
+# to be run alongside the website's version of the transformation
+# scripts (python -m src.export_corpus).
+
+import re
+import os
+import json
+import html
+import time
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import src.transform_downloadable_xml as transform_downloadable_xml
+from src.transform_downloadable_txt import create_html_soup, transform_elements, tidy_up_txt
+
+SOURCE_FOLDER = "documents/xml"
+OUTPUT_FOLDER = "documents/corpus"
+MANIFEST_FILE = "manifest.json"
+# the text types to export each file as
+EST_OR_MS = ["est"]
+# if True: one record per sentence instead of per paragraph
+SPLIT_SENTENCES = False
+# number of files per JSONL file
+SHARD_SIZE = 200
+WORKERS = os.cpu_count()
+
+# the paragraph-like elements, i.e. the ones the TXT
+# transformation separates with a space when unwrapping them
+PARAGRAPH_ELEMENTS = [
+    "address",
+    "cell",
+    "dateline",
+    "head",
+    "item",
+    "l",
+    "p",
+    "salute",
+    "signed"
+]
+# markers for the start of a paragraph and for a page break,
+# characters from the Private Use Area which won't be
+# present in the texts and aren't touched by the TXT rules
+PARAGRAPH_MARKER = "\ue001"
+PAGE_MARKER = "\ue003"
+END_MARKER = "\ue002"
+MARKER_PATTERN = re.compile("\ue001(\\d*)\ue002|\ue003(.*?)\ue002")
+# a sentence ends with a full stop, question mark or exclamation
+# mark followed by a word starting with an uppercase letter
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+(?=[”’(]?[A-ZÅÄÖÜ])")
+
+# read_xml reads files relative to its SOURCE_FOLDER
+transform_downloadable_xml.SOURCE_FOLDER = SOURCE_FOLDER
+
+# loop through the source folder recursively and
+# list the xml files relative to it
+def get_source_file_paths():
+    source_folder = Path(SOURCE_FOLDER)
+    file_list = []
+    for file_path in source_folder.rglob("*.xml"):
+        file_list.append(file_path.relative_to(source_folder).as_posix())
+    file_list.sort()
+    return file_list
+
+# publication_id and language are present in the file name
+def extract_info_from_filename(filename):
+    search_string = re.compile(r"(\w{2})_(\d+)$")
+    match = re.search(search_string, Path(filename).stem)
+    if match is None:
+        return None, None
+    language = match.group(1)
+    publication_id = match.group(2)
+    return publication_id, language
+
+# the path of each <div>, made out of the positions of
+# the div and its ancestor divs among their sibling divs,
+# e.g. "1/3" for the third div in the first top-level div
+def create_div_paths(xml_soup):
+    div_paths = {}
+    div_counts = {}
+    for div in xml_soup.body.find_all("div"):
+        parent_div = div.find_parent("div")
+        if parent_div is None:
+            parent_path = ""
+        else:
+            parent_path = div_paths[id(parent_div)] + "/"
+        div_counts[parent_path] = div_counts.get(parent_path, 0) + 1
+        div_paths[id(div)] = parent_path + str(div_counts[parent_path])
+    return div_paths
+
+# insert a numbered marker at the start of each outermost
+# paragraph-like element and replace each <pb/> with a marker
+# containing its page number
+# return the info about each paragraph, in the order of the markers
+def insert_markers(xml_soup):
+    div_paths = create_div_paths(xml_soup)
+    paragraphs = []
+    for element in xml_soup.body.find_all(PARAGRAPH_ELEMENTS):
+        if element.find_parent(PARAGRAPH_ELEMENTS) is not None:
+            continue
+        parent_div = element.find_parent("div")
+        if parent_div is None:
+            div_path = ""
+        else:
+            div_path = div_paths[id(parent_div)]
+        element.insert(0, PARAGRAPH_MARKER + str(len(paragraphs)) + END_MARKER)
+        paragraphs.append({"element": element.name, "div_path": div_path})
+    for element in xml_soup.body.find_all("pb"):
+        if "n" in element.attrs:
+            element.replace_with(PAGE_MARKER + element["n"].replace(END_MARKER, "") + END_MARKER)
+        else:
+            element.decompose()
+    return paragraphs
+
+# the txt is a string with tags escaped, and a few
+# elements not handled by the TXT rules may be left
+# the corpus should contain plain text only
+def clean_text(text):
+    search_string = re.compile(r"<.*?>")
+    text = search_string.sub("", text)
+    return html.unescape(text)
+
+# split the transformed string at the markers
+# each paragraph gets its text and a list of
+# (offset in text, page number) for the page breaks
+def split_paragraphs(txt_string, paragraphs):
+    records = []
+    record = None
+    page = None
+    position = 0
+    # an empty paragraph marker at the end of the string
+    # makes sure the text of the last paragraph is added
+    for match in MARKER_PATTERN.finditer(txt_string + PARAGRAPH_MARKER + END_MARKER):
+        if record is not None:
+            text = clean_text(txt_string[position:match.start()])
+            if record["text"] == "" or record["text"].endswith(" "):
+                text = text.lstrip()
+            if text != "":
+                record["pages"].append((len(record["text"]), page))
+                record["text"] += text
+        position = match.end()
+        if match.group(1) is not None:
+            if match.group(1) == "":
+                break
+            record = dict(paragraphs[int(match.group(1))])
+            record["text"] = ""
+            record["pages"] = [(0, page)]
+            records.append(record)
+        else:
+            page = match.group(2)
+    return records
+
+# the page number at a certain position of the text
+def page_at(pages, offset):
+    page = None
+    for page_offset, page_value in pages:
+        if page_offset > offset:
+            break
+        page = page_value
+    return page
+
+# transform one file into records, using the TXT rules
+def create_records(filename, est_or_ms):
+    xml_soup = transform_downloadable_xml.read_xml(filename)
+    if xml_soup.body is None:
+        return []
+    paragraphs = insert_markers(xml_soup)
+    html_soup = create_html_soup(xml_soup)
+    html_soup = transform_elements(html_soup, est_or_ms)
+    html_string = str(html_soup.body)
+    search_string = re.compile(r"<body>|</body>")
+    html_string = search_string.sub("", html_string)
+    html_string = tidy_up_txt(html_string)
+    publication_id, language = extract_info_from_filename(filename)
+    records = []
+    paragraph_number = 0
+    for paragraph in split_paragraphs(html_string, paragraphs):
+        text = paragraph["text"].rstrip()
+        if text == "":
+            continue
+        paragraph_number += 1
+        record = {
+            "publication_id": publication_id,
+            "language": language,
+            "est_or_ms": est_or_ms,
+            "file": filename,
+            "div_path": paragraph["div_path"],
+            "element": paragraph["element"],
+            "paragraph": paragraph_number
+        }
+        if not SPLIT_SENTENCES:
+            record["page"] = page_at(paragraph["pages"], 0)
+            record["text"] = text
+            records.append(record)
+            continue
+        sentence_start = 0
+        sentence_number = 0
+        sentence_ends = [(match.start(), match.end()) for match in SENTENCE_PATTERN.finditer(text)]
+        # the last sentence runs to the end of the paragraph,
+        # whether it ends with punctuation or not
+        sentence_ends.append((len(text), len(text)))
+        for sentence_end, next_start in sentence_ends:
+            sentence = text[sentence_start:sentence_end]
+            if sentence != "":
+                sentence_number += 1
+                sentence_record = dict(record)
+                sentence_record["sentence"] = sentence_number
+                sentence_record["page"] = page_at(paragraph["pages"], sentence_start)
+                sentence_record["text"] = sentence
+                records.append(sentence_record)
+            sentence_start = next_start
+    return records
+
+# transform the files of one shard and write their records
+# to a JSONL file, via a temporary file so that an interrupted
+# export never leaves a half-written shard behind
+def export_shard(shard_filename, file_list):
+    start_time = time.perf_counter()
+    record_count = 0
+    failed_files = []
+    temp_path = os.path.join(OUTPUT_FOLDER, shard_filename + ".tmp")
+    with open(temp_path, "w", encoding="utf-8") as output_file:
+        for filename in file_list:
+            publication_id, language = extract_info_from_filename(filename)
+            if publication_id is None:
+                continue
+            for est_or_ms in EST_OR_MS:
+                try:
+                    records = create_records(filename, est_or_ms)
+                except Exception as error:
+                    failed_files.append(filename + ": " + repr(error))
+                    continue
+                for record in records:
+                    output_file.write(json.dumps(record, ensure_ascii=False))
+                    output_file.write("\n")
+                    record_count += 1
+    os.replace(temp_path, os.path.join(OUTPUT_FOLDER, shard_filename))
+    return shard_filename, record_count, failed_files, time.perf_counter() - start_time
+
+# the size and modification time of each file, used for
+# checking whether a shard has to be exported again
+def file_states(file_list):
+    states = {}
+    for filename in file_list:
+        file_stat = os.stat(os.path.join(SOURCE_FOLDER, filename))
+        states[filename] = [file_stat.st_size, file_stat.st_mtime_ns]
+    return states
+
+def read_manifest():
+    manifest_path = os.path.join(OUTPUT_FOLDER, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {"shards": {}, "failed": {}}
+    with open(manifest_path, encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+def write_manifest(manifest):
+    manifest_path = os.path.join(OUTPUT_FOLDER, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+def main():
+    start_time = time.perf_counter()
+    if not os.path.exists(OUTPUT_FOLDER):
+        os.makedirs(OUTPUT_FOLDER)
+    file_list = get_source_file_paths()
+    manifest = read_manifest()
+    settings = {"est_or_ms": EST_OR_MS, "split_sentences": SPLIT_SENTENCES}
+    # a manifest made with other settings is of no use
+    if manifest.get("settings") != settings:
+        manifest = {"settings": settings, "shards": {}, "failed": {}}
+    manifest.setdefault("failed", {})
+    shards_to_export = {}
+    shard_states = {}
+    for i in range(0, len(file_list), SHARD_SIZE):
+        shard_filename = "corpus_" + str(i // SHARD_SIZE).zfill(5) + ".jsonl"
+        shard_files = file_list[i:i + SHARD_SIZE]
+        shard_states[shard_filename] = file_states(shard_files)
+        finished_shard = manifest["shards"].get(shard_filename)
+        if finished_shard is not None and finished_shard["files"] == shard_states[shard_filename]:
+            continue
+        shards_to_export[shard_filename] = shard_files
+    print(str(len(shards_to_export)) + " of " + str(len(shard_states)) + " shards to export.")
+    record_count = 0
+    failed_files = []
+    with ProcessPoolExecutor(max_workers=WORKERS) as executor:
+        futures = [executor.submit(export_shard, shard_filename, shard_files) for shard_filename, shard_files in shards_to_export.items()]
+        for future in as_completed(futures):
+            shard_filename, shard_record_count, shard_failed_files, shard_time = future.result()
+            record_count += shard_record_count
+            failed_files += shard_failed_files
+            # a shard with failed files isn't marked as finished,
+            # so the next run tries its files again
+            if len(shard_failed_files) > 0:
+                manifest["shards"].pop(shard_filename, None)
+                manifest["failed"][shard_filename] = shard_failed_files
+            else:
+                manifest["shards"][shard_filename] = {"files": shard_states[shard_filename], "records": shard_record_count}
+                manifest["failed"].pop(shard_filename, None)
+            write_manifest(manifest)
+            print(shard_filename + " exported: " + str(shard_record_count) + " records in " + str(round(shard_time, 1)) + " s.")
+    # shards left over from a larger export are no longer valid
+    for shard_filename in list(manifest["failed"]):
+        if shard_filename not in shard_states:
+            del manifest["failed"][shard_filename]
+    for shard_filename in list(manifest["shards"]):
+        if shard_filename not in shard_states:
+            del manifest["shards"][shard_filename]
+            if os.path.exists(os.path.join(OUTPUT_FOLDER, shard_filename)):
+                os.remove(os.path.join(OUTPUT_FOLDER, shard_filename))
+    write_manifest(manifest)
+    total_time = time.perf_counter() - start_time
+    exported_files = sum(len(shard_files) for shard_files in shards_to_export.values())
+    print(str(exported_files) + " files and " + str(record_count) + " records exported in " + str(round(total_time, 1)) + " s.")
+    if total_time > 0:
+        print(str(round(exported_files / total_time, 1)) + " files/s.")
+    for failed_file in failed_files:
+        print("Failed: " + failed_file)
+
+# the guard is needed by the process pool on platforms
+# where worker processes import this module anew
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+# This script runs the transformation of transform_xml.py
+# on a whole folder of incoming XML documents, e.g. a large
+# Transkribus export or a mixed delivery from collaborators.
+
+# The documents can also be read straight from one or more
+# ZIP archives (option SOURCE_ARCHIVES), as Transkribus exports
+# and TEIGarage results arrive, without extracting them. The
+# results can be written to a ZIP archive too (OUTPUT_ARCHIVE)
+# instead of a folder. Each batch of results is added to a copy
+# of the archive which then replaces it, so a run that is killed
+# never leaves the archive unreadable.
+
+# Word processor documents (DOCX and ODT) are converted into TEI
+# locally by word_to_tei.py, instead of being sent through
+# TEIGarage Conversion first, and then transformed like the rest.
+
+# The files are transformed by a process pool, and each worker
+# loads the abbreviation index (and the indexes of the other
+# dictionaries in use) once (see abbr_matcher.py) and
+# then uses it for all the files it gets. The document type of
+# each file is detected separately (see detect_document_type
+# in transform_xml.py), unless set with the options there.
+
+# With the option WATCH the script keeps running, with the
+# workers and their abbreviation index loaded, and transforms
+# new and changed files as soon as they appear.
+
+# A manifest records the hash of each source file that has been
+# transformed. If the run is interrupted, it can just be started
+# again and will only transform the files that are new, have
+# changed, have no output or failed last time. A file that
+# fails is recorded in the manifest together with the error,
+# without stopping the run.
+
+import re
+import os
+import json
+import time
+import shutil
+import signal
+import hashlib
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from bs4 import BeautifulSoup
+
+import transform_xml
+from abbr_matcher import hash_abbr_source
+from word_to_tei import word_to_tei
+
+SOURCE_FOLDER = "documents/bad_xml"
+OUTPUT_FOLDER = "documents/good_xml"
+# the types of files to transform
+SOURCE_EXTENSIONS = (".xml", ".docx", ".odt")
+WORD_EXTENSIONS = (".docx", ".odt")
+# if not empty: read the files from these ZIP archives
+# instead of SOURCE_FOLDER
+SOURCE_ARCHIVES = []
+# if not None: write the results to this ZIP archive
+# instead of OUTPUT_FOLDER
+OUTPUT_ARCHIVE = None
+# the METS and PAGE XML files of Transkribus exports
+# aren't documents to transform
+SKIP_MEMBER_PATTERN = re.compile(r"(^|/)(mets\.xml$|page/)")
+MANIFEST_FILE = "ingest_manifest.json"
+WORKERS = os.cpu_count()
+# if True: keep running and transform new and changed
+# files as soon as they appear
+WATCH = False
+# seconds between the checks for new and changed files
+WATCH_INTERVAL = 2
+# the manifest is saved after this many finished files,
+# and always at the end of the run
+MANIFEST_INTERVAL = 50
+
+# the messages for every step would drown the summary
+transform_xml.PRINT_PROGRESS = False
+
+# the dictionary indexes of each worker process
+choice_indexes = None
+# the source archives opened by each worker process
+open_archives = {}
+# the size, modification time and hash of each file in the
+# source folder, by its path
+file_hashes = {}
+
+# Ctrl+C is handled by the main process, which then
+# shuts the workers down
+def init_worker():
+    global choice_indexes
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    choice_indexes = transform_xml.load_choice_indexes()
+
+def hash_file(file_path):
+    with open(file_path, "rb") as source_file:
+        return hashlib.sha1(source_file.read()).hexdigest()
+
+# the hash of a file is only computed again if its size or
+# modification time has changed, which matters in watch mode
+def get_file_hash(file_path):
+    file_stat = os.stat(file_path)
+    file_state = (file_stat.st_size, file_stat.st_mtime_ns)
+    if file_path in file_hashes and file_hashes[file_path][0] == file_state:
+        return file_hashes[file_path][1]
+    source_hash = hash_file(file_path)
+    file_hashes[file_path] = (file_state, source_hash)
+    return source_hash
+
+# list the files to transform as a dict of
+# name -> (archive path or None, path of the file, hash, size)
+# the name of an archive member is the archive's name followed
+# by the path of the member, e.g. export.zip/1234/doc.xml,
+# and the CRC and size recorded in the archive are used as
+# its hash, so that the member doesn't have to be read for that
+def get_sources():
+    sources = {}
+    if len(SOURCE_ARCHIVES) == 0:
+        for filename in os.listdir(SOURCE_FOLDER):
+            if not filename.lower().endswith(SOURCE_EXTENSIONS):
+                continue
+            file_path = os.path.join(SOURCE_FOLDER, filename)
+            sources[filename] = (None, file_path, get_file_hash(file_path), os.path.getsize(file_path))
+        return sources
+    for archive_path in SOURCE_ARCHIVES:
+        with zipfile.ZipFile(archive_path) as archive:
+            for member in archive.infolist():
+                if member.is_dir() or not member.filename.lower().endswith(SOURCE_EXTENSIONS):
+                    continue
+                if SKIP_MEMBER_PATTERN.search(member.filename):
+                    continue
+                member_hash = format(member.CRC, "08x") + "-" + str(member.file_size)
+                name = os.path.basename(archive_path) + "/" + member.filename
+                sources[name] = (archive_path, member.filename, member_hash, member.file_size)
+    return sources
+
+# the name of the transformed file, relative to the output
+# folder or inside the output archive
+# e.g. export.zip/1234/doc.xml becomes export/1234/doc.xml
+# word processor documents keep their own extension and get
+# .xml added, e.g. doc.docx becomes doc.docx.xml, so they
+# can't overwrite the output of a doc.xml next to them
+def get_output_name(name):
+    if name.lower().endswith(WORD_EXTENSIONS):
+        name = name + ".xml"
+    if len(SOURCE_ARCHIVES) == 0:
+        return name
+    archive_name, member_name = name.split("/", 1)
+    return os.path.splitext(archive_name)[0] + "/" + member_name
+
+# read the content of a file, from the source folder or
+# streamed straight out of its archive
+def read_source(archive_path, file_path):
+    if archive_path is None:
+        with open(file_path, "rb") as source_file:
+            file_content = source_file.read()
+    else:
+        if archive_path not in open_archives:
+            open_archives[archive_path] = zipfile.ZipFile(archive_path)
+        with open_archives[archive_path].open(file_path) as source_file:
+            file_content = source_file.read()
+    return file_content
+
+def write_to_folder(tidy_xml_string, output_name):
+    output_path = os.path.join(OUTPUT_FOLDER, output_name)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8-sig") as output_file:
+        output_file.write(tidy_xml_string)
+
+# transform one file, the same way as transform_xml.main() does
+# the result is written to the output folder by the worker,
+# but only one process can write to the output archive,
+# so then it's returned instead
+# returns the name, the document type, the number of pages,
+# the error (or None), the time it took and the result
+# (if it wasn't written)
+def ingest_file(name, archive_path, file_path):
+    start_time = time.perf_counter()
+    try:
+        file_content = read_source(archive_path, file_path)
+        if name.lower().endswith(WORD_EXTENSIONS):
+            old_soup = word_to_tei(file_content, name)
+        else:
+            old_soup = BeautifulSoup(file_content.decode("utf-8-sig"), "xml")
+        document_type, correct_p = transform_xml.get_document_type(old_soup, name)
+        new_soup, false_l = transform_xml.transform_xml(old_soup, choice_indexes["abbr"]["lookup"], document_type)
+        page_count = len(new_soup.find_all("pb"))
+        tidy_xml_string = transform_xml.tidy_up_xml(str(new_soup), false_l, transform_xml.get_choice_matchers(choice_indexes), document_type, correct_p)
+        if OUTPUT_ARCHIVE is None:
+            write_to_folder(tidy_xml_string, get_output_name(name))
+            tidy_xml_string = None
+    except Exception as error:
+        return name, None, 0, repr(error), time.perf_counter() - start_time, None
+    return name, document_type, page_count, None, time.perf_counter() - start_time, tidy_xml_string
+
+# the options that affect the output of every file
+# if any of them change, everything has to be transformed again
+def create_settings():
+    settings = {
+        "document_type": transform_xml.DOCUMENT_TYPE,
+        "correct_p": transform_xml.CORRECT_P,
+        "check_untagged_abbreviations": transform_xml.CHECK_UNTAGGED_ABBREVIATIONS
+    }
+    for choice_type, (dictionary_file, index_file) in transform_xml.get_used_dictionaries().items():
+        settings[choice_type + "_dictionary"] = hash_abbr_source(dictionary_file, choice_type)
+    return settings
+
+# the manifest is kept in the output folder,
+# or next to the output archive
+def get_manifest_path():
+    if OUTPUT_ARCHIVE is None:
+        return os.path.join(OUTPUT_FOLDER, MANIFEST_FILE)
+    return os.path.splitext(OUTPUT_ARCHIVE)[0] + "_" + MANIFEST_FILE
+
+def read_manifest():
+    manifest_path = get_manifest_path()
+    if not os.path.exists(manifest_path):
+        return {"files": {}, "failed": {}}
+    with open(manifest_path, encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+def write_manifest(manifest):
+    manifest_path = get_manifest_path()
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False, indent=1)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+# the names of the files already in the output archive
+# an archive that can't be read is moved aside, and
+# everything is transformed again
+def list_output_archive():
+    if not os.path.exists(OUTPUT_ARCHIVE):
+        return set()
+    try:
+        with zipfile.ZipFile(OUTPUT_ARCHIVE) as output_archive:
+            return set(output_archive.namelist())
+    except zipfile.BadZipFile:
+        os.replace(OUTPUT_ARCHIVE, OUTPUT_ARCHIVE + ".broken")
+        print("The output archive can't be read, moved it to " + OUTPUT_ARCHIVE + ".broken and starting over.")
+        return set()
+
+# add the transformed files of a batch to the output archive
+# appending to the archive in place overwrites its central
+# directory, so an interrupted write would leave the whole
+# archive unreadable: a copy is appended to instead, and
+# it then replaces the archive
+def write_to_output_archive(output_files):
+    if len(output_files) == 0:
+        return
+    temp_path = OUTPUT_ARCHIVE + ".tmp"
+    if os.path.exists(OUTPUT_ARCHIVE):
+        shutil.copyfile(OUTPUT_ARCHIVE, temp_path)
+    elif os.path.exists(temp_path):
+        os.remove(temp_path)
+    with zipfile.ZipFile(temp_path, "a", zipfile.ZIP_DEFLATED) as output_archive:
+        for output_name, tidy_xml_string in output_files:
+            output_archive.writestr(output_name, ("\ufeff" + tidy_xml_string).encode("utf-8"))
+    os.replace(temp_path, OUTPUT_ARCHIVE)
+
+# a ZIP archive can't contain the same name twice, so the
+# files that will be transformed again are removed from the
+# output archive first, by copying the rest into a new one
+def remove_from_output_archive(output_names):
+    temp_path = OUTPUT_ARCHIVE + ".tmp"
+    with zipfile.ZipFile(OUTPUT_ARCHIVE) as old_archive:
+        with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED) as new_archive:
+            for member in old_archive.infolist():
+                if member.filename in output_names:
+                    continue
+                with old_archive.open(member) as old_file, new_archive.open(member, "w") as new_file:
+                    shutil.copyfileobj(old_file, new_file)
+    os.replace(temp_path, OUTPUT_ARCHIVE)
+
+# a file is done if it has been transformed with the same
+# content and its output is still there
+def is_done(manifest, name, source_hash, output_names):
+    finished_file = manifest["files"].get(name)
+    if finished_file is None or finished_file["hash"] != source_hash:
+        return False
+    output_name = get_output_name(name)
+    if OUTPUT_ARCHIVE is None:
+        return os.path.exists(os.path.join(OUTPUT_FOLDER, output_name))
+    return output_name in output_names
+
+# the manifest of the previous runs, unless it was made with
+# other settings, in which case it's of no use
+def prepare_manifest():
+    manifest = read_manifest()
+    settings = create_settings()
+    if manifest.get("settings") != settings:
+        manifest = {"settings": settings, "files": {}, "failed": {}}
+    return manifest
+
+# the files that aren't done yet
+# in watch mode a file that failed isn't tried again
+# until it has changed
+def select_files(sources, manifest, output_names, skip_failed):
+    files_to_ingest = []
+    for name in sorted(sources):
+        source_hash = sources[name][2]
+        if is_done(manifest, name, source_hash, output_names):
+            continue
+        if skip_failed and name in manifest["failed"] and manifest["failed"][name]["hash"] == source_hash:
+            continue
+        files_to_ingest.append(name)
+    return files_to_ingest
+
+# transform the files with the workers of the executor
+# and record the results in the manifest
+# returns the statistics for the summary
+def ingest_files(executor, files_to_ingest, sources, manifest, output_names):
+    statistics = {"finished": 0, "pages": 0, "size": 0, "document_types": {}}
+    stale_output_names = output_names.intersection(get_output_name(name) for name in files_to_ingest)
+    if len(stale_output_names) > 0:
+        remove_from_output_archive(stale_output_names)
+    # the files of the batch not yet in the output archive
+    output_files = []
+    completed_count = 0
+    try:
+        futures = []
+        for name in files_to_ingest:
+            archive_path, file_path, source_hash, file_size = sources[name]
+            futures.append(executor.submit(ingest_file, name, archive_path, file_path))
+        for future in as_completed(futures):
+            name, document_type, file_page_count, error, file_time, tidy_xml_string = future.result()
+            completed_count += 1
+            if error is not None:
+                manifest["failed"][name] = {"hash": sources[name][2], "error": error}
+                manifest["files"].pop(name, None)
+                print("Failed: " + name + ": " + error)
+            else:
+                if OUTPUT_ARCHIVE is not None:
+                    output_files.append((get_output_name(name), tidy_xml_string))
+                manifest["files"][name] = {"hash": sources[name][2], "document_type": document_type, "pages": file_page_count}
+                manifest["failed"].pop(name, None)
+                statistics["finished"] += 1
+                statistics["pages"] += file_page_count
+                statistics["size"] += sources[name][3]
+                statistics["document_types"][document_type] = statistics["document_types"].get(document_type, 0) + 1
+                print(name + " created (" + document_type + ", " + str(round(file_time, 1)) + " s).")
+            if completed_count % MANIFEST_INTERVAL == 0:
+                # the files have to be in the archive before
+                # the manifest says that they're done
+                if OUTPUT_ARCHIVE is not None:
+                    write_to_output_archive(output_files)
+                    output_files = []
+                write_manifest(manifest)
+    finally:
+        if OUTPUT_ARCHIVE is not None:
+            write_to_output_archive(output_files)
+        # files no longer among the sources aren't part of the batch
+        for name in list(manifest["files"]) + list(manifest["failed"]):
+            if name not in sources:
+                manifest["files"].pop(name, None)
+                manifest["failed"].pop(name, None)
+        write_manifest(manifest)
+    return statistics
+
+def print_summary(statistics, total_time):
+    print(str(statistics["finished"]) + " files (" + str(statistics["pages"]) + " pages, " + str(round(statistics["size"] / 1048576, 1)) + " MB) transformed in " + str(round(total_time, 1)) + " s.")
+    if total_time > 0:
+        print(str(round(statistics["finished"] / total_time, 1)) + " files/s, " + str(round(statistics["pages"] / total_time, 1)) + " pages/s.")
+    for document_type, count in sorted(statistics["document_types"].items()):
+        print(document_type + ": " + str(count) + " files.")
+
+def get_output_names():
+    if OUTPUT_ARCHIVE is None:
+        return set()
+    return list_output_archive()
+
+# the size and modification time of the dictionaries in use
+def get_dictionary_state():
+    dictionary_state = []
+    for dictionary_file, index_file in transform_xml.get_used_dictionaries().values():
+        dictionary_stat = os.stat(dictionary_file)
+        dictionary_state.append((dictionary_stat.st_size, dictionary_stat.st_mtime_ns))
+    return dictionary_state
+
+# keep the workers, with the dictionary indexes loaded, running
+# and check the sources every WATCH_INTERVAL seconds
+# new and changed files are transformed as soon as they're found,
+# and unchanged files are skipped by their hash
+# only files whose size or modification time has changed are
+# hashed again, see get_file_hash
+def watch():
+    print("Watching for new and changed files, stop with Ctrl+C.")
+    dictionary_state = None
+    executor = None
+    manifest = None
+    try:
+        while True:
+            # if a dictionary in use changes, new workers
+            # are started, so that they load the new index
+            new_dictionary_state = get_dictionary_state()
+            if new_dictionary_state != dictionary_state:
+                if executor is not None:
+                    executor.shutdown()
+                transform_xml.load_choice_indexes()
+                executor = ProcessPoolExecutor(max_workers=WORKERS, initializer=init_worker)
+                manifest = prepare_manifest()
+                dictionary_state = new_dictionary_state
+            # a file or archive may be in the middle of being copied
+            # if it can't be read yet, it will be next time
+            try:
+                sources = get_sources()
+            except (OSError, zipfile.BadZipFile):
+                time.sleep(WATCH_INTERVAL)
+                continue
+            output_names = get_output_names()
+            files_to_ingest = select_files(sources, manifest, output_names, True)
+            if len(files_to_ingest) > 0:
+                start_time = time.perf_counter()
+                statistics = ingest_files(executor, files_to_ingest, sources, manifest, output_names)
+                print_summary(statistics, time.perf_counter() - start_time)
+            time.sleep(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def main():
+    start_time = time.perf_counter()
+    if OUTPUT_ARCHIVE is None and not os.path.exists(OUTPUT_FOLDER):
+        os.makedirs(OUTPUT_FOLDER)
+    if WATCH:
+        watch()
+        return
+    # build the dictionary indexes here if they're missing or old,
+    # so the workers don't all do it at the same time
+    transform_xml.load_choice_indexes()
+    sources = get_sources()
+    manifest = prepare_manifest()
+    output_names = get_output_names()
+    files_to_ingest = select_files(sources, manifest, output_names, False)
+    print(str(len(files_to_ingest)) + " of " + str(len(sources)) + " files to transform.")
+    with ProcessPoolExecutor(max_workers=WORKERS, initializer=init_worker) as executor:
+        statistics = ingest_files(executor, files_to_ingest, sources, manifest, output_names)
+    print_summary(statistics, time.perf_counter() - start_time)
+    skipped_count = len(sources) - len(files_to_ingest)
+    if skipped_count > 0:
+        print(str(skipped_count) + " files already done.")
+    if len(manifest["failed"]) > 0:
+        print(str(len(manifest["failed"])) + " files failed, see " + get_manifest_path() + ".")
+
+# the guard is needed by the process pool on platforms
+# where worker processes import this module anew
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# This module contains the preprocessing of the project's
+# original xml files, i.e. the string replacement that has to
+# be done on the file content before it's made into a
+# BeautifulSoup object. It's shared by the transformations
+# for the website and the download feature.
+
+# There are two profiles: "reading_text", which removes
+# line breaks and end-of-line hyphens (used for the reading
+# text html as well as the downloadable xml and txt), and
+# "manuscript", which only makes the hyphens uniform
+# (used for the manuscript/transcription html).
+
+# The same file is often transformed by several endpoints,
+# so the preprocessed strings are cached by the hash of the
+# file content and the profile. Optionally they're also saved
+# in CACHE_FOLDER, so other processes can use them too.
+
+import re
+import os
+import hashlib
+
+# change this whenever the preprocessing changes its output,
+# so that strings cached on disk are no longer used
+PREPROCESSING_VERSION = "1"
+# number of preprocessed strings kept in memory
+CACHE_SIZE = 256
+# folder for preprocessed strings shared between
+# processes, or None for the in-memory cache only
+CACHE_FOLDER = None
+PREPROCESSED_CACHE = {}
+
+# read a file and return its content along with
+# the hash of the content
+# the content is read the same way as with open() in text
+# mode, i.e. with the BOM removed and universal newlines
+def read_file(file_path):
+    with open(file_path, "rb") as source_file:
+        file_bytes = source_file.read()
+    file_hash = hashlib.sha1(file_bytes).hexdigest()
+    file_content = file_bytes.decode("utf-8-sig")
+    file_content = file_content.replace("\r\n", "\n").replace("\r", "\n")
+    return file_content, file_hash
+
+# the preprocessing for reading texts
+def preprocess_reading_text(file_content):
+    # check for hyphens + line breaks
+    # if they are present, replace them
+    # before the file's content is made into a 
+    # BeautifulSoup object
+    # the (-|¬|­) below looks for hyphen minus, not sign
+    # and (invisible) soft hyphen
+    # there may also be some tags involved
+    # also check spacing around page breaks
+    search_string = re.compile(r"(-|¬|­)(</hi>|</supplied>)?<lb/>")
+    match_string = re.search(search_string, file_content)
+    if match_string:
+        file_content = replace_hyphens(file_content)
+    search_string = re.compile(r"(<pb.*?/>)")
+    match_string = re.search(search_string, file_content)
+    if match_string:
+        file_content = edit_page_breaks(file_content)
+    # when there are several completely deleted lines of text
+    # or a deletion spanning a line break
+    # there may be files with one <del> per line of text,
+    # but it's ok to have a <del> spanning several lines
+    # so let's replace those chopped up <del>:s
+    # this makes the transformation of <add> containing <del> 
+    # work better later on
+    search_string = re.compile(r"</del><lb/>\n<del>")
+    file_content = search_string.sub("<lb/>\n", file_content)
+    return file_content
+
+# hyphens followed by line breaks are not to be present
+# in the reading texts
+# they originate from the transcriptions for the manuscript/transcription column,
+# where each line of text is equivalent to the original manuscript's
+# line, including its possible hyphens
+# a hyphen + <lb/> may or may not be followed by newlines and <pb/>-tags
+# the <pb/>-tag should not be preceded by space, and always followed
+# by space unless inside a word or between text dividing elements
+# in order not to create space(s) inside words, we have to take this
+# into account
+def replace_hyphens(file_content):
+    # the (-|­) below checks for either hyphen minus or a soft hyphen
+    # (invisible here), and removes the line break
+    # we also have to check for certain tags around the hyphen
+    # if there are two <hi> tags in the word, one for each line:
+    # merge them
+    search_string = re.compile(r"(-|­)<lb/>\n*(<pb.*?/>)\n*")
+    file_content = search_string.sub(r"\2", file_content)
+    search_string = re.compile(r"(-|­)<lb/>\n*")
+    file_content = search_string.sub("", file_content)
+    search_string = re.compile(r"(-|­)</hi><lb/>\n*(<pb.*?/>)\n*<hi>")
+    file_content = search_string.sub(r"\2", file_content)
+    search_string = re.compile(r"(-|­)</hi><lb/>\n*<hi>")
+    file_content = search_string.sub("", file_content)
+    search_string = re.compile(r"(-|­)(</supplied>)<lb/>\n*")
+    file_content = search_string.sub(r"\2", file_content)
+    # the ¬ (not sign) in the transcriptions represents a hyphen which is
+    # not to disappear, at this point we can replace it with a true hyphen
+    # and remove the line break
+    # we also have to check for certain tags around the hyphen
+    # if there are two <hi> tags in the word, one for each line:
+    # merge them
+    search_string = re.compile(r"¬<lb/>\n*(<pb.*?/>)\n*")
+    file_content = search_string.sub(r"-\1", file_content)
+    search_string = re.compile(r"¬<lb/>\n*")
+    file_content = search_string.sub("-", file_content)
+    search_string = re.compile(r"¬</hi><lb/>\n*(<pb.*?/>)\n*<hi>")
+    file_content = search_string.sub(r"-\1", file_content)
+    search_string = re.compile(r"¬</hi><lb/>\n*<hi>")
+    file_content = search_string.sub("-", file_content)
+    search_string = re.compile(r"¬(</supplied>)<lb/>\n*")
+    file_content = search_string.sub(r"-\1", file_content)
+    # in this case, we should also add a space
+    # (cases like "<hi>Väst-</hi> och <hi>Öst-Finland</hi>")
+    search_string = re.compile(r"¬</hi><lb/>\n*")
+    file_content = search_string.sub("-</hi> ", file_content)
+    # the – (en dash) is normally to be followed by space after removing
+    # the line break, unless the dash is part of a word and there's no
+    # space between the dash and the preceding character
+    # if the latter is the case: remove the line break now
+    search_string = re.compile(r"(\w)–<lb/>\n*(<pb.*?/>)\n*")
+    file_content = search_string.sub(r"\1–\2", file_content)
+    search_string = re.compile(r"(\w)–<lb/>\n*")
+    file_content = search_string.sub(r"\1–", file_content)
+    return file_content
+
+# when newlines preceding <pb/> are removed
+# and <pb/>-tags followed by a newline and a word or a certain element
+# get the newline replaced by a trailing space at this point,
+# the transformations of <lb/> and <pb/> work correctly later on
+# and the encoding of <pb/> is TEI conform
+def edit_page_breaks(file_content):
+    search_string = re.compile(r"\n(<pb.*?/>)")
+    file_content = search_string.sub(r"\1", file_content)
+    search_string = re.compile(r"(<pb.*?/>)\n(\w)")
+    file_content = search_string.sub(r"\1 \2", file_content)
+    # elements used within paragraph-like elements may be on a new line
+    # due to the transcription being divided into lines of text with <lb/>
+    # the <pb/> is always on its own line in this project's transcriptions
+    # when getting rid of the line breaks, this has to be taken into account
+    # as a page break is always to be followed (but not preceded) by a space
+    # unless the page breaks in the middle of a word
+    # (the latter case already handled by function replace_hyphens)
+    search_string = re.compile(r"(<pb.*?/>)\n(?=(<choice|<add|<del|<persName|<xref|<anchor|<hi|<foreign|<supplied|<unclear|<gap))")
+    file_content = search_string.sub(r"\1 ", file_content)
+    return file_content
+
+# in the transcriptions for the manuscript/transcription column,
+# each line of text is equivalent to the original manuscript's line,
+# including its possible hyphens
+# in the transcriptions, either hyphen minus or soft hyphen has been
+# used as the kind of hyphen which is to disappear in the reading text,
+# and the ¬ (not sign) has been used for a hyphen which is never to disappear
+# let's make all hyphens uniform, and visible, by using only hyphen minus
+# the (¬|­) below checks for either a not sign or an (invisible) soft hyphen
+# there may also be <hi> tags involved
+def replace_manuscript_hyphens(file_content):
+    search_string = re.compile(r"(¬|­)(</hi>)?<lb/>")
+    file_content = search_string.sub(r"-\2<lb/>", file_content)
+    return file_content
+
+# the preprocessing for manuscripts/transcriptions
+def preprocess_manuscript(file_content):
+    # check for hyphens + line breaks
+    # if they are present, replace them
+    # before the file's content is made into a 
+    # BeautifulSoup object
+    # the (¬|­) below checks for either a not sign or
+    # an (invisible) soft hyphen
+    # there may also be <hi> tags involved
+    search_string = re.compile(r"(¬|­)(</hi>)?<lb/>")
+    match_string = re.search(search_string, file_content)
+    if match_string:
+        file_content = replace_manuscript_hyphens(file_content)
+    return file_content
+
+PROFILES = {
+    "reading_text": preprocess_reading_text,
+    "manuscript": preprocess_manuscript
+}
+
+# read an xml file and return its preprocessed content
+# from the cache if this file content has already been
+# preprocessed with this profile
+def read_preprocessed(file_path, profile):
+    file_content, file_hash = read_file(file_path)
+    key = file_hash + "_" + profile + "_" + PREPROCESSING_VERSION
+    file_content_preprocessed = PREPROCESSED_CACHE.get(key)
+    if file_content_preprocessed is not None:
+        return file_content_preprocessed
+    cache_path = None
+    if CACHE_FOLDER is not None:
+        cache_path = os.path.join(CACHE_FOLDER, key + ".xml")
+        if os.path.exists(cache_path):
+            with open(cache_path, "r", encoding="utf-8", newline="") as cache_file:
+                file_content_preprocessed = cache_file.read()
+    if file_content_preprocessed is None:
+        file_content_preprocessed = PROFILES[profile](file_content)
+        if cache_path is not None:
+            write_to_cache(file_content_preprocessed, cache_path)
+    # drop the oldest string once the cache is full
+    if len(PREPROCESSED_CACHE) >= CACHE_SIZE:
+        del PREPROCESSED_CACHE[next(iter(PREPROCESSED_CACHE))]
+    PREPROCESSED_CACHE[key] = file_content_preprocessed
+    return file_content_preprocessed
+
+# save a preprocessed string in the cache folder
+# via a temporary file, so that another process never
+# reads a half-written file
+def write_to_cache(file_content, cache_path):
+    if not os.path.exists(CACHE_FOLDER):
+        os.makedirs(CACHE_FOLDER, exist_ok=True)
+    temp_path = cache_path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, "w", encoding="utf-8", newline="") as cache_file:
+        cache_file.write(file_content)
+    os.replace(temp_path, cache_path)
@@ -0,0 +1,109 @@
+# This script finds the files in the corpus that use a certain
+# abbreviation, optionally only with a certain expansion, and
+# can give all those occurrences a new expansion, e.g. when an
+# expansion has been corrected in the abbr_dictionary.
+
+# The files are looked up in the occurrence index kept by the
+# incremental harvest of create_abbr_dictionary.py (see
+# abbr_occurrences.py), so only the files that contain the
+# abbreviation are read and rewritten. The harvest is run
+# before the lookup, so that the index is up to date, and again
+# after rewriting, so that the dictionary counts are too (only
+# the rewritten files are harvested again).
+
+# Only the content of the <expan> of each occurrence is
+# replaced, the rest of the file is left exactly as it was.
+# Corrections and regularizations can be handled in the
+# same way by changing CHOICE_TYPE.
+
+import codecs
+from xml.sax.saxutils import escape
+from bs4 import BeautifulSoup
+import create_abbr_dictionary
+from abbr_matcher import CHOICE_TAGS
+from abbr_occurrences import open_occurrence_index, find_occurrences
+
+# the type of the dictionary, see CHOICE_TAGS in abbr_matcher.py
+CHOICE_TYPE = "abbr"
+# the content of the <abbr>, with any tags in it
+ABBREVIATION = "Dr"
+# the expansion to be replaced, or None for all expansions
+OLD_EXPANSION = None
+# the new expansion, or None: only list the files
+NEW_EXPANSION = None
+
+# group the occurrences by file
+def group_by_file(occurrences):
+    files = {}
+    for file_path, line_number, column, expansion in occurrences:
+        files.setdefault(file_path, []).append((line_number, column, expansion))
+    return files
+
+# give the occurrences in a file the new expansion
+# the occurrences are replaced starting from the end of
+# each line, so the columns of the ones before stay right
+# an occurrence that isn't there any longer (if the file has
+# been changed since the harvest) is skipped
+# returns the number of occurrences replaced and skipped
+def rewrite_file(file_path, file_occurrences, new_expansion):
+    with open(file_path, "rb") as source_file:
+        file_content = source_file.read()
+    has_bom = file_content.startswith(codecs.BOM_UTF8)
+    lines = file_content.decode("utf-8-sig").splitlines(keepends=True)
+    replacement_tag = CHOICE_TAGS[CHOICE_TYPE][1]
+    replaced_count = 0
+    skipped_count = 0
+    for line_number, column, expansion in sorted(file_occurrences, reverse=True):
+        line = lines[line_number - 1] if line_number <= len(lines) else ""
+        match_string = create_abbr_dictionary.CHOICE_PATTERN.match(line, column - 1)
+        if match_string is None:
+            skipped_count += 1
+            continue
+        choice = BeautifulSoup(match_string.group(), "xml").find("choice")
+        if create_abbr_dictionary.get_choice_pair(choice) != (CHOICE_TYPE, ABBREVIATION, expansion):
+            skipped_count += 1
+            continue
+        old_choice = match_string.group()
+        replacement_start = old_choice.index("<" + replacement_tag + ">") + len(replacement_tag) + 2
+        replacement_end = old_choice.index("</" + replacement_tag + ">", replacement_start)
+        new_choice = old_choice[:replacement_start] + escape(new_expansion) + old_choice[replacement_end:]
+        lines[line_number - 1] = line[:match_string.start()] + new_choice + line[match_string.end():]
+        replaced_count += 1
+    if replaced_count > 0:
+        new_content = "".join(lines).encode("utf-8")
+        if has_bom:
+            new_content = codecs.BOM_UTF8 + new_content
+        with open(file_path, "wb") as output_file:
+            output_file.write(new_content)
+    return replaced_count, skipped_count
+
+def main():
+    create_abbr_dictionary.update_dictionaries_from_corpus()
+    connection = open_occurrence_index(create_abbr_dictionary.OCCURRENCE_INDEX)
+    try:
+        occurrences = find_occurrences(connection, ABBREVIATION, OLD_EXPANSION, CHOICE_TYPE)
+    finally:
+        connection.close()
+    files = group_by_file(occurrences)
+    print(str(len(occurrences)) + " occurrences of " + ABBREVIATION + " in " + str(len(files)) + " files.")
+    for file_path, file_occurrences in files.items():
+        expansions = sorted(set(expansion for line_number, column, expansion in file_occurrences))
+        print(file_path + ": " + str(len(file_occurrences)) + " (" + ", ".join(expansions) + ")")
+    if NEW_EXPANSION is None:
+        return
+    total_replaced = 0
+    total_skipped = 0
+    for file_path, file_occurrences in files.items():
+        replaced_count, skipped_count = rewrite_file(file_path, file_occurrences, NEW_EXPANSION)
+        total_replaced += replaced_count
+        total_skipped += skipped_count
+    print(str(total_replaced) + " occurrences given the expansion " + NEW_EXPANSION + ".")
+    if total_skipped > 0:
+        print(str(total_skipped) + " occurrences had changed and were skipped.")
+    if total_replaced > 0:
+        create_abbr_dictionary.update_dictionaries_from_corpus()
+
+# the guard is needed by the process pool of the harvest
+# on platforms where worker processes import this module anew
+if __name__ == "__main__":
+    main()
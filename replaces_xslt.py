@@ -5,6 +5,7 @@
 import re
 import os
 from bs4 import BeautifulSoup
+from preprocessing import read_preprocessed
 import html
 import copy
 
@@ -25,114 +26,14 @@ def get_source_file_paths():
     return file_list
 
 # read an xml file and return its content as a soup object
+# hyphens, line breaks and page breaks are handled
+# by the shared preprocessing before that
 def read_xml(filename):
-    with open(SOURCE_FOLDER + "/" + filename, "r", encoding="utf-8-sig") as source_file:
-        file_content = source_file.read()
-        # check for hyphens + line breaks
-        # if they are present, replace them
-        # before the file's content is made into a 
-        # BeautifulSoup object
-        # the (-|¬|­) below looks for hyphen minus, not sign
-        # and (invisible) soft hyphen
-        # there may also be some tags involved
-        # also check spacing around page breaks
-        search_string = re.compile(r"(-|¬|­)(</hi>|</supplied>)?<lb/>")
-        match_string = re.search(search_string, file_content)
-        if match_string:
-            file_content = replace_hyphens(file_content)
-        search_string = re.compile(r"(<pb.*?/>)")
-        match_string = re.search(search_string, file_content)
-        if match_string:
-            file_content = edit_page_breaks(file_content)
-        # when there are several completely deleted lines of text
-        # or a deletion spanning a line break
-        # there may be files with one <del> per line of text,
-        # but it's ok to have a <del> spanning several lines
-        # so let's replace those chopped up <del>:s
-        # this makes the transformation of <add> containing <del> 
-        # work better later on
-        search_string = re.compile(r"</del><lb/>\n<del>")
-        file_content = search_string.sub("<lb/>\n", file_content)
-        xml_soup = BeautifulSoup(file_content, "xml")
+    file_content = read_preprocessed(SOURCE_FOLDER + "/" + filename, "reading_text")
+    xml_soup = BeautifulSoup(file_content, "xml")
     print("We have old soup.")
     return xml_soup
 
-# hyphens followed by line breaks are not to be present
-# in the reading texts
-# they originate from the transcriptions for the manuscript/transcription column,
-# where each line of text is equivalent to the original manuscript's
-# line, including its possible hyphens
-# a hyphen + <lb/> may or may not be followed by newlines and <pb/>-tags
-# the <pb/>-tag should not be preceded by space, and always followed
-# by space unless inside a word or between text dividing elements
-# in order not to create space(s) inside words, we have to take this
-# into account
-def replace_hyphens(file_content):
-    # the (-|­) below checks for either hyphen minus or a soft hyphen
-    # (invisible here), and removes the line break
-    # we also have to check for certain tags around the hyphen
-    # if there are two <hi> tags in the word, one for each line:
-    # merge them
-    search_string = re.compile(r"(-|­)<lb/>\n*(<pb.*?/>)\n*")
-    file_content = search_string.sub(r"\2", file_content)
-    search_string = re.compile(r"(-|­)<lb/>\n*")
-    file_content = search_string.sub("", file_content)
-    search_string = re.compile(r"(-|­)</hi><lb/>\n*(<pb.*?/>)\n*<hi>")
-    file_content = search_string.sub(r"\2", file_content)
-    search_string = re.compile(r"(-|­)</hi><lb/>\n*<hi>")
-    file_content = search_string.sub("", file_content)
-    search_string = re.compile(r"(-|­)(</supplied>)<lb/>\n*")
-    file_content = search_string.sub(r"\2", file_content)
-    # the ¬ (not sign) in the transcriptions represents a hyphen which is
-    # not to disappear, at this point we can replace it with a true hyphen
-    # and remove the line break
-    # we also have to check for certain tags around the hyphen
-    # if there are two <hi> tags in the word, one for each line:
-    # merge them
-    search_string = re.compile(r"¬<lb/>\n*(<pb.*?/>)\n*")
-    file_content = search_string.sub(r"-\1", file_content)
-    search_string = re.compile(r"¬<lb/>\n*")
-    file_content = search_string.sub("-", file_content)
-    search_string = re.compile(r"¬</hi><lb/>\n*(<pb.*?/>)\n*<hi>")
-    file_content = search_string.sub(r"-\1", file_content)
-    search_string = re.compile(r"¬</hi><lb/>\n*<hi>")
-    file_content = search_string.sub("-", file_content)
-    search_string = re.compile(r"¬(</supplied>)<lb/>\n*")
-    file_content = search_string.sub(r"-\1", file_content)
-    # in this case, we should also add a space
-    # (cases like "<hi>Väst-</hi> och <hi>Öst-Finland</hi>")
-    search_string = re.compile(r"¬</hi><lb/>\n*")
-    file_content = search_string.sub("-</hi> ", file_content)
-    # the – (en dash) is normally to be followed by space after removing
-    # the line break, unless the dash is part of a word and there's no
-    # space between the dash and the preceding character
-    # if the latter is the case: remove the line break now
-    search_string = re.compile(r"(\w)–<lb/>\n*(<pb.*?/>)\n*")
-    file_content = search_string.sub(r"\1–\2", file_content)
-    search_string = re.compile(r"(\w)–<lb/>\n*")
-    file_content = search_string.sub(r"\1–", file_content)
-    return file_content
-
-# when newlines preceding <pb/> are removed
-# and <pb/>-tags followed by a newline and a word or a certain element
-# get the newline replaced by a trailing space at this point,
-# the transformations of <lb/> and <pb/> work correctly later on
-def edit_page_breaks(file_content):
-    search_string = re.compile(r"\n(<pb.*?/>)")
-    file_content = search_string.sub(r"\1", file_content)
-    search_string = re.compile(r"(<pb.*?/>)\n(\w)")
-    file_content = search_string.sub(r"\1 \2", file_content)
-    # elements used within paragraph-like elements may be on a new line
-    # due to the transcription being divided into lines of text with <lb/>
-    # the <pb/> is always on its own line in this project's transcriptions
-    # when getting rid of the line breaks, this has to be taken into account
-    # as a page break is always to be followed (but not preceded) by a space
-    # unless the page breaks in the middle of a word
-    # (the latter case already handled by function replace_hyphens)
-    search_string = re.compile(r"(<pb.*?/>)\n(?=(<choice|<add|<del|<persName|<xref|<anchor|<hi|<foreign|<supplied|<unclear|<gap))")
-    file_content = search_string.sub(r"\1 ", file_content)
-    return file_content
-
 def create_html_template():
     html_doc = '''
     <!DOCTYPE html>
@@ -0,0 +1,105 @@
+# This module standardizes certain characters in the text
+# of an xml string, i.e. in everything outside the tags,
+# without touching attribute values or other parts of tags.
+# It's used by transform_xml.py and transform_epub.py.
+# It also groups the digits of numbers over 999 with
+# Narrow No-Break Space, in the text only.
+
+# The string is split into text and tags once, each text
+# segment is normalized and the string is then joined again,
+# so the whole thing is done in linear time.
+
+import re
+
+TAG_PATTERN = re.compile(r"(<[^>]*>)")
+SOFT_HYPHEN = "\u00ad"
+
+# the text of the documents should use ” (&#x201d;
+# Right Double Quotation Mark) as the character for quotation
+# marks and ’ as the apostrophe, and the en dash instead
+# of the em dash
+QUOTATION_MARKS = str.maketrans({
+    "„": "”",
+    "‟": "”",
+    "“": "”",
+    "»": "”",
+    "«": "”",
+    "—": "–",
+    "'": "’"
+})
+# it's very common to use " (&#x22;) in the text too, but
+# it should only be used around attribute values
+STRAIGHT_DOUBLE_QUOTES = str.maketrans({'"': "”"})
+# the separator used between groups of three digits
+NUMBER_SEPARATOR = "&#x202F;"
+# a number is either a run of digits separated into groups
+# of three by normal spaces or commas, or a run of
+# at least four digits without separator
+NUMBER_PATTERN = re.compile(r"(?<!\d)(?:\d{1,3}(?:[ ,]\d{3})+|\d{4,})(?!\d)")
+# numbers between 1500 and 1914 in this material
+# are most likely years and shouldn't contain any space,
+# so leave four-digit numbers in this range out
+YEAR_RANGE = (1500, 1914)
+
+# standardize the characters of one text segment
+def normalize_text_segment(text, straight_double_quotes, soft_hyphens):
+    if straight_double_quotes:
+        text = text.translate(STRAIGHT_DOUBLE_QUOTES)
+    text = text.translate(QUOTATION_MARKS)
+    text = text.replace("’’", "”")
+    text = text.replace("´", "’")
+    # do not allow soft hyphen (&shy;), use only hyphen minus
+    # (or the not sign for hyphens that are to be transformed
+    # differently later on for html and download xml on the site)
+    # first check for hyphen minus combined with soft hyphen,
+    # as these cases have appeared in the material
+    if soft_hyphens and SOFT_HYPHEN in text:
+        text = text.replace("-" + SOFT_HYPHEN, "-")
+        text = text.replace(SOFT_HYPHEN + "-", "-")
+        text = text.replace(SOFT_HYPHEN, "-")
+    return text
+
+# standardize the characters in all text segments of the string
+# the even items of the split string are text, the odd ones tags
+def normalize_text(xml_string, straight_double_quotes=True, soft_hyphens=True):
+    parts = TAG_PATTERN.split(xml_string)
+    for i in range(0, len(parts), 2):
+        if parts[i] != "":
+            parts[i] = normalize_text_segment(parts[i], straight_double_quotes, soft_hyphens)
+    return "".join(parts)
+
+# split the digits of a number into groups of three
+# counting from the right, e.g. 1234567 -> 1 234 567
+def group_digits(digits):
+    first_group_length = len(digits) % 3 or 3
+    groups = [digits[:first_group_length]]
+    for i in range(first_group_length, len(digits), 3):
+        groups.append(digits[i:i + 3])
+    return NUMBER_SEPARATOR.join(groups)
+
+# the callback for one number found in a text segment
+def format_number(match_string, group_unseparated, year_range):
+    number = match_string.group()
+    # numbers over 999 that have normal space or comma as separator:
+    # replace those separators with Narrow No-Break Space
+    if not number.isdigit():
+        return number.replace(" ", NUMBER_SEPARATOR).replace(",", NUMBER_SEPARATOR)
+    # add Narrow No-Break Space in numbers over 999 without separator
+    if not group_unseparated:
+        return number
+    if year_range is not None and len(number) == 4 and year_range[0] <= int(number) <= year_range[1]:
+        return number
+    return group_digits(number)
+
+# add Narrow No-Break Space in all numbers over 999 in the
+# text segments of the string, so that each number is
+# looked at once and attribute values are left alone
+# group_unseparated controls whether runs of digits without
+# separator are grouped too, and year_range (or None) which
+# four-digit numbers are left as they are
+def format_numbers(xml_string, group_unseparated=True, year_range=YEAR_RANGE):
+    parts = TAG_PATTERN.split(xml_string)
+    for i in range(0, len(parts), 2):
+        if parts[i] != "":
+            parts[i] = NUMBER_PATTERN.sub(lambda match_string: format_number(match_string, group_unseparated, year_range), parts[i])
+    return "".join(parts)
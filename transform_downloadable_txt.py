@@ -4,11 +4,26 @@
 # and "ms" (manuscript/transcription), and this script works for both types.
 
 import re
+import hashlib
 from bs4 import BeautifulSoup
 
 # read an xml file and return its content as a soup object
 # also handle hyphens and line breaks
 from src.transform_downloadable_xml import read_xml
+# hash the source file and the metadata for the fingerprint
+from src.transform_downloadable_xml import hash_source_file, hash_bibl_data
+# the txt is built on the reading of the xml and the
+# preprocessing, so their versions are part of the fingerprint too
+from src.transform_downloadable_xml import TRANSFORMER_VERSION as XML_TRANSFORMER_VERSION
+from src.preprocessing import PREPROCESSING_VERSION
+
+# part of the fingerprint of each downloadable file
+# change this whenever the transformation changes its output,
+# so that previously downloaded files are no longer matched
+TRANSFORMER_VERSION = "1"
+# approximate size in characters of each chunk
+# yielded by transform_to_txt_stream
+STREAM_CHUNK_SIZE = 65536
 
 def create_html_template():
     html_doc = '''
@@ -35,7 +50,7 @@ def create_html_soup(xml_soup):
 
 # go through the elements, attributes and values
 # and transform them as needed
-def transform_tags(html_soup, est_or_ms):
+def transform_elements(html_soup, est_or_ms):
     # transform <lb/>
     # if the xml file is an ms, we should get rid of all
     # line division and the hyphenation of words in line breaks
@@ -175,11 +190,11 @@ def transform_tags(html_soup, est_or_ms):
                         element.unwrap()
                     else:
                         element.decompose()
-    html_soup = html_soup.body
-    html_string = str(html_soup)
-    # remove <body>
-    search_string = re.compile(r"<body>|</body>")
-    html_string = search_string.sub("", html_string)
+    return html_soup
+
+# get rid of tabs, newlines and extra spaces in the
+# string made out of the transformed elements
+def tidy_up_txt(html_string):
     # remove tabs and newlines
     search_string = re.compile(r"\t|\n")
     html_string = search_string.sub("", html_string)
@@ -191,6 +206,16 @@ def transform_tags(html_soup, est_or_ms):
     # deletions from the text, and we need to tidy this up
     search_string = re.compile(r"\s+(,|;|\.[^\.]|:|\?|!)")
     html_string = search_string.sub(r"\1", html_string)
+    return html_string
+
+def transform_tags(html_soup, est_or_ms):
+    html_soup = transform_elements(html_soup, est_or_ms)
+    html_soup = html_soup.body
+    html_string = str(html_soup)
+    # remove <body>
+    search_string = re.compile(r"<body>|</body>")
+    html_string = search_string.sub("", html_string)
+    html_string = tidy_up_txt(html_string)
     # remove leading/trailing whitespace
     html_string = html_string.strip()
     if html_string == "":
@@ -198,8 +223,68 @@ def transform_tags(html_soup, est_or_ms):
     else:
         return html_string
 
+# a cheap fingerprint of the downloadable file,
+# computed without doing the transformation
+# the translated metadata is part of the endpoint response,
+# so it's included in the fingerprint even though the txt itself
+# doesn't contain it
+def fingerprint(filename, language, bibl_data, est_or_ms):
+    fingerprint_values = [
+        "txt",
+        TRANSFORMER_VERSION,
+        XML_TRANSFORMER_VERSION,
+        PREPROCESSING_VERSION,
+        hash_source_file(filename),
+        str(hash_bibl_data(bibl_data)),
+        est_or_ms,
+        language
+    ]
+    fingerprint_string = "|".join(fingerprint_values)
+    return hashlib.sha1(fingerprint_string.encode("utf-8")).hexdigest()
+
 def transform_to_txt(filename, est_or_ms):
     xml_soup = read_xml(filename)
     html_soup = create_html_soup(xml_soup)
     txt_content = transform_tags(html_soup, est_or_ms)
-    return txt_content
\ No newline at end of file
+    return txt_content
+
+# the same transformation as transform_to_txt, but the result
+# is yielded in chunks, so the web layer can start sending the
+# file before all of it has been turned into a string
+# after the transformation the body consists of mostly
+# unwrapped strings, so a chunk is cut in the middle of
+# its last run of (at least three) non-whitespace characters
+# and the rest of it is carried over to the next chunk,
+# that way tidy_up_txt sees whitespace and the following
+# punctuation together, just like for the whole string
+def transform_to_txt_stream(filename, est_or_ms):
+    xml_soup = read_xml(filename)
+    html_soup = create_html_soup(xml_soup)
+    html_soup = transform_elements(html_soup, est_or_ms)
+    search_string = re.compile(r".*\S\S(?=\S)", re.DOTALL)
+    buffer = ""
+    first_chunk = True
+    for element in html_soup.body.contents:
+        # strings have to be escaped the same way as in str(html_soup)
+        if element.name is None:
+            buffer += element.output_ready()
+        else:
+            buffer += str(element)
+        if len(buffer) < STREAM_CHUNK_SIZE:
+            continue
+        match_string = search_string.match(buffer)
+        if match_string is None:
+            continue
+        txt_chunk = tidy_up_txt(buffer[:match_string.end()])
+        buffer = buffer[match_string.end():]
+        if first_chunk:
+            txt_chunk = txt_chunk.lstrip()
+        if txt_chunk != "":
+            first_chunk = False
+            yield txt_chunk
+    txt_chunk = tidy_up_txt(buffer)
+    if first_chunk:
+        txt_chunk = txt_chunk.lstrip()
+    txt_chunk = txt_chunk.rstrip()
+    if txt_chunk != "":
+        yield txt_chunk
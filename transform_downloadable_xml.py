@@ -24,7 +24,11 @@
 
 import re
 import os
+import json
+import hashlib
+from xml.sax.saxutils import escape
 from bs4 import BeautifulSoup
+from src.preprocessing import read_preprocessed, PREPROCESSING_VERSION
 
 db_usr = os.environ.get("")
 db_pass = os.environ.get("")
@@ -32,284 +36,198 @@ db_host = os.environ.get("")
 db_db = os.environ.get("")
 
 SOURCE_FOLDER = "./"
+# rendered teiHeaders, see get_tei_header
+HEADER_CACHE = {}
+HEADER_CACHE_SIZE = 1024
+# part of the fingerprint of each downloadable file
+# change this whenever the transformation changes its output,
+# so that previously downloaded files are no longer matched
+TRANSFORMER_VERSION = "2"
+# hashes of source files, see hash_source_file
+FILE_HASH_CACHE = {}
+# approximate size in characters of each chunk
+# yielded by transform_stream
+STREAM_CHUNK_SIZE = 65536
 
 # read an xml file and return its content as a soup object
+# hyphens, line breaks and page breaks are handled
+# by the shared preprocessing before that
 def read_xml(filename):
-    with open(SOURCE_FOLDER + "/" + filename, "r", encoding="utf-8-sig") as source_file:
-        file_content = source_file.read()
-        # check for hyphens + line breaks
-        # if they are present, replace them
-        # before the file's content is made into a 
-        # BeautifulSoup object
-        # the (-|¬|­) below looks for hyphen minus, not sign
-        # and (invisible) soft hyphen
-        # there may also be some tags involved
-        # also check spacing around page breaks
-        search_string = re.compile(r"(-|¬|­)(</hi>|</supplied>)?<lb/>")
-        match_string = re.search(search_string, file_content)
-        if match_string:
-            file_content = replace_hyphens(file_content)
-        search_string = re.compile(r"(<pb.*?/>)")
-        match_string = re.search(search_string, file_content)
-        if match_string:
-            file_content = edit_page_breaks(file_content)
-        # when there are several completely deleted lines of text
-        # or a deletion spanning a line break
-        # there may be files with one <del> per line of text,
-        # but it's ok to have a <del> spanning several lines
-        # so let's replace those chopped up <del>:s
-        search_string = re.compile(r"</del><lb/>\n<del>")
-        file_content = search_string.sub("<lb/>\n", file_content)
-        old_soup = BeautifulSoup(file_content, "xml")
+    file_content = read_preprocessed(SOURCE_FOLDER + "/" + filename, "reading_text")
+    old_soup = BeautifulSoup(file_content, "xml")
     return old_soup
 
-# hyphens followed by line breaks are not to be present
-# in the reading texts
-# they originate from the transcriptions for the manuscript/transcription column,
-# where each line of text is equivalent to the original manuscript's
-# line, including its possible hyphens
-# a hyphen + <lb/> may or may not be followed by newlines and <pb/>-tags
-# the <pb/>-tag should not be preceded by space, and always followed
-# by space unless inside a word or between text dividing elements
-# in order not to create space(s) inside words, we have to take this
-# into account
-def replace_hyphens(file_content):
-    # the (-|­) below checks for either hyphen minus or a soft hyphen
-    # (invisible here), and removes the line break
-    # we also have to check for certain tags around the hyphen
-    # if there are two <hi> tags in the word, one for each line:
-    # merge them
-    search_string = re.compile(r"(-|­)<lb/>\n*(<pb.*?/>)\n*")
-    file_content = search_string.sub(r"\2", file_content)
-    search_string = re.compile(r"(-|­)<lb/>\n*")
-    file_content = search_string.sub("", file_content)
-    search_string = re.compile(r"(-|­)</hi><lb/>\n*(<pb.*?/>)\n*<hi>")
-    file_content = search_string.sub(r"\2", file_content)
-    search_string = re.compile(r"(-|­)</hi><lb/>\n*<hi>")
-    file_content = search_string.sub("", file_content)
-    search_string = re.compile(r"(-|­)(</supplied>)<lb/>\n*")
-    file_content = search_string.sub(r"\2", file_content)
-    # the ¬ (not sign) in the transcriptions represents a hyphen which is
-    # not to disappear, at this point we can replace it with a true hyphen
-    # and remove the line break
-    # we also have to check for certain tags around the hyphen
-    # if there are two <hi> tags in the word, one for each line:
-    # merge them
-    search_string = re.compile(r"¬<lb/>\n*(<pb.*?/>)\n*")
-    file_content = search_string.sub(r"-\1", file_content)
-    search_string = re.compile(r"¬<lb/>\n*")
-    file_content = search_string.sub("-", file_content)
-    search_string = re.compile(r"¬</hi><lb/>\n*(<pb.*?/>)\n*<hi>")
-    file_content = search_string.sub(r"-\1", file_content)
-    search_string = re.compile(r"¬</hi><lb/>\n*<hi>")
-    file_content = search_string.sub("-", file_content)
-    search_string = re.compile(r"¬(</supplied>)<lb/>\n*")
-    file_content = search_string.sub(r"-\1", file_content)
-    # in this case, we should also add a space
-    # (cases like "<hi>Väst-</hi> och <hi>Öst-Finland</hi>")
-    search_string = re.compile(r"¬</hi><lb/>\n*")
-    file_content = search_string.sub("-</hi> ", file_content)
-    # the – (en dash) is normally to be followed by space after removing
-    # the line break, unless the dash is part of a word and there's no
-    # space between the dash and the preceding character
-    # if the latter is the case: remove the line break now
-    search_string = re.compile(r"(\w)–<lb/>\n*(<pb.*?/>)\n*")
-    file_content = search_string.sub(r"\1–\2", file_content)
-    search_string = re.compile(r"(\w)–<lb/>\n*")
-    file_content = search_string.sub(r"\1–", file_content)
-    return file_content
-
-# when newlines preceding <pb/> are removed
-# and <pb/>-tags followed by a newline and a word or a certain element
-# get the newline replaced by a trailing space at this point,
-# the transformations of <lb/> and <pb/> work correctly later on
-# and the encoding of <pb/> is TEI conform
-def edit_page_breaks(file_content):
-    search_string = re.compile(r"\n(<pb.*?/>)")
-    file_content = search_string.sub(r"\1", file_content)
-    search_string = re.compile(r"(<pb.*?/>)\n(\w)")
-    file_content = search_string.sub(r"\1 \2", file_content)
-    # elements used within paragraph-like elements may be on a new line
-    # due to the transcription being divided into lines of text with <lb/>
-    # the <pb/> is always on its own line in this project's transcriptions
-    # when getting rid of the line breaks, this has to be taken into account
-    # as a page break is always to be followed (but not preceded) by a space
-    # unless the page breaks in the middle of a word
-    # (the latter case already handled by function replace_hyphens)
-    search_string = re.compile(r"(<pb.*?/>)\n(?=(<choice|<add|<del|<persName|<xref|<anchor|<hi|<foreign|<supplied|<unclear|<gap))")
-    file_content = search_string.sub(r"\1 ", file_content)
-    return file_content
-
 def content_template():
     xml_template = '''
-    <TEI>
-    <teiHeader>
-    <fileDesc>
-    <titleStmt>
-    <title></title>
-    <respStmt>
-    </respStmt>
-    </titleStmt>
-    <publicationStmt>
-    <publisher>Leo Mechelin – Pro lege</publisher>
-    </publicationStmt>
-    <sourceDesc>
-    </sourceDesc>
-    </fileDesc>
-    </teiHeader>
     <text>
     <body>
     </body>
     </text>
-    </TEI>
     '''
     return BeautifulSoup(xml_template, "xml")
 
+# metadata values from the db may contain characters
+# that have to be escaped, and stray whitespace
+# that tidy_up_xml would otherwise have collapsed,
+# so the same rules are applied to it here
+def header_text(value):
+    value = str(value)
+    search_string = re.compile(r"\s\n")
+    value = search_string.sub(" ", value)
+    search_string = re.compile(r"\n|\t")
+    value = search_string.sub("", value)
+    search_string = re.compile(r"\s{2,}")
+    value = search_string.sub(" ", value)
+    return escape(value)
+
+# in an attribute value the quotes have to be escaped too
+def header_attribute(value):
+    return header_text(value).replace('"', "&quot;")
+
+# render the teiHeader directly from bibl_data as a
+# preformatted string, one element per line, which is
+# the same layout tidy_up_xml used to produce for it
+# the header doesn't depend on the file content, so
+# there's no need to build it as part of the soup
+def render_tei_header(language, bibl_data, est_or_ms):
+    lines = ['<?xml version="1.0" encoding="utf-8"?>', "<TEI>"]
+    if bibl_data is None:
+        lines.append("<teiHeader>")
+    else:
+        lines.append('<teiHeader xml:lang="' + header_attribute(language) + '">')
+    lines.append("<fileDesc>")
+    lines.append("<titleStmt>")
+    if bibl_data is None:
+        lines.append("<title></title>")
+        lines.append("<respStmt>")
+    else:
+        lines.append("<title>" + header_text(bibl_data["publication_title"]) + "</title>")
+        if bibl_data["publication_subtitle"] is not None:
+            lines.append('<title type="sub">' + header_text(bibl_data["publication_subtitle"]) + "</title>")
+        lines.append("<respStmt>")
+        # only the translators of this language version
+        # of the text are mentioned
+        for translation in bibl_data["translations"]:
+            translated_lang = translation["translated_into"]
+            if language == "sv" and "svenska" in translated_lang:
+                resp = "översättning till svenska"
+            elif language == "fi" and translated_lang == "suomeksi":
+                resp = "suomentanut"
+            else:
+                continue
+            lines.append("<resp>" + resp + "</resp>")
+            for translator in translation["translators"]:
+                lines.append("<name>" + header_text(translator) + "</name>")
+            break
+    lines.append("</respStmt>")
+    lines.append("</titleStmt>")
+    lines.append("<publicationStmt>")
+    lines.append("<publisher>Leo Mechelin – Pro lege</publisher>")
+    lines.append("</publicationStmt>")
+    lines.append("<sourceDesc>")
+    if bibl_data is not None:
+        orig_lang_abbr = bibl_data["orig_lang_abbr"]
+        manuscript_id = bibl_data["manuscript_id"]
+        lines.append("<bibl>")
+        if bibl_data["author"] != []:
+            for person in bibl_data["author"]:
+                lines.append("<author>" + header_text(person) + "</author>")
+        elif bibl_data["sender"] != []:
+            for person in bibl_data["sender"]:
+                lines.append("<sender>" + header_text(person) + "</sender>")
+        for person in bibl_data["recipient"]:
+            lines.append("<recipient>" + header_text(person) + "</recipient>")
+        if bibl_data["published_by"] is not None:
+            lines.append("<publisher>" + header_text(bibl_data["published_by"]) + "</publisher>")
+        lines.append("<date>" + header_text(bibl_data["publication_date"]) + "</date>")
+        lines.append("<archiveInfo>" + header_text(bibl_data["publication_archive_info"]) + "</archiveInfo>")
+        lines.append("<docType>" + header_text(bibl_data["document_type"]) + "</docType>")
+        # the first language is the main language of the document,
+        # the rest of them are listed as other languages
+        text_lang = "<textLang"
+        if len(orig_lang_abbr) > 0:
+            text_lang += ' mainLang="' + header_attribute(orig_lang_abbr[0]) + '"'
+        if len(orig_lang_abbr) > 1:
+            text_lang += ' otherLangs="' + header_attribute(" ".join(orig_lang_abbr[1:])) + '"'
+        text_lang += ">"
+        if language == "sv":
+            text_lang += "Dokumentets originalspråk: "
+        if language == "fi":
+            text_lang += "Dokumentin alkuperäinen kieli: "
+        text_lang += header_text(bibl_data["original_language"]) + "</textLang>"
+        lines.append(text_lang)
+        lines.append("<publicationId>" + header_text(bibl_data["id"]) + "</publicationId>")
+        # if this text's language value is in orig_lang_abbr
+        # and its est_or_ms value is "est", then
+        # this text is both manuscript/transcription and reading text
+        # at the same time and in the same file:
+        # then we can add its manuscript_id
+        # if est_or_ms is "ms", then we know we should add manuscript_id 
+        # if this text's language value isn't in orig_lang_abbr
+        # and its est_or_ms value is "est",
+        # then there's a separate manuscript file (or no manuscript file at all)
+        # and we shouldn't connect that manuscript_id to this text
+        if est_or_ms == "ms" or (est_or_ms == "est" and language in orig_lang_abbr and manuscript_id is not None):
+            lines.append("<manuscriptId>" + header_text(manuscript_id) + "</manuscriptId>")
+        lines.append("</bibl>")
+    lines.append("</sourceDesc>")
+    lines.append("</fileDesc>")
+    lines.append("</teiHeader>")
+    return "\n".join(lines) + "\n"
+
+# the metadata for a text is a dict containing lists,
+# so serialize it in a stable way before hashing it
+def hash_bibl_data(bibl_data):
+    if bibl_data is None:
+        return None
+    metadata_json = json.dumps(bibl_data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(metadata_json.encode("utf-8")).hexdigest()
+
+# bulk exports request the same publication in the same
+# language over and over again, so keep the rendered headers
+# keyed by publication, language, est_or_ms and a hash
+# of the metadata, which changes if the db data changes
+def get_tei_header(language, bibl_data, est_or_ms):
+    if bibl_data is None:
+        publication_id = None
+    else:
+        publication_id = bibl_data["id"]
+    metadata_hash = hash_bibl_data(bibl_data)
+    key = (publication_id, language, est_or_ms, metadata_hash)
+    tei_header = HEADER_CACHE.get(key)
+    if tei_header is None:
+        tei_header = render_tei_header(language, bibl_data, est_or_ms)
+        # drop the oldest header once the cache is full
+        if len(HEADER_CACHE) >= HEADER_CACHE_SIZE:
+            del HEADER_CACHE[next(iter(HEADER_CACHE))]
+        HEADER_CACHE[key] = tei_header
+    return tei_header
+
 # get body from source xml and combine with template
 # go through certain elements, attributes and values
-# add content to them and transform them
-def transform_xml(old_soup, language, bibl_data, est_or_ms):
+# and transform them
+# if there's no text content apart from the template: return None
+def transform_body(old_soup, language, bibl_data, est_or_ms):
     xml_body = old_soup.find("body")
     new_soup = content_template()
     # transfer original xml body to template body
     # and unwrap duplicated body element
     new_soup.body.append(xml_body)
     new_soup.body.unwrap()
-    # if there's no text content apart from the template:
-    # return an empty string
     body = new_soup.find("body")
     div = new_soup.find("div")
     if len(body.get_text(strip = True)) == 0:
-        xml_string = ""
-        return xml_string
+        return None
     elif div is not None and len(div.get_text(strip = True)) == 0:
-        xml_string = ""
-        return xml_string
+        return None
     else:
-        if bibl_data is not None:
-            publication_id = bibl_data["id"]
-            manuscript_id = bibl_data["manuscript_id"]
-            publication_title = bibl_data["publication_title"]
-            publication_subtitle = bibl_data["publication_subtitle"]
-            published_by = bibl_data["published_by"]
-            document_type = bibl_data["document_type"]
-            original_language = bibl_data["original_language"]
-            orig_lang_abbr = bibl_data["orig_lang_abbr"]
-            publication_date = bibl_data["publication_date"]
-            publication_archive_info = bibl_data["publication_archive_info"]
-            author = bibl_data["author"]
-            sender = bibl_data["sender"]
-            recipient = bibl_data["recipient"]
-            translations = bibl_data["translations"]
-            new_soup.teiHeader["xml:lang"] = language
-            new_soup.title.append(publication_title)
-            if publication_subtitle is not None:
-                new_tag = new_soup.new_tag("title")
-                new_soup.title.insert_after(new_tag)
-                new_tag["type"] = "sub"
-                new_tag.append(publication_subtitle)
-            if translations != []:
-                for translation in translations:
-                    translated_lang = translation["translated_into"]
-                    if language == "sv":
-                        if "svenska" in translated_lang:
-                            new_tag = new_soup.new_tag("resp")
-                            new_soup.respStmt.append(new_tag)
-                            new_tag.append("översättning till svenska")
-                            translators = translation["translators"]
-                            for translator in translators:
-                                new_tag = new_soup.new_tag("name")
-                                new_soup.respStmt.append(new_tag)
-                                new_tag.append(translator)
-                            break
-                        else:
-                            continue
-                    if language == "fi":
-                        if translated_lang == "suomeksi":
-                            new_tag = new_soup.new_tag("resp")
-                            new_soup.respStmt.append(new_tag)
-                            new_tag.append("suomentanut")
-                            translators = translation["translators"]
-                            for translator in translators:
-                                new_tag = new_soup.new_tag("name")
-                                new_soup.respStmt.append(new_tag)
-                                new_tag.append(translator)
-                            break
-                        else:
-                            continue
-            new_tag = new_soup.new_tag("bibl")
-            new_soup.sourceDesc.append(new_tag)
-            if author != []:
-                for person in author:
-                    new_tag = new_soup.new_tag("author")
-                    new_soup.bibl.append(new_tag)
-                    new_tag.append(person)
-            elif sender != []:
-                for person in sender:
-                    new_tag = new_soup.new_tag("sender")
-                    new_soup.bibl.append(new_tag)
-                    new_tag.append(person)
-            if recipient != []:
-                for person in recipient:
-                    new_tag = new_soup.new_tag("recipient")
-                    new_soup.bibl.append(new_tag)
-                    new_tag.append(person)
-            if published_by is not None:
-                    new_tag = new_soup.new_tag("publisher")
-                    new_soup.bibl.append(new_tag)
-                    new_tag.append(published_by)
-            new_tag = new_soup.new_tag("date")
-            new_soup.bibl.append(new_tag)
-            new_tag.append(publication_date)
-            new_tag = new_soup.new_tag("archiveInfo")
-            new_soup.bibl.append(new_tag)
-            new_tag.append(publication_archive_info)
-            new_tag = new_soup.new_tag("docType")
-            new_soup.bibl.append(new_tag)
-            new_tag.append(document_type)
-            new_tag = new_soup.new_tag("textLang")
-            new_soup.bibl.append(new_tag)
-            if language == "sv":
-                new_tag.append("Dokumentets originalspråk: ")
-            if language == "fi":
-                new_tag.append("Dokumentin alkuperäinen kieli: ")
-            new_tag.append(original_language)
-            i = 0
-            for orig_lang in orig_lang_abbr:
-                if i == 0:
-                    new_tag["mainLang"] = orig_lang
-                    if len(orig_lang_abbr) == 1:
-                        break
-                if i == 1:
-                    new_tag["otherLangs"] = orig_lang
-                if i > 1:
-                    new_tag["otherLangs"] += " "
-                    new_tag["otherLangs"] += orig_lang
-                i += 1
-            new_tag = new_soup.new_tag("publicationId")
-            new_soup.bibl.append(new_tag)
-            new_tag.append(publication_id)
-            # if this text's language value is in orig_lang_abbr
-            # and its est_or_ms value is "est", then
-            # this text is both manuscript/transcription and reading text
-            # at the same time and in the same file:
-            # then we can add its manuscript_id
-            # if est_or_ms is "ms", then we know we should add manuscript_id 
-            # if this text's language value isn't in orig_lang_abbr
-            # and its est_or_ms value is "est",
-            # then there's a separate manuscript file (or no manuscript file at all)
-            # and we shouldn't connect that manuscript_id to this text
-            if est_or_ms == "ms" or (est_or_ms == "est" and language in orig_lang_abbr and manuscript_id is not None):
-                new_tag = new_soup.new_tag("manuscriptId")
-                new_soup.bibl.append(new_tag)
-                new_tag.append(str(manuscript_id))
         # add this text's language value to the top <div>
         element = new_soup.find("div")
         if element is not None:
             if est_or_ms == "est":
                 element["xml:lang"] = language
-            if est_or_ms == "ms":
-                element["xml:lang"] = original_language              
+            if est_or_ms == "ms" and bibl_data is not None:
+                element["xml:lang"] = bibl_data["original_language"]
         # transform <lb/>
         elements = new_soup.find_all("lb")
         if len(elements) > 0:
@@ -334,9 +252,21 @@ def transform_xml(old_soup, language, bibl_data, est_or_ms):
             for element in elements:
                 if "type" not in element.attrs:
                     element["type"] = "orig"
-        xml_string = str(new_soup)
+        return new_soup
+
+# the teiHeader is rendered separately by get_tei_header
+# if there's no text content apart from the template:
+# return an empty string
+def transform_xml(old_soup, language, bibl_data, est_or_ms):
+    new_soup = transform_body(old_soup, language, bibl_data, est_or_ms)
+    if new_soup is None:
+        xml_string = ""
         return xml_string
+    xml_string = str(new_soup.find("text"))
+    return xml_string
 
+# tidy up the <text> part of the document
+# the teiHeader is already formatted by render_tei_header
 def tidy_up_xml(xml_string):
     # this is what's left of the transcription line breaks
     # replace them with just a space
@@ -348,11 +278,6 @@ def tidy_up_xml(xml_string):
     search_string = re.compile(r"\s{2,}")
     xml_string = search_string.sub(" ", xml_string)
     # add newlines as preferred
-    # for <TEI> and <teiHeader>:
-    search_string = re.compile(r"(<TEI>|<teiHeader.*?>|<fileDesc>|<titleStmt>|</title>|<respStmt>|</resp>|</name>|</respStmt>|</titleStmt>|<publicationStmt>|</publisher>|</publicationStmt>|<sourceDesc>|<bibl>|</author>|</sender>|</recipient>|</date>|</archiveInfo>|</docType>|</textLang>|</publicationId>|</manuscriptId>|</bibl>|</sourceDesc>|</fileDesc>|</teiHeader>|</TEI>)")
-    xml_string = search_string.sub(r"\1\n", xml_string)
-    search_string = re.compile(r"(<TEI>)")
-    xml_string = search_string.sub(r"\n\1", xml_string)
     # for <text>, <body> and text dividing elements:
     search_string = re.compile(r"(<text>|</text>|<body.*?>|</body>|<div.*?>|</div>|</head>|</p>|<lg>|</lg>|</l>|<opener>|</opener>|<closer>|</closer>|<postscript>|</postscript>|</dateline>|</address>|</salute>|</signed>|<table>|</table>|</row>|<list>|</list>|</item>|<milestone.*?/>)")
     xml_string = search_string.sub(r"\1\n", xml_string)
@@ -369,8 +294,90 @@ def tidy_up_xml(xml_string):
     xml_string = search_string.sub("", xml_string)
     return xml_string
 
+# hash the content of a source file
+# the hash is kept as long as the file's size and
+# modification time stay the same, so repeated requests
+# for an unchanged file don't even have to read it
+def hash_source_file(filename):
+    file_path = SOURCE_FOLDER + "/" + filename
+    file_stat = os.stat(file_path)
+    cached = FILE_HASH_CACHE.get(file_path)
+    if cached is not None and cached[0] == file_stat.st_mtime_ns and cached[1] == file_stat.st_size:
+        return cached[2]
+    file_hash = hashlib.sha1()
+    with open(file_path, "rb") as source_file:
+        for chunk in iter(lambda: source_file.read(65536), b""):
+            file_hash.update(chunk)
+    file_hash = file_hash.hexdigest()
+    FILE_HASH_CACHE[file_path] = (file_stat.st_mtime_ns, file_stat.st_size, file_hash)
+    return file_hash
+
+# a cheap fingerprint of the downloadable file,
+# computed without doing the transformation
+# the API can use it as an ETag and answer If-None-Match
+# with 304 Not Modified, skipping transform altogether
+def fingerprint(file, language, bibl_data, est_or_ms):
+    fingerprint_values = [
+        "xml",
+        TRANSFORMER_VERSION,
+        PREPROCESSING_VERSION,
+        hash_source_file(file),
+        str(hash_bibl_data(bibl_data)),
+        est_or_ms,
+        language
+    ]
+    fingerprint_string = "|".join(fingerprint_values)
+    return hashlib.sha1(fingerprint_string.encode("utf-8")).hexdigest()
+
 def transform(file, language, bibl_data, est_or_ms):
     old_soup = read_xml(file)
     xml_string = transform_xml(old_soup, language, bibl_data, est_or_ms)
-    xml_string = tidy_up_xml(xml_string)
-    return xml_string
\ No newline at end of file
+    if xml_string == "":
+        return xml_string
+    xml_string = get_tei_header(language, bibl_data, est_or_ms) + tidy_up_xml(xml_string) + "</TEI>\n"
+    return xml_string
+
+# the opening tag of an element, without its contents
+def opening_tag(new_soup, element):
+    empty_element = new_soup.new_tag(element.name, attrs=element.attrs)
+    empty_element.append("")
+    closing_tag = "</" + empty_element.name + ">"
+    return str(empty_element)[:-len(closing_tag)]
+
+# strings have to be escaped the way the soup does it,
+# which str() doesn't do
+def serialize(element):
+    if element.name is None:
+        return element.output_ready()
+    return str(element)
+
+# the same transformation as transform, but the result
+# is yielded in chunks, so the web layer can start sending the
+# file before all of it has been turned into a string
+# the teiHeader comes first, then the text is yielded
+# section by section, i.e. the children of each top-level <div>
+# are collected until there's about STREAM_CHUNK_SIZE
+# characters of them, and then tidied and yielded
+def transform_stream(file, language, bibl_data, est_or_ms):
+    old_soup = read_xml(file)
+    new_soup = transform_body(old_soup, language, bibl_data, est_or_ms)
+    if new_soup is None:
+        return
+    yield get_tei_header(language, bibl_data, est_or_ms)
+    yield "<text>\n<body>\n"
+    for top_element in new_soup.body.contents:
+        if top_element.name != "div":
+            if top_element.name is not None or len(top_element.strip()) > 0:
+                yield tidy_up_xml(serialize(top_element))
+            continue
+        yield tidy_up_xml(opening_tag(new_soup, top_element))
+        buffer = ""
+        for element in top_element.contents:
+            buffer += serialize(element)
+            # a page break is followed by a newline only if
+            # the next element is p-like, so keep it in the same chunk
+            if len(buffer) >= STREAM_CHUNK_SIZE and element.name is not None and element.name != "pb":
+                yield tidy_up_xml(buffer)
+                buffer = ""
+        yield tidy_up_xml(buffer + "</div>")
+    yield "</body>\n</text>\n</TEI>\n"
@@ -13,8 +13,11 @@
 # it further and make it more accessible. The resulting
 # file will be used for non-commercial purposes only.
 
-# This script should be run on an unzipped epub
-# (change the .epub to .zip and then unzip it).
+# The epub is read as it is, without unzipping it: the
+# container file META-INF/container.xml tells where the package
+# file is, the package file lists the content files and the
+# page map, and each content file is read straight from the
+# archive into memory when it's needed.
 
 # The way of getting the files of the epub
 # in the right order using the package file,
@@ -23,28 +26,125 @@
 # in this way I have very gratefully borrowed from
 # Jonas Lillqvist (@jonaslil).
 
+# The content files are transformed and tidied up in parallel
+# by a process pool: each worker opens the epub once and gets
+# the page_dict of the book, and the results are written to the
+# output file in the order of the spine as soon as they're ready,
+# so the whole book is never kept in one soup. The tidying up
+# that can't be done one file at a time (a paragraph continuing
+# over a page break at the start of the next file) is done
+# where the results are joined.
+
+# With the option BATCH_FOLDER all the epubs in a folder are
+# converted, divided between the workers of a process pool one
+# book at a time. Each output file is named after the identifier
+# of the book in its package file. The page map of each book is
+# looked for in the layouts listed in read_page_dict, and a
+# summary lists the time each book took, books without a known
+# page map and page anchors missing from the page map.
+
 # (The text content of an epub should be in xhtml files,
 # but these epub content files are .xml, even though
 # it's xhtml inside. If using this script on html, you
 # should use another parser, such as lxml.)
 
 import os
+import time
+import zipfile
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import posixpath
+from urllib.parse import unquote
 from bs4 import BeautifulSoup, Comment
 import re
+from text_normalization import normalize_text, format_numbers
 
-# path to unzipped epub
-EPUB_FOLDER = r"C:\..\development\epub\Storfurstendömet_Finlands_grundlagar"
-PACKAGE_FILE = os.path.join(EPUB_FOLDER, "OEBPS", "volume.opf")
-NAVIGATION_FILE = os.path.join(EPUB_FOLDER, "OEBPS", "_page_map_.xml")
+# path to the epub
+EPUB_FILE = r"C:\..\development\epub\Storfurstendömet_Finlands_grundlagar.epub"
+# if set: convert all the epubs in this folder instead
+BATCH_FOLDER = None
+# the file in every epub that tells where the package file is
+CONTAINER_FILE = "META-INF/container.xml"
+# the media type of the page map in the package file
+PAGE_MAP_MEDIA_TYPE = "application/oebps-page-map+xml"
+# the id of the page anchor in the href of a page in the page map
+PAGE_HREF_PATTERN = re.compile(r".+#(.+)")
+# the characters of a book identifier that can't be
+# used in the name of the output file
+FILENAME_PATTERN = re.compile(r"[^\w.-]+")
+# number of missing page anchors listed for each book
+MAX_MISSING_ANCHORS = 10
 # tag that contains all the contents to be checked in a file;
 # if it's <div> you'll need to change this script a bit
 CONTAINER_ELEMENT = "body"
 OUTPUT_FOLDER = r"C:\..\development\epub"
+WORKERS = os.cpu_count()
+# number of content files handed to a worker at a time
+FILES_PER_TASK = 4
+# what the asterisk standing for a footnote is replaced with
+FOOTNOTE_NOTE = "<note n=\"*)\"></note>"
+# a <pb/> followed by p-like content, see tidy_up_xml
+PAGE_BREAK_CONTENT_PATTERN = re.compile(r"(<pb .+?/>) *(<p|<lg>|<list>|<table>)")
+# <pb/>s in a row at the end and at the start of a content file,
+# with the newlines added after them by the <pb/> rule
+PAGE_BREAKS_END_PATTERN = re.compile(r"(<pb [^>]*/>\n?)*<pb [^>]*/>$")
+PAGE_BREAKS_START_PATTERN = re.compile(r"(<pb [^>]*/>(\n(?=<p|<lg>|<list>|<table>))?)*")
+# a paragraph continuing over a page break, see tidy_up_xml
+PARAGRAPH_PAGE_BREAK_PATTERN = re.compile(r"</p>\n(<pb n=\"\d+\" type=\"orig\"/>)\n<p rend=\"noIndent\">")
+
+# the epub archive and page_dict of each worker process
+worker_archive = None
+worker_page_dict = None
+
+# read a file in the epub archive
+def read_archive_file(epub_archive, member_path):
+    return epub_archive.read(member_path).decode("utf-8-sig")
+
+# the container file contains the path of the package file
+# (e.g. OEBPS/volume.opf) inside the archive
+def find_package_path(epub_archive):
+    container_soup = BeautifulSoup(read_archive_file(epub_archive, CONTAINER_FILE), "xml")
+    rootfile = container_soup.find("rootfile")
+    return rootfile["full-path"]
 
-def read_file(filepath):
-    with open(filepath, encoding="utf-8-sig") as source_file:
-        content = source_file.read()
-    return content
+# the hrefs in the package file are relative to the folder
+# of the package file, and may be url-encoded
+def resolve_href(package_path, href):
+    return posixpath.normpath(posixpath.join(posixpath.dirname(package_path), unquote(href)))
+
+# make a dictionary of the items in the manifest, id -> href,
+# in one pass, so that the items can be looked up by their id
+# without going through the manifest each time
+def index_manifest(package_soup):
+    manifest = {}
+    for item in package_soup.find("manifest").find_all("item"):
+        if item.has_attr("id") and item.has_attr("href"):
+            manifest[item["id"]] = item["href"]
+    return manifest
+
+# the page map is the item in the manifest referred to by the
+# page-map attribute of the spine, or else the item that has
+# the page map media type
+def find_page_map_href(package_soup, manifest):
+    spine = package_soup.find("spine")
+    if spine.has_attr("page-map") and spine["page-map"] in manifest:
+        return manifest[spine["page-map"]]
+    item = package_soup.find("item", attrs={"media-type": PAGE_MAP_MEDIA_TYPE})
+    if item is not None:
+        return item["href"]
+    return None
+
+# the identifier of the book, i.e. the <dc:identifier>
+# that the package refers to as its unique identifier
+def find_book_identifier(package_soup):
+    package = package_soup.find("package")
+    identifiers = package_soup.find_all("identifier")
+    for identifier in identifiers:
+        if package.has_attr("unique-identifier") and identifier.get("id") == package["unique-identifier"]:
+            return identifier.get_text().strip()
+    if len(identifiers) > 0:
+        return identifiers[0].get_text().strip()
+    return None
 
 # there is a file containing a list of tags with page numbers
 # and their href-values, e.g.:
@@ -57,11 +157,60 @@ def extract_page_numbers(page_soup):
     for page in pages:
         name_value = page["name"]
         href_value = page["href"]
-        search_string = re.compile(r".+#(.+)")
-        href_value = search_string.sub(r"\1", href_value)
+        href_value = PAGE_HREF_PATTERN.sub(r"\1", href_value)
         page_dict[href_value] = name_value
     return page_dict
 
+# in an epub 2 without a page map, the page numbers may be in
+# the page list of the navigation file (ncx) instead:
+# <pageTarget value="20"><navLabel><text>20</text></navLabel>
+# <content src="content/content-0021.xml#GBS.PA22"/></pageTarget>
+def extract_ncx_page_numbers(ncx_soup):
+    page_dict = {}
+    for page_target in ncx_soup.find_all("pageTarget"):
+        content = page_target.find("content")
+        label = page_target.find("text")
+        if content is None or label is None or "#" not in content.get("src", ""):
+            continue
+        page_dict[PAGE_HREF_PATTERN.sub(r"\1", content["src"])] = label.get_text().strip()
+    return page_dict
+
+# and in an epub 3 in the page list of the navigation document:
+# <nav epub:type="page-list"><ol><li><a href="...#GBS.PA22">20</a>
+def extract_nav_page_numbers(nav_soup):
+    page_dict = {}
+    for nav in nav_soup.find_all("nav"):
+        if nav.get("epub:type") != "page-list" and nav.get("type") != "page-list":
+            continue
+        for link in nav.find_all("a"):
+            if "#" in link.get("href", ""):
+                page_dict[PAGE_HREF_PATTERN.sub(r"\1", link["href"])] = link.get_text().strip()
+    return page_dict
+
+# get the page_dict from whichever layout the book uses:
+# a page map, the page list of the ncx or the page list of the
+# epub 3 navigation document, in this order
+# returns the name of the layout (None if none of them
+# was found) and the page_dict
+def read_page_dict(epub_archive, package_path, package_soup, manifest):
+    page_map_href = find_page_map_href(package_soup, manifest)
+    if page_map_href is not None:
+        page_soup = BeautifulSoup(read_archive_file(epub_archive, resolve_href(package_path, page_map_href)), "xml")
+        return "page-map", extract_page_numbers(page_soup)
+    spine = package_soup.find("spine")
+    if spine.has_attr("toc") and spine["toc"] in manifest:
+        ncx_soup = BeautifulSoup(read_archive_file(epub_archive, resolve_href(package_path, manifest[spine["toc"]])), "xml")
+        page_dict = extract_ncx_page_numbers(ncx_soup)
+        if len(page_dict) > 0:
+            return "ncx", page_dict
+    nav_item = package_soup.find("item", attrs={"properties": re.compile(r"\bnav\b")})
+    if nav_item is not None:
+        nav_soup = BeautifulSoup(read_archive_file(epub_archive, resolve_href(package_path, nav_item["href"])), "xml")
+        page_dict = extract_nav_page_numbers(nav_soup)
+        if len(page_dict) > 0:
+            return "nav", page_dict
+    return None, {}
+
 # template for content, could be more elaborate
 def content_template():
     xml_template = '''
@@ -73,21 +222,52 @@ def content_template():
 # create a list of paths of the content html files
 # to ensure that the files are read in the right order,
 # the script reads the itemrefs in the spine element,
-# and then looks for the matching items in the manifest
-def list_xhtml_file_paths(package_soup):
+# and then looks up the matching items in the manifest
+def list_xhtml_file_paths(package_soup, manifest):
     spine = package_soup.find("spine")
     itemrefs = spine.find_all("itemref")
     for itemref in itemrefs:
         # get the value of the idref attribute of the itemref
         # in the spine
         idref = itemref["idref"]
-        # find the item in the manifest with a matching id
-        item = package_soup.find(id=idref)
-        yield item["href"]
+        # the item in the manifest with a matching id
+        yield manifest[idref]
+
+# read what's needed of the package file and the page map:
+# the path of the package file, the identifier of the book,
+# the manifest (id -> href), the paths of the content files in
+# the archive in the order of the spine, the layout of the
+# page map and the page_dict (page anchor -> page number)
+def read_epub(epub_archive):
+    package_path = find_package_path(epub_archive)
+    package_soup = BeautifulSoup(read_archive_file(epub_archive, package_path), "xml")
+    manifest = index_manifest(package_soup)
+    content_paths = [resolve_href(package_path, href) for href in list_xhtml_file_paths(package_soup, manifest)]
+    page_map_layout, page_dict = read_page_dict(epub_archive, package_path, package_soup, manifest)
+    return {
+        "package_path": package_path,
+        "identifier": find_book_identifier(package_soup),
+        "manifest": manifest,
+        "content_paths": content_paths,
+        "page_map_layout": page_map_layout,
+        "page_dict": page_dict
+    }
+
+# the name of the output file: the identifier of the book,
+# or the name of the epub if it has none
+def get_output_name(epub, epub_file):
+    output_name = None
+    if epub["identifier"] is not None:
+        output_name = FILENAME_PATTERN.sub("_", epub["identifier"]).strip("_")
+    if not output_name:
+        output_name = Path(epub_file).stem
+    return output_name + ".xml"
 
 # go through the xml elements, attributes and values
 # from the source file and transform them as needed
-def transform_xml(container_soup, page_dict):
+# page anchors that aren't in the page_dict are added
+# to missing_anchors, and their <pb/> gets no @n
+def transform_xml(container_soup, page_dict, missing_anchors):
     elements = container_soup.find_all("div")
     if len(elements) > 0:
         for element in elements:
@@ -138,8 +318,10 @@ def transform_xml(container_soup, page_dict):
                 del element["id"]
                 # use the newly made dictionary to get
                 # the page number (value of @n)
-                n_value = page_dict[id_value]
-                element["n"] = n_value
+                if id_value in page_dict:
+                    element["n"] = page_dict[id_value]
+                else:
+                    missing_anchors.append(id_value)
                 element["type"] = "orig"
                 element.name = "pb"
     elements = container_soup.find_all("span")
@@ -161,12 +343,16 @@ def transform_xml(container_soup, page_dict):
         comment.extract()
     return container_soup
 
-def tidy_up_xml(xml_string):
-    # get rid of tabs, extra spaces and newlines,
+# get rid of tabs, extra spaces and newlines
+def tidy_up_whitespace(xml_string):
     search_string = re.compile(r"\n\t{1,7}|\n\s{1,30}")
     xml_string = search_string.sub(" ", xml_string)
     search_string = re.compile(r"\n|\t|\s{2,}")
     xml_string = search_string.sub("", xml_string)
+    return xml_string
+
+def tidy_up_xml(xml_string):
+    xml_string = tidy_up_whitespace(xml_string)
     # add newlines as preferred
     search_string = re.compile(r"(<div.*?>)")
     xml_string = search_string.sub(r"\n\1\n", xml_string)
@@ -176,20 +362,17 @@ def tidy_up_xml(xml_string):
     search_string = re.compile(r"( )((<pb|<lb) .+?/>)")
     xml_string = search_string.sub(r"\2", xml_string)
     # add newline after <pb/> if followed by p-like content
-    search_string = re.compile(r"(<pb .+?/>) *(<p|<lg>|<list>|<table>)")
-    xml_string = search_string.sub(r"\1\n\2", xml_string)
+    xml_string = PAGE_BREAK_CONTENT_PATTERN.sub(r"\1\n\2", xml_string)
     # add space before ... if preceeded by a word character
     # remove space between full stops and standardize two full stops to three
     search_string = re.compile(r"(\w) *\. *\.( *\.)?")
     xml_string = search_string.sub(r"\1 ...", xml_string)
     # add Narrow No-Break Space in numbers over 999
-    search_string = re.compile(r"(\d{1,3})( |,)(\d{3,})( |,)(\d{3,})")
-    xml_string = search_string.sub(r"\1&#x202F;\3&#x202F;\5", xml_string)
-    search_string = re.compile(r"(\d{1,3})( |,)(\d{3,})")
-    xml_string = search_string.sub(r"\1&#x202F;\3", xml_string)
+    # that have normal space or comma as separator
+    xml_string = format_numbers(xml_string, group_unseparated=False)
     # the asterisk stands for a footnote
     search_string = re.compile(r" *\*\) *")
-    xml_string = search_string.sub("<note n=\"*)\"></note>", xml_string)
+    xml_string = search_string.sub(FOOTNOTE_NOTE, xml_string)
     # remove extra <hi> markup
     search_string = re.compile(r" </hi><hi>")
     xml_string = search_string.sub(" ", xml_string)
@@ -203,43 +386,216 @@ def tidy_up_xml(xml_string):
     search_string = re.compile(r"^ +<", re.MULTILINE)
     xml_string = search_string.sub("<", xml_string)
     # these paragraphs should be one, not two
-    search_string = re.compile(r"</p>\n(<pb n=\"\d+\" type=\"orig\"/>)\n<p rend=\"noIndent\">")
-    xml_string = search_string.sub(r"\1 ", xml_string)
-    # standardize certain characters
-    xml_string = xml_string.replace("„", "”")
-    xml_string = xml_string.replace("‟", "”")
-    xml_string = xml_string.replace("“", "”")
-    xml_string = xml_string.replace("»", "”")
-    xml_string = xml_string.replace("«", "”")
-    xml_string = xml_string.replace("—", "–")
-    xml_string = xml_string.replace("\'", "’")
-    xml_string = xml_string.replace("’’", "”")
-    xml_string = xml_string.replace("´", "’")
-    print("XML tidied.")
+    xml_string = PARAGRAPH_PAGE_BREAK_PATTERN.sub(r"\1 ", xml_string)
+    # standardize certain characters in the text,
+    # see text_normalization.py
+    xml_string = normalize_text(xml_string, straight_double_quotes=False, soft_hyphens=False)
     return xml_string
 
-# save the new xml file in another folder
-def write_to_file(tidy_xml_string, filename):
+# two tidied content files are joined the way tidying the whole
+# book at once would do, so the whitespace between them (which
+# was left out of the files when they were tidied) is tidied up
+# here, together with the tags on either side of it
+# the newlines the <pb/> rule of tidy_up_xml gives a run of
+# <pb/>s depend on the whole run (it takes the "<p" of the next
+# <pb/> for p-like content), so the <pb/>s where the files meet
+# are put together without their newlines and tidied again
+# a paragraph continuing over a page break may also be split
+# between two files, with the page break at the end of the
+# previous file or at the start of the next one, so the end of
+# the last paragraph of the previous file is checked too
+# returns the previous file to write, ending where the next one
+# starts, and the rest of the next file
+def join_content_files(previous_string, whitespace, next_string):
+    whitespace = tidy_up_whitespace(whitespace)
+    # delete space before <pb/> and <lb/>
+    if whitespace == " " and re.match(r"(<pb|<lb) .+?/>", next_string):
+        whitespace = ""
+    end_match = PAGE_BREAKS_END_PATTERN.search(previous_string)
+    if end_match is not None:
+        start_match = PAGE_BREAKS_START_PATTERN.match(next_string)
+        page_breaks = (end_match.group() + whitespace + start_match.group()).replace("\n", "")
+        next_string = next_string[start_match.end():]
+        next_start = next_string[:len("<table>")]
+        page_breaks = PAGE_BREAK_CONTENT_PATTERN.sub(r"\1\n\2", page_breaks + next_start)
+        previous_string = previous_string[:end_match.start()] + page_breaks[:len(page_breaks) - len(next_start)]
+        whitespace = ""
+    # the spaces around the asterisk that stands for a footnote
+    # are removed along with it
+    if whitespace == " " and (previous_string.endswith(FOOTNOTE_NOTE) or next_string.startswith(FOOTNOTE_NOTE)):
+        whitespace = ""
+    # remove spaces at the beginning of lines
+    if whitespace == " " and previous_string.endswith("\n") and next_string.startswith("<"):
+        whitespace = ""
+    previous_string += whitespace
+    paragraph_end = previous_string.rfind("</p>")
+    if paragraph_end != -1:
+        joined_string = previous_string[paragraph_end:] + next_string
+        match_string = PARAGRAPH_PAGE_BREAK_PATTERN.match(joined_string)
+        if match_string is not None:
+            next_string = match_string.group(1) + " " + joined_string[match_string.end():]
+            return previous_string[:paragraph_end], next_string
+    return previous_string, next_string
+
+# each worker opens the epub once and keeps it open
+def init_worker(epub_file, page_dict):
+    global worker_archive, worker_page_dict
+    worker_archive = zipfile.ZipFile(epub_file)
+    worker_page_dict = page_dict
+
+# transform and tidy up one content file of the epub,
+# this is what each worker does
+# returns the whitespace at the start, the tidied string, the
+# whitespace at the end and the missing page anchors
+def transform_content_file(content_path):
+    file_soup = BeautifulSoup(read_archive_file(worker_archive, content_path), "xml")
+    # find the first element with the tag name defined by CONTAINER_ELEMENT
+    container_soup = file_soup.find(CONTAINER_ELEMENT)
+    missing_anchors = []
+    container_soup = transform_xml(container_soup, worker_page_dict, missing_anchors)
+    # the whitespace at the ends is tidied up where the
+    # files are joined, see join_content_files
+    xml_string = container_soup.decode_contents()
+    content_string = xml_string.lstrip()
+    leading_space = xml_string[:len(xml_string) - len(content_string)]
+    trailing_space = content_string[len(content_string.rstrip()):]
+    content_string = content_string.rstrip()
+    return leading_space, tidy_up_xml(content_string), trailing_space, missing_anchors
+
+# the start and end of the output file, i.e. the tidied
+# template without any content, and the whitespace
+# between them
+def get_template_parts():
+    template_string = str(content_template())
+    template_end = template_string.rindex("</div>")
+    template_start = template_string[:template_end].rstrip()
+    template_space = template_string[len(template_start):template_end]
+    return tidy_up_xml(template_start), template_space, tidy_up_xml(template_string[template_end:])
+
+# write the transformed content files to the output file in
+# the order of the spine, one at a time
+# the last file written is held back until the next one
+# is ready, so that they can be joined
+# returns the missing page anchors of all the files
+def write_content_files(content_results, output_file):
+    previous_string, whitespace, template_end = get_template_parts()
+    missing_anchors = []
+    for leading_space, content_string, trailing_space, file_missing_anchors in content_results:
+        missing_anchors.extend(file_missing_anchors)
+        whitespace += leading_space
+        # a file with nothing but whitespace in it
+        if content_string == "":
+            continue
+        previous_string, content_string = join_content_files(previous_string, whitespace, content_string)
+        output_file.write(previous_string)
+        previous_string = content_string
+        whitespace = trailing_space
+    previous_string, template_end = join_content_files(previous_string, whitespace, template_end)
+    output_file.write(previous_string + template_end)
+    return missing_anchors
+
+# transform the content files of the epub in parallel
+# and write them to the output file
+def transform_epub(epub_file, epub, output_file):
+    with ProcessPoolExecutor(max_workers=WORKERS, initializer=init_worker, initargs=(epub_file, epub["page_dict"])) as executor:
+        content_results = executor.map(transform_content_file, epub["content_paths"], chunksize=FILES_PER_TASK)
+        return write_content_files(content_results, output_file)
+
+# convert one book of a batch, this is what each worker does
+# the books are already divided between the workers, so
+# the content files of a book are transformed one by one
+# returns a summary of the book
+def convert_book(epub_file, output_name):
+    start_time = time.perf_counter()
+    summary = {"book": epub_file, "output": output_name, "content_files": 0, "pages": 0, "page_map_layout": None, "missing_anchors": [], "error": None}
+    try:
+        with zipfile.ZipFile(epub_file) as epub_archive:
+            epub = read_epub(epub_archive)
+        summary["content_files"] = len(epub["content_paths"])
+        summary["pages"] = len(epub["page_dict"])
+        summary["page_map_layout"] = epub["page_map_layout"]
+        init_worker(epub_file, epub["page_dict"])
+        try:
+            with open(os.path.join(OUTPUT_FOLDER, output_name), "w", encoding="utf-8-sig") as output_file:
+                summary["missing_anchors"] = write_content_files(map(transform_content_file, epub["content_paths"]), output_file)
+        finally:
+            worker_archive.close()
+    except Exception as error:
+        summary["error"] = repr(error)
+    summary["time"] = time.perf_counter() - start_time
+    return summary
+
+# the output names of the books in the batch folder, after their
+# identifiers, with the name of the epub added if two books
+# have the same identifier
+def get_batch_output_names(epub_files):
+    output_names = {}
+    used_names = set()
+    for epub_file in epub_files:
+        try:
+            with zipfile.ZipFile(epub_file) as epub_archive:
+                package_soup = BeautifulSoup(read_archive_file(epub_archive, find_package_path(epub_archive)), "xml")
+            output_name = get_output_name({"identifier": find_book_identifier(package_soup)}, epub_file)
+        except (OSError, KeyError, zipfile.BadZipFile):
+            output_name = Path(epub_file).stem + ".xml"
+        if output_name in used_names:
+            output_name = output_name[:-len(".xml")] + "_" + Path(epub_file).stem + ".xml"
+        used_names.add(output_name)
+        output_names[epub_file] = output_name
+    return output_names
+
+def print_book_summary(summary):
+    if summary["error"] is not None:
+        print(summary["book"] + " failed: " + summary["error"])
+        return
+    print(summary["book"] + " -> " + summary["output"] + ": " + str(summary["content_files"]) + " files, " + str(summary["pages"]) + " pages, " + str(round(summary["time"], 1)) + " s.")
+    if summary["page_map_layout"] is None:
+        print("    No known page map layout found.")
+    missing_anchors = summary["missing_anchors"]
+    if len(missing_anchors) > 0:
+        print("    " + str(len(missing_anchors)) + " page anchors missing from the page map: " + ", ".join(missing_anchors[:MAX_MISSING_ANCHORS]))
+
+# convert all the epubs in BATCH_FOLDER with a process pool,
+# one book per worker at a time
+def convert_batch():
+    start_time = time.perf_counter()
+    epub_files = [str(epub_file) for epub_file in sorted(Path(BATCH_FOLDER).glob("*.epub"))]
+    output_names = get_batch_output_names(epub_files)
+    summaries = {}
+    with ProcessPoolExecutor(max_workers=WORKERS) as executor:
+        futures = [executor.submit(convert_book, epub_file, output_names[epub_file]) for epub_file in epub_files]
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries[summary["book"]] = summary
+            if summary["error"] is None:
+                print(summary["output"] + " created.")
+    print()
+    failed_count = 0
+    for epub_file in epub_files:
+        print_book_summary(summaries[epub_file])
+        if summaries[epub_file]["error"] is not None:
+            failed_count += 1
+    print(str(len(epub_files) - failed_count) + " of " + str(len(epub_files)) + " books converted in " + str(round(time.perf_counter() - start_time, 1)) + " s.")
+
+def main():
     if not os.path.exists(OUTPUT_FOLDER):
         os.makedirs(OUTPUT_FOLDER)
-    output_file = open(os.path.join(OUTPUT_FOLDER, filename), "w", encoding="utf-8-sig")
-    output_file.write(tidy_xml_string)
-    output_file.close()
+    if BATCH_FOLDER is not None:
+        convert_batch()
+        return
+    with zipfile.ZipFile(EPUB_FILE) as epub_archive:
+        epub = read_epub(epub_archive)
+    output_name = get_output_name(epub, EPUB_FILE)
+    with open(os.path.join(OUTPUT_FOLDER, output_name), "w", encoding="utf-8-sig") as output_file:
+        missing_anchors = transform_epub(EPUB_FILE, epub, output_file)
+    if epub["page_map_layout"] is None:
+        print("No known page map layout found.")
+    if len(missing_anchors) > 0:
+        print(str(len(missing_anchors)) + " page anchors missing from the page map: " + ", ".join(missing_anchors[:MAX_MISSING_ANCHORS]))
+    print("XML tidied.")
+    print(output_name + " created.")
 
-def main():
-    package_soup = BeautifulSoup(read_file(PACKAGE_FILE), "xml")
-    page_soup = BeautifulSoup(read_file(NAVIGATION_FILE), "xml")
-    page_dict = extract_page_numbers(page_soup)
-    new_soup = content_template()
-    for filepath in list_xhtml_file_paths(package_soup):
-        full_path = os.path.join(EPUB_FOLDER, "OEBPS", filepath)
-        file_soup = BeautifulSoup(read_file(full_path), "xml")
-        # find the first element with the tag name defined by CONTAINER_ELEMENT
-        container_soup = file_soup.find(CONTAINER_ELEMENT)
-        container_soup = transform_xml(container_soup, page_dict)
-        new_soup.div.append(container_soup)
-        new_soup.find(CONTAINER_ELEMENT).unwrap()
-    tidy_xml_string = tidy_up_xml(str(new_soup))
-    write_to_file(tidy_xml_string, "result.xml")
-
-main()
+# the guard is needed by the process pool on platforms
+# where worker processes import this module anew
+if __name__ == "__main__":
+    main()
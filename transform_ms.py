@@ -4,6 +4,7 @@
 import re
 import os
 from bs4 import BeautifulSoup
+from preprocessing import read_preprocessed
 import copy
 
 SOURCE_FOLDER = "documents/xml"
@@ -23,38 +24,13 @@ def get_source_file_paths():
     return file_list
 
 # read an xml file and return its content as a soup object
+# hyphens are made uniform by the shared preprocessing before that
 def read_xml(filename):
-    with open(SOURCE_FOLDER + "/" + filename, "r", encoding="utf-8-sig") as source_file:
-        file_content = source_file.read()
-        # check for hyphens + line breaks
-        # if they are present, replace them
-        # before the file's content is made into a 
-        # BeautifulSoup object
-        # the (¬|­) below checks for either a not sign or
-        # an (invisible) soft hyphen
-        # there may also be <hi> tags involved
-        search_string = re.compile(r"(¬|­)(</hi>)?<lb/>")
-        match_string = re.search(search_string, file_content)
-        if match_string:
-            file_content = replace_hyphens(file_content)
-        xml_soup = BeautifulSoup(file_content, "xml")
+    file_content = read_preprocessed(SOURCE_FOLDER + "/" + filename, "manuscript")
+    xml_soup = BeautifulSoup(file_content, "xml")
     print("We have old soup.")
     return xml_soup
 
-# in the transcriptions for the manuscript/transcription column,
-# each line of text is equivalent to the original manuscript's line,
-# including its possible hyphens
-# in the transcriptions, either hyphen minus or soft hyphen has been
-# used as the kind of hyphen which is to disappear in the reading text,
-# and the ¬ (not sign) has been used for a hyphen which is never to disappear
-# let's make all hyphens uniform, and visible, by using only hyphen minus
-# the (¬|­) below checks for either a not sign or an (invisible) soft hyphen
-# there may also be <hi> tags involved
-def replace_hyphens(file_content):
-    search_string = re.compile(r"(¬|­)(</hi>)?<lb/>")
-    file_content = search_string.sub(r"-\2<lb/>", file_content)
-    return file_content
-
 def create_html_template():
     html_doc = '''
     <!DOCTYPE html>
@@ -9,25 +9,67 @@
 # or not encoded at all (option CHECK_UNTAGGED_ABBREVIATIONS).
 # For this we need the abbr_dictionary created by
 # create_abbr_dictionary.py.
+# The dictionaries of corrections and regularizations created
+# by the same script can be used in the same way (options
+# CHECK_UNTAGGED_CORRECTIONS and CHECK_UNTAGGED_REGULARIZATIONS),
+# and all of them are applied during the same scan of the text.
 
 import re
 import os
-from bs4 import BeautifulSoup
-import json
+from bs4 import BeautifulSoup, NavigableString
+from abbr_matcher import load_abbr_index, expand_choices
+from text_normalization import normalize_text, format_numbers
 
 SOURCE_FOLDER = "documents/bad_xml"
 OUTPUT_FOLDER = "documents/good_xml"
+ABBR_DICTIONARY = "dictionaries/abbr_dictionary.json"
+# created by create_abbr_dictionary.py, and rebuilt
+# automatically if the dictionary has changed
+ABBR_INDEX = "dictionaries/abbr_index.bin"
+CORR_DICTIONARY = "dictionaries/corr_dictionary.json"
+CORR_INDEX = "dictionaries/corr_index.bin"
+REG_DICTIONARY = "dictionaries/reg_dictionary.json"
+REG_INDEX = "dictionaries/reg_index.bin"
 # document_type includes: letter, article, misc
-DOCUMENT_TYPE = "article"
+# or auto: detect the document type of each file separately,
+# see detect_document_type
+DOCUMENT_TYPE = "auto"
 # if True: look for unencoded abbreviations and
 # surround them with the needed tags as well as
 # add the likely expansions
 CHECK_UNTAGGED_ABBREVIATIONS = True
+# if True: look for words that have been corrected or
+# regularized elsewhere in the material and encode them as
+# <choice><orig>/<corr> or <choice><orig>/<reg> with the likely
+# correction or regularization
+# where matches overlap, abbreviations go first, then
+# corrections and then regularizations
+CHECK_UNTAGGED_CORRECTIONS = False
+CHECK_UNTAGGED_REGULARIZATIONS = False
 # if True: correct falsely inserted <p> elements
 # due to Transkribus often interpreting (shorter) 
 # lines of text as separate paragraphs, even though 
 # they aren't
-CORRECT_P = False
+# or "auto": correct them in files that look like this
+CORRECT_P = "auto"
+# the signals used when detecting the document type:
+# rend values and elements that only occur in letters
+LETTER_RENDS = frozenset(["Kirjekappale"])
+LETTER_ELEMENTS = frozenset(["opener", "closer", "salute", "dateline", "signed"])
+# text transcribed line by line has at most this many
+# characters per <lb/> on average
+MAX_LINE_LENGTH = 80
+# Transkribus exports with fewer lines than this per <p>
+# on average (and at least MIN_P_COUNT <p>:s) have
+# falsely inserted <p>:s
+MIN_LINES_PER_P = 2
+MIN_P_COUNT = 5
+# if True: print a message after each step of the transformation
+PRINT_PROGRESS = True
+
+def print_progress(message):
+    if PRINT_PROGRESS:
+        print(message)
 
 # loop through xml source files in folder and append to list
 def get_source_file_paths():
@@ -42,25 +84,346 @@ def read_xml(filename):
     with open (SOURCE_FOLDER + "/" + filename, "r", encoding="utf-8-sig") as source_file:
         file_content = source_file.read()
         old_soup = BeautifulSoup(file_content, "xml")
-    print("We have old soup.")
+    print_progress("We have old soup.")
     return old_soup
 
-# get dictionary content from file
-def read_dict_from_file(filename):
-    with open(filename, encoding="utf-8-sig") as source_file:
-        json_content = json.load(source_file)
-        return json_content
+# the <hi> rend values found in Transkribus exports and
+# TEIGarage conversions, and what they're turned into
+# the same raw values occur over and over again in a document,
+# so each one is classified once and the result is kept here
+HI_REND_TABLE = {}
+COLOR_PATTERN = re.compile(r"\s*color\(.*\)")
+
+# classify a raw rend value of <hi>
+# returns None if the <hi> should be unwrapped, otherwise
+# a tuple of the new rend value (None if the rend should be
+# deleted), the new element name and the new type (or None)
+def classify_hi_rend(value):
+    if value in HI_REND_TABLE:
+        return HI_REND_TABLE[value]
+    raw_value = value
+    rend = value
+    name = "hi"
+    type = None
+    if "color" in value:
+        value = COLOR_PATTERN.sub("", value)
+        if value == "":
+            HI_REND_TABLE[raw_value] = None
+            return None
+        rend = value
+    if value == "italic bold":
+        rend = "boldItalic"
+    if "subscript" in value:
+        rend = "sub"
+    if "underlined" in value:
+        rend = None
+    if "super" in value:
+        rend = "raised"
+    if "strikethrough" in value:
+        rend = None
+        name = "tag"
+    if "italic" in value:
+        rend = None
+    if value == "Harvennettu":
+        rend = "expanded"
+    if value == "Vieraskielinen":
+        rend = None
+        name = "foreign"
+    if value == "Emphasis":
+        rend = None
+    if value == "Lisätty_marginaaliin":
+        rend = None
+        type = "marginalia"
+        name = "add"
+    HI_REND_TABLE[raw_value] = (rend, name, type)
+    return HI_REND_TABLE[raw_value]
+
+# the handlers for each element, called by visit_element
+# each handler gets the element, the number of <div>:s it's in,
+# whether it's in a <p> and the context of the whole transformation
+def transform_pb(pb, div_depth, in_p, context):
+    if "facs" in pb.attrs:
+        del pb["facs"]
+    if "xml:id" in pb.attrs:
+        del pb["xml:id"]
+    pb["type"] = "orig"
+
+def transform_p(p, div_depth, in_p, context):
+    if "facs" in p.attrs:
+        del p["facs"]
+    if "style" in p.attrs:
+        del p["style"]
+    if "rend" in p.attrs:
+        value = p["rend"]
+        if value == "Quote":
+            p["rend"] = "parIndent"
+        elif value == "Leipäteksti_ei_sisennetty" and context["document_type"] == "letter":
+            del p["rend"]
+        elif value == "Leipäteksti_ei_sisennetty":
+            p["rend"] = "noIndent"
+        elif value == "footnote text":
+            p.unwrap()
+        elif value == "Subtitle":
+            del p["rend"]
+            p["type"] = "subtitle"
+        elif value == "Runo":
+            del p["rend"]
+            p.name = "lg"
+        elif value == "Kirjekappale":
+            p.wrap(context["soup"].new_tag("opener"))
+        elif value == "Standard" or value == "color(#222222)":
+            del p["rend"]
+
+# it's possible to export prose from Transkribus OCR
+# encoded as p + lg + l
+# since it's not verse, but prose: delete l and lg
+# and set a flag, so we can combine the lines correctly
+# later on and then get rid of line breaks and hyphens
+def transform_l(l, div_depth, in_p, context):
+    if "rend" in l.attrs:
+        if l["rend"] == "indent":
+            del l["rend"]
+    if in_p:
+        l.unwrap()
+        context["false_l"] = True
+
+def transform_lb(lb, div_depth, in_p, context):
+    if "facs" in lb.attrs:
+        del lb["facs"]
+    if "n" in lb.attrs:
+        del lb["n"]
+
+# the level of a head depends on how many <div>:s it's in
+def transform_head(head, div_depth, in_p, context):
+    if "rend" in head.attrs:
+        head["type"] = head["rend"]
+        del head["rend"]
+    if div_depth <= 2:
+        head["level"] = "1"
+    elif div_depth <= 5:
+        head["level"] = str(div_depth - 1)
+
+def transform_table(table, div_depth, in_p, context):
+    if "rend" in table.attrs:
+        del table["rend"]
+
+def transform_cell(cell, div_depth, in_p, context):
+    if "style" in cell.attrs:
+        del cell["style"]
+    if "rend" in cell.attrs:
+        value = cell["rend"]
+        if value == "Body_Text background-color(FAFAFA)" or value == "Leipäteksti_ei_sisennetty background-color(FAFAFA)":
+            del cell["rend"]
+
+def transform_list(list, div_depth, in_p, context):
+    if "type" in list.attrs:
+        del list["type"]
+
+def transform_hi(hi, div_depth, in_p, context):
+    if hi.attrs == {} and context["document_type"] != "article":
+        hi["rend"] = "raised"
+    if "rend" in hi.attrs:
+        if "style" in hi.attrs:
+            del hi["style"]
+        classification = classify_hi_rend(hi["rend"])
+        if classification is None:
+            hi.unwrap()
+            return
+        rend, name, type = classification
+        if rend is None:
+            del hi["rend"]
+        else:
+            hi["rend"] = rend
+        if type is not None:
+            hi["type"] = type
+        hi.name = name
+    if "xml:space" in hi.attrs:
+        del hi["xml:space"]
+    if "style" in hi.attrs:
+        value = hi["style"]
+        if "super" in value:
+            hi["rend"] = "raised"
+            del hi["style"]
+        elif value == "text-decoration: underline;":
+            del hi["style"]
+        else:
+            hi.unwrap()
+
+def transform_seg(seg, div_depth, in_p, context):
+    if "xml:space" in seg.attrs:
+        del seg["xml:space"]
+    if "rend" in seg.attrs:
+        value = seg["rend"]
+        if "italic bold" in value:
+            seg["rend"] = "boldItalic"
+            seg.name = "hi"
+        if value == "italic":
+            del seg["rend"]
+            seg.name = "hi"
+        if value == "color(222222)":
+            seg.unwrap()
+
+def transform_ref(ref, div_depth, in_p, context):
+    if "target" in ref.attrs:
+        ref["type"] = "readingtext"
+        del ref["target"]
+        ref["id"] = ""
+        ref.name = "xref"
+
+def transform_ab(ab, div_depth, in_p, context):
+    if "facs" in ab.attrs:
+        del ab["facs"]
+    if "type" in ab.attrs:
+        del ab["type"]
+    ab.name = "p"
+
+def transform_note(note, div_depth, in_p, context):
+    if "place" in note.attrs:
+        del note["place"]
+    if "xml:id" in note.attrs:
+        note["id"] = note["xml:id"]
+        del note["xml:id"]
+
+def transform_supplied(supplied, div_depth, in_p, context):
+    if "reason" in supplied.attrs:
+        del supplied["reason"]
+
+def transform_comment(comment, div_depth, in_p, context):
+    comment.name = "note"
+
+ELEMENT_HANDLERS = {
+    "pb": transform_pb,
+    "p": transform_p,
+    "l": transform_l,
+    "lb": transform_lb,
+    "head": transform_head,
+    "table": transform_table,
+    "cell": transform_cell,
+    "list": transform_list,
+    "hi": transform_hi,
+    "seg": transform_seg,
+    "ref": transform_ref,
+    "ab": transform_ab,
+    "note": transform_note,
+    "supplied": transform_supplied,
+    "comment": transform_comment
+}
+
+# go through the tree once, depth first, and call the
+# handler of each element before going on to its children
+# the children are listed before calling the handler,
+# since unwrapping an element moves them to its parent
+# <lg>, <tag> and <choice> depend on the elements around them,
+# so they're collected and handled after the whole tree
+# has been gone through
+def visit_element(element, div_depth, in_p, context):
+    children = [child for child in element.children if child.name is not None]
+    name = element.name
+    handler = ELEMENT_HANDLERS.get(name)
+    if handler is not None:
+        handler(element, div_depth, in_p, context)
+    if element.name == "lg":
+        context["lgs"].append(element)
+    elif element.name == "tag":
+        context["tags"].append(element)
+    elif element.name == "choice":
+        context["choices"].append(element)
+    elif element.name == "div":
+        div_depth += 1
+    # an <ab> becoming a <p> doesn't count here, only the
+    # <p>:s that are still there after transform_p
+    if name == "p" and element.name == "p" and element.parent is not None:
+        in_p = True
+    for child in children:
+        visit_element(child, div_depth, in_p, context)
+
+# a string is output as is if it contains no characters
+# that need escaping
+def is_plain_string(element):
+    return type(element) is NavigableString and not any(character in element for character in "&<>")
+
+# strikethrough is exported as <hi> and becomes a <tag>,
+# which should really be a <del>, but if the text is already
+# encoded as deleted, i.e. the <tag> is the only content of a <del>
+# or the other way around, the <tag> is unnecessary
+def is_deleted_twice(tag):
+    if len(tag.contents) != 1:
+        return False
+    child = tag.contents[0]
+    parent = tag.parent
+    if parent is not None and parent.name == "del" and parent.attrs == {} and len(parent.contents) == 1:
+        if tag.attrs == {} and is_plain_string(child):
+            return True
+    if child.name == "del" and child.attrs == {} and len(child.contents) == 1:
+        return is_plain_string(child.contents[0])
+    return False
+
+# work out the document type of a file and whether its <p>:s
+# need correcting, from what can be seen in a single pass
+# through its body:
+# a letter has elements or rend values for its opener or closer,
+# prose exported from Transkribus OCR as p + lg + l is printed
+# material, i.e. an article,
+# a manuscript transcribed in Transkribus has one <lb/> per
+# (short) line, so many <lb/>:s make it misc,
+# and everything else is an article (e.g. converted from
+# a word processor document with TEIGarage Conversion)
+# Transkribus exports have facs attributes, and in them one or
+# two lines per <p> means the <p>:s were falsely inserted
+def detect_document_type(old_soup):
+    xml_body = old_soup.find("body")
+    letter_signals = 0
+    l_in_p = False
+    transkribus = False
+    p_count = 0
+    lb_count = 0
+    text_length = 0
+    for element in xml_body.descendants:
+        if element.name is None:
+            text_length += len(element.strip())
+            continue
+        if "facs" in element.attrs:
+            transkribus = True
+        if element.name in LETTER_ELEMENTS or element.get("rend") in LETTER_RENDS:
+            letter_signals += 1
+        if element.name == "p":
+            p_count += 1
+        elif element.name == "lb":
+            lb_count += 1
+        elif element.name == "l" and not l_in_p and element.find_parent("p") is not None:
+            l_in_p = True
+    if letter_signals > 0:
+        document_type = "letter"
+    elif l_in_p:
+        document_type = "article"
+    elif lb_count > 0 and text_length / lb_count <= MAX_LINE_LENGTH:
+        document_type = "misc"
+    else:
+        document_type = "article"
+    correct_p = transkribus and p_count >= MIN_P_COUNT and lb_count < MIN_LINES_PER_P * p_count
+    return document_type, correct_p
+
+# the document type and correct_p for a file:
+# the options, unless they're set to auto
+def get_document_type(old_soup, filename):
+    document_type, correct_p = detect_document_type(old_soup)
+    if DOCUMENT_TYPE != "auto":
+        document_type = DOCUMENT_TYPE
+    if CORRECT_P != "auto":
+        correct_p = CORRECT_P
+    print_progress(filename + ": " + document_type + ", correct_p " + str(correct_p))
+    return document_type, correct_p
 
 # get body from source xml and combine with template
 # go through certain elements, attributes and values
 # and transform them
-def transform_xml(old_soup, abbr_dictionary):
+def transform_xml(old_soup, abbr_dictionary, document_type):
     xml_body = old_soup.find("body")
-    if DOCUMENT_TYPE == "letter":
+    if document_type == "letter":
         new_soup = letter_content_template()
         new_soup.div.opener.insert_after(xml_body)
         new_soup.body.unwrap()
-    elif DOCUMENT_TYPE == "misc":
+    elif document_type == "misc":
         new_soup = misc_content_template()
         new_soup.div.append(xml_body)
         new_soup.body.unwrap()
@@ -68,284 +431,51 @@ def transform_xml(old_soup, abbr_dictionary):
         new_soup = content_template()
         new_soup.div.append(xml_body)
         new_soup.body.unwrap()
-    pbs = new_soup.find_all("pb")
-    if len(pbs) > 0:
-        for pb in pbs:
-            if "facs" in pb.attrs:
-                del pb["facs"]
-            if "xml:id" in pb.attrs:
-                del pb["xml:id"]
-            pb["type"] = "orig"
-    ps = new_soup.find_all("p")
-    if len(ps) > 0:
-        for p in ps:
-            if "facs" in p.attrs:
-                del p["facs"]
-            if "style" in p.attrs:
-                del p["style"]
-            if "rend" in p.attrs:
-                value = p["rend"]
-                if value == "Quote":
-                    p["rend"] = "parIndent"
-                if value == "Leipäteksti_ei_sisennetty" and DOCUMENT_TYPE == "letter":
-                    del p["rend"]
-                    continue
-                if value == "Leipäteksti_ei_sisennetty":
-                    p["rend"] = "noIndent"
-                if value == "footnote text":
-                    p.unwrap()
-                if value == "Subtitle":
-                    del p["rend"]
-                    p["type"] = "subtitle"
-                if value == "Runo":
-                    del p["rend"]
-                    p.name = "lg"
-                if value == "Kirjekappale":
-                    p.wrap(new_soup.new_tag("opener"))
-                if value == "Standard":
-                    del p["rend"]
-                if value == "color(#222222)":
-                    del p["rend"]
-    # it's possible to export prose from Transkribus OCR
-    # encoded as p + lg + l
-    # since it's not verse, but prose: delete l and lg
-    # and set a flag, so we can combine the lines correctly
-    # later on and then get rid of line breaks and hyphens
-    false_l = False
-    ls = new_soup.find_all("l")
-    if len(ls) > 0:
-        for l in ls:
-            if "rend" in l.attrs:
-                if l["rend"] == "indent":
-                    del l["rend"]
-            parent_p = l.find_parent("p")
-            if parent_p:
-                l.unwrap()
-                false_l = True
+    context = {
+        "soup": new_soup,
+        "document_type": document_type,
+        "false_l": False,
+        "lgs": [],
+        "tags": [],
+        "choices": []
+    }
+    visit_element(new_soup, 0, False, context)
+    false_l = context["false_l"]
     if false_l:
-        lgs = new_soup.find_all("lg")
-        for lg in lgs:
+        for lg in context["lgs"]:
             lg.unwrap()
-    lbs = new_soup.find_all("lb")
-    if len(lbs) > 0:
-        for lb in lbs:
-            if "facs" in lb.attrs:
-                del lb["facs"]
-            if "n" in lb.attrs:
-                del lb["n"]
-    heads = new_soup.find_all("head")
-    if len("head") > 0:
-        for head in heads:
-            if "rend" in head.attrs:
-                head["type"] = head["rend"]
-                del head["rend"]
-            i = 0
-            for parent in head.parents:
-                if parent.name == "div":
-                    i += 1
-            if i <= 2:
-                head["level"] = "1"
-            if i == 3:
-                head["level"] = "2"
-            if i == 4:
-                head["level"] = "3"
-            if i == 5:
-                head["level"] = "4"
-    tables = new_soup.find_all("table")
-    if len(tables) > 0:
-        for table in tables:
-            if "rend" in table.attrs:
-                del table["rend"]
-    cells = new_soup.find_all("cell")
-    if len(cells) > 0:
-        for cell in cells:
-            if "style" in cell.attrs:
-                del cell["style"]
-            if "rend" in cell.attrs:
-                value = cell["rend"]
-                if value == "Body_Text background-color(FAFAFA)" or value == "Leipäteksti_ei_sisennetty background-color(FAFAFA)":
-                    del cell["rend"]
-    lists = new_soup.find_all("list")
-    if len(lists) > 0:
-        for list in lists:
-            if "type" in list.attrs:
-                del list["type"]
-    his = new_soup.find_all("hi")
-    if len(his) > 0:
-        for hi in his:
-            if hi.attrs == {} and DOCUMENT_TYPE != "article":
-                hi["rend"] = "raised"
-            if "rend" in hi.attrs and "style" in hi.attrs:
-                del hi["style"]
-                value = hi["rend"]
-                match_string = re.search("color", value)
-                if match_string:
-                    search_string = re.compile(r"\s*color\(.*\)")
-                    value = search_string.sub("", value)
-                    if value == "":
-                        hi.unwrap()
-                        continue
-                    else:
-                        hi["rend"] = value
-                if value == "italic bold":
-                    hi["rend"] = "boldItalic"
-                match_string = re.search("subscript", value)
-                if match_string:
-                    hi["rend"] = "sub"
-                match_string = re.search("underlined", value)
-                if match_string:
-                    del hi["rend"]
-                match_string = re.search("super", value)
-                if match_string:
-                    hi["rend"] = "raised"
-                match_string = re.search("strikethrough", value)
-                if match_string:
-                    del hi["rend"]
-                    hi.name = "tag"
-                match_string = re.search("italic", value)
-                if match_string or value == "italic":
-                    del hi["rend"]
-                if value == "Harvennettu":
-                    hi["rend"] = "expanded"
-                if value == "Vieraskielinen":
-                    del hi["rend"]
-                    hi.name = "foreign"
-                if value == "Emphasis":
-                    del hi["rend"]
-            if "rend" in hi.attrs:
-                value = hi["rend"]
-                match_string = re.search("color", value)
-                if match_string:
-                    search_string = re.compile(r"\s*color\(.*\)")
-                    value = search_string.sub("", value)
-                    if value == "":
-                        hi.unwrap()
-                        continue
-                    else:
-                        hi["rend"] = value
-                if value == "italic bold":
-                    hi["rend"] = "boldItalic"
-                match_string = re.search("subscript", value)
-                if match_string:
-                    hi["rend"] = "sub"
-                match_string = re.search("underlined", value)
-                if match_string:
-                    del hi["rend"]
-                match_string = re.search("super", value)
-                if match_string:
-                    hi["rend"] = "raised"
-                match_string = re.search("strikethrough", value)
-                if match_string:
-                    del hi["rend"]
-                    hi.name = "tag"
-                match_string = re.search("italic", value)
-                if match_string or value == "italic":
-                    del hi["rend"]
-                if value == "Harvennettu":
-                    hi["rend"] = "expanded"
-                if value == "Vieraskielinen":
-                    del hi["rend"]
-                    hi.name = "foreign"
-                if value == "Emphasis":
-                    del hi["rend"]
-                if value == "Lisätty_marginaaliin":
-                    del hi["rend"]
-                    hi["type"] = "marginalia"
-                    hi.name = "add"
-            if "xml:space" in hi.attrs:
-                del hi["xml:space"]
-            if "style" in hi.attrs:
-                value = hi["style"]
-                match_string = re.search("super", value)
-                if match_string:
-                    hi["rend"] = "raised"
-                    del hi["style"]
-                elif value == "text-decoration: underline;":
-                    del hi["style"]
-                else:
-                    hi.unwrap()
-    segs = new_soup.find_all("seg")
-    if len(segs) > 0:
-        for seg in segs:
-            if "xml:space" in seg.attrs:
-                del seg["xml:space"]
-            if "rend" in seg.attrs:
-                value = seg["rend"]
-                match_string = re.search("italic bold", value)
-                if match_string:
-                    seg["rend"] = "boldItalic"
-                    seg.name = "hi"
-                if value == "italic":
-                    del seg["rend"]
-                    seg.name = "hi"
-                if value == "color(222222)":
-                    seg.unwrap()
-    refs = new_soup.find_all("ref")
-    if len(refs) > 0:
-        for ref in refs:
-            if "target" in ref.attrs:
-                ref["type"] = "readingtext"
-                del ref["target"]
-                ref["id"] = ""
-                ref.name = "xref"
-    abs = new_soup.find_all("ab")
-    if len(abs) > 0:
-        for ab in abs:
-            if "facs" in ab.attrs:
-                del ab["facs"]
-            if "type" in ab.attrs:
-                del ab["type"]
-            ab.name = "p"
-    notes = new_soup.find_all("note")
-    if len(notes) > 0:
-        for note in notes:
-            if "place" in note.attrs:
-                del note["place"]
-            if "xml:id" in note.attrs:
-                note["id"] = note["xml:id"]
-                del note["xml:id"]
-    supplieds = new_soup.find_all("supplied")
-    if len(supplieds) > 0:
-        for supplied in supplieds:
-            if "reason" in supplied.attrs:
-                del supplied["reason"]
-    comments = new_soup.find_all("comment")
-    if len(comments) > 0:
-        for comment in comments:
-            comment.name = "note"
-    tags = new_soup.find_all("tag")
-    if len(tags) > 0:
-        for tag in tags:
-            if tag.string is not None and (str(tag.previous_element) == str("<del><tag>" + tag.string + "</tag></del>") or str(tag.next_element) == str("<del>" + tag.string + "</del>")):
-                tag.unwrap()
-            else:
-                tag.name = "del"
-    choices = new_soup.find_all("choice")
+    # tags are checked in document order, and a <tag> that
+    # becomes a <del> may affect the check for the next one
+    for tag in context["tags"]:
+        if is_deleted_twice(tag):
+            tag.unwrap()
+        else:
+            tag.name = "del"
     # it's easy to mark up abbreviations in Transkribus
     # this gets exported as <choice><abbr>Tit.</abbr><expan/></choice>
     # if we have a recorded expansion for the abbreviation:
     # add this expansion 
-    if len(choices) > 0:
-        # by handling one <choice> at a time we can get <abbr>
-        # and <expan> as a pair
-        for choice in choices:
-            for child in choice.children:
-                # we don't want to change <abbr> in any way,
-                # we just need its content in order to check
-                # the abbr_dictionary for a possible expansion
-                if child.name == "abbr":
-                    abbr = child
-                    abbr_content = str(abbr)
-                    abbr_content = abbr_content.replace("<abbr>", "")
-                    abbr_content = abbr_content.replace("</abbr>", "")
-                    if abbr_content in abbr_dictionary.keys():
-                        expan_content = abbr_dictionary[abbr_content]
-                        # now get the <expan> to update
-                        for child in choice.children:
-                            # only add content to an empty <expan>
-                            if child.name == "expan" and len(child.contents) == 0:
-                                child.insert(0, expan_content)
-    print("We have new soup.")
+    # by handling one <choice> at a time we can get <abbr>
+    # and <expan> as a pair
+    for choice in context["choices"]:
+        for child in choice.children:
+            # we don't want to change <abbr> in any way,
+            # we just need its content in order to check
+            # the abbr_dictionary for a possible expansion
+            # (the most frequent one if there are several)
+            if child.name == "abbr":
+                abbr = child
+                abbr_content = str(abbr)
+                abbr_content = abbr_content.replace("<abbr>", "")
+                abbr_content = abbr_content.replace("</abbr>", "")
+                if abbr_content in abbr_dictionary.keys():
+                    expan_content = abbr_dictionary[abbr_content]
+                    # now get the <expan> to update
+                    for child in choice.children:
+                        # only add content to an empty <expan>
+                        if child.name == "expan" and len(child.contents) == 0:
+                            child.insert(0, expan_content)
+    print_progress("We have new soup.")
     return new_soup, false_l
 
 # the new XML files contain a template
@@ -388,7 +518,7 @@ def content_template():
 # add newlines as preferred
 # fix common problems caused by OCR programs, editors or
 # otherwise present in source files
-def tidy_up_xml(xml_string, false_l, abbr_dictionary):
+def tidy_up_xml(xml_string, false_l, choice_matchers, document_type, correct_p):
     # it's possible to export prose from Transkribus OCR
     # encoded as p + lg + l
     # since it's not verse, but prose:
@@ -401,11 +531,11 @@ def tidy_up_xml(xml_string, false_l, abbr_dictionary):
         xml_string = search_string.sub(" ", xml_string)
         search_string = re.compile(r"\t{1,7}|\s{2}")
         xml_string = search_string.sub("", xml_string)
-    elif DOCUMENT_TYPE == "letter" or DOCUMENT_TYPE == "misc":
+    elif document_type == "letter" or document_type == "misc":
         # get rid of tabs, extra spaces and newlines
         search_string = re.compile(r"\n|\t|\s{2,}")
         xml_string = search_string.sub("", xml_string)
-    elif DOCUMENT_TYPE == "letter":
+    elif document_type == "letter":
         search_string = re.compile(r"(</opener>|</closer>)")
         xml_string = search_string.sub(r"\1\n", xml_string)
     else:
@@ -426,7 +556,7 @@ def tidy_up_xml(xml_string, false_l, abbr_dictionary):
     # add newline after <lb/> (and get rid of trailing space)
     search_string = re.compile(r" *<lb/> *")
     xml_string = search_string.sub("<lb/>\n", xml_string)
-    if DOCUMENT_TYPE == "misc":
+    if document_type == "misc":
         # get rid of newline just before end of <p>
         search_string = re.compile(r"<lb/>\n</p>")
         xml_string = search_string.sub("</p>", xml_string)
@@ -447,26 +577,9 @@ def tidy_up_xml(xml_string, false_l, abbr_dictionary):
     # let <hi> continue instead of being broken up into several <hi>:s
     search_string = re.compile(r"</hi><lb/>\n<hi>")
     xml_string = search_string.sub(r"<lb/>\n", xml_string)
-    # for numbers over 999 that have normal space or comma as separator:
-    # replace those separators with Narrow No-Break Space
-    search_string = re.compile(r"(\d{1,3})( |,)(\d{3,})( |,)(\d{3,})")
-    xml_string = search_string.sub(r"\1&#x202F;\3&#x202F;\5", xml_string)
-    search_string = re.compile(r"(\d{1,3})( |,)(\d{3,})")
-    xml_string = search_string.sub(r"\1&#x202F;\3", xml_string)
-    # add Narrow No-Break Space in numbers over 999 without separator
-    # numbers between 1500 and 1914 in this material
-    # are most likely years and shouldn't contain any space,
-    # so leave them out of the replacement
-    search_string = re.compile(r"(\d{1,3})(\d{3,})(\d{3,})")
-    xml_string = search_string.sub(r"\1&#x202F;\2&#x202F;\3", xml_string)
-    search_string = re.compile(r"(\d{2,3})(\d{3,})")
-    xml_string = search_string.sub(r"\1&#x202F;\2", xml_string)
-    search_string = re.compile(r"\d{4,}")
-    result = re.findall(search_string, xml_string)
-    for match in result:
-        if int(match) < 1500 or int(match) > 1914:
-            match_replacement = match[:1] + "&#x202F;" + match[1:]
-            xml_string = xml_string.replace(match, match_replacement, 1)
+    # add Narrow No-Break Space in numbers over 999,
+    # except in those that are most likely years
+    xml_string = format_numbers(xml_string)
     # the asterisk stands for a footnote
     search_string = re.compile(r" *\*\) *")
     xml_string = search_string.sub("<note id=\"\" n=\"*)\"></note>", xml_string)
@@ -490,7 +603,7 @@ def tidy_up_xml(xml_string, false_l, abbr_dictionary):
     # and at the beginning of each line)
     search_string = re.compile(r"^ +<", re.MULTILINE)
     xml_string = search_string.sub("<", xml_string)
-    if DOCUMENT_TYPE == "article":
+    if document_type == "article":
     # there shouldn't be line breaks like these in articles
         search_string = re.compile(r"-<lb/>\n")
         xml_string = search_string.sub("", xml_string)
@@ -505,7 +618,7 @@ def tidy_up_xml(xml_string, false_l, abbr_dictionary):
     xml_string = search_string.sub("<lb/>\n", xml_string)
     search_string = re.compile(r"</add><lb/>\n<add>")
     xml_string = search_string.sub("<lb/>\n", xml_string)
-    if CORRECT_P is True:
+    if correct_p is True:
         # Transkribus changed its text regions algorithm
         # and now "recognizes" <p>:s everywhere
         # this is of no help to us, so we're better off 
@@ -516,88 +629,56 @@ def tidy_up_xml(xml_string, false_l, abbr_dictionary):
         xml_string = search_string.sub("<lb/>\n", xml_string)
         search_string = re.compile(r"(</p>\n)(<pb .+?/>)(\n<p>)")
         xml_string = search_string.sub(r"<lb/>\n\2\n", xml_string)
+    # remove empty <p/>
+    xml_string = xml_string.replace("<p/>", "")
     # " should be used only in elements, not in element contents
-    # i.e. the text of the document should use ” (&#x201d;
-    # Right Double Quotation Mark) as the character for quotation
-    # marks, but it's very common to use " (&#x22;) and we need
+    # i.e. the text of the document should use ” as the character
+    # for quotation marks, but it's very common to use " and we need
     # to replace those " without touching the ones around attribute
     # values and thus destroying the code
-    # my best take on this is to first replace all tags with something
-    # completely different, then replace quotation marks in the
-    # remaining text, and finally put the tags back where they
-    # once were
-    # first find all tags and thus also the " they may contain
-    search_string = re.compile(r"<.*?>")
-    result = re.findall(search_string, xml_string)
-    tag_replacement = "€"
-    # replace all tags temporarily
-    for tag in result:
-        xml_string = xml_string.replace(tag, tag_replacement, 1)
-    # replace the remaining ", because we now know they all
-    # should be replaced
-    xml_string = xml_string.replace('"', "”")
-    result_2 = re.findall(tag_replacement, xml_string)
-    # replace the first occurrence of the tag_replacement with
-    # the first tag in the original result list, and so on
-    # after this, tags are back in their places and there are
-    # no " in the text, just ”
-    i = 0
-    for occurrence in result_2:
-        xml_string = xml_string.replace(tag_replacement, result[i], 1)
-        i += 1
-    # remove empty <p/>
-    xml_string = xml_string.replace("<p/>", "")
-    # finally standardize certain other characters
-    xml_string = xml_string.replace("„", "”")
-    xml_string = xml_string.replace("‟", "”")
-    xml_string = xml_string.replace("“", "”")
-    xml_string = xml_string.replace("»", "”")
-    xml_string = xml_string.replace("«", "”")
-    xml_string = xml_string.replace("—", "–")
-    xml_string = xml_string.replace("\'", "’")
-    xml_string = xml_string.replace("’’", "”")
-    xml_string = xml_string.replace("´", "’")
-    # do not allow soft hyphen (&shy;), use only hyphen minus
-    # (or the not sign for hyphens that are to be transformed 
-    # differently later on for html and download xml on the site)
-    # first check for hyphen minus combined with soft 
-    # (and often invisible, depending on your text/code editor) hyphen,
-    # as these cases have appeared in the material
-    xml_string = xml_string.replace("-­", "-")
-    xml_string = xml_string.replace("­-", "-")
-    xml_string = xml_string.replace("­", "-")
-    if CHECK_UNTAGGED_ABBREVIATIONS is True:
-        xml_string = replace_untagged_abbreviations(xml_string, abbr_dictionary)
-    print("XML tidied.")
+    # also standardize certain other characters and
+    # don't allow soft hyphens, see text_normalization.py
+    xml_string = normalize_text(xml_string)
+    if len(choice_matchers) > 0:
+        xml_string = replace_untagged_choices(xml_string, choice_matchers)
+    print_progress("XML tidied.")
     return xml_string
 
-# if abbreviations haven't been encoded but we still want to
-# add likely expansions to them: use this option
-def replace_untagged_abbreviations(xml_string, abbr_dictionary):
-    # certain words should only be given expans if they have
-    # been encoded as abbrs, otherwise they probably aren't
-    # abbrs but just ordinary words that can't be expanded
-    # keep these words in this list
-    do_not_expand = ["a.", "adress.", "af", "af.", "afsigt", "allmän", "angelägen", "angelägen.", "art", "B", "B.", "beslut", "beslut.", "bl.", "borg", "borg.", "c.", "d", "D", "D.", "dat", "del", "del.", "des", "E", "E.", "erkände", "f.", "f:", "F.", "fl.", "fr", "Fr", "Fr.", "följ", "Följ", "för", "för.", "föredrag", "förhand", "förhand.", "förord", "först", "först.", "G.", "ge", "ge.", "gen", "gifter", "gång.", "H", "H.", "hand.", "just", "Just", "k.", "K", "K.", "K. F", "K. F.", "kg", "kung", "Kung", "l", "L", "L.", "lämpligt", "lämpligt.", "m", "m.", "M", "M.", "Maj.", "med", "med.", "min", "min.", "mån", "n", "n.", "N", "N.", "nu", "nu.", "ord", "ord.", "period", "period.", "propos", "public", "R", "R.", "redo", "regn", "regn.", "rest", "rest.", "rörde", "s", "s.", "S", "S.", "sammans.", "säg", "Säg", "sigill", "St", "St.", "S<hi rend=\"raised\">t", "S<hi rend=\"raised\">t</hi> Petersburg", "system.", "t.", "tills", "Tills", "tur", "upp", "upp.", "utfärd", "utfärd.", "v.", "verk.", "väg.", "W", "W.", "öfver."]
-    # these are all the recorded abbrs that we hav en expan for
-    abbr_list = abbr_dictionary.keys()
-    for abbreviation in abbr_list:
-        if abbreviation in do_not_expand:
-            continue
-        # prevent abbrs containing a dot from being treated as regex
-        # otherwise e.g. abbr "Fr." matches "Fri" in the text
-        abbreviation_in_text = re.escape(abbreviation)
-        # by adding some sontext to the abbr we can specify 
-        # what a word should look like and make sure that parts
-        # of words or already tagged words don't get tagged 
-        search_string = re.compile(r"(\s|^|»|”|\()" + abbreviation_in_text + r"(\s|\.|,|\?|!|»|”|:|;|\)|<lb/>|</p>)", re.MULTILINE)
-        result = search_string.search(xml_string)
-        if result is not None:
-            # get the expan for this abbr and substitute this
-            # part of the text
-            expansion = abbr_dictionary[abbreviation]
-            xml_string = search_string.sub(r"\1" + "<choice><abbr>" + abbreviation + "</abbr><expan>" + expansion + "</expan></choice>" r"\2", xml_string)
-    return xml_string
+# if abbreviations (or corrections etc.) haven't been encoded
+# but we still want to add likely expansions to them: use these
+# options
+# each matcher is built from its dictionary once and saved
+# in its index, see abbr_matcher.py
+def replace_untagged_choices(xml_string, choice_matchers):
+    return expand_choices(xml_string, choice_matchers)
+
+# the dictionaries in use, by type: the abbreviation dictionary
+# is always needed for the expansions of encoded abbreviations
+def get_used_dictionaries():
+    used_dictionaries = {"abbr": (ABBR_DICTIONARY, ABBR_INDEX)}
+    if CHECK_UNTAGGED_CORRECTIONS is True:
+        used_dictionaries["corr"] = (CORR_DICTIONARY, CORR_INDEX)
+    if CHECK_UNTAGGED_REGULARIZATIONS is True:
+        used_dictionaries["reg"] = (REG_DICTIONARY, REG_INDEX)
+    return used_dictionaries
+
+# load the indexes of the dictionaries in use
+def load_choice_indexes():
+    choice_indexes = {}
+    for choice_type, (dictionary_file, index_file) in get_used_dictionaries().items():
+        choice_indexes[choice_type] = load_abbr_index(dictionary_file, index_file, choice_type)
+    return choice_indexes
+
+# the matchers used for untagged abbreviations etc. together
+# with the tags of their <choice>, in order of precedence
+def get_choice_matchers(choice_indexes):
+    choice_matchers = []
+    if CHECK_UNTAGGED_ABBREVIATIONS is True:
+        choice_matchers.append((choice_indexes["abbr"]["matcher"], choice_indexes["abbr"]["tags"]))
+    for choice_type in ["corr", "reg"]:
+        if choice_type in choice_indexes:
+            choice_matchers.append((choice_indexes[choice_type]["matcher"], choice_indexes[choice_type]["tags"]))
+    return choice_matchers
 
 # save the new xml file in another folder
 def write_to_file(tidy_xml_string, filename):
@@ -609,12 +690,21 @@ def write_to_file(tidy_xml_string, filename):
 
 def main():
     file_list = get_source_file_paths()
+    # the abbreviation index contains the most frequent
+    # expansion of each abbreviation in the dictionary
+    # and the matcher built from them
+    choice_indexes = load_choice_indexes()
+    abbr_dictionary = choice_indexes["abbr"]["lookup"]
+    choice_matchers = get_choice_matchers(choice_indexes)
     for file in file_list:
         old_soup = read_xml(file)
-        abbr_dictionary = read_dict_from_file("dictionaries/abbr_dictionary.json")
-        new_soup, false_l = transform_xml(old_soup, abbr_dictionary)
-        tidy_xml_string = tidy_up_xml(str(new_soup), false_l, abbr_dictionary)
+        document_type, correct_p = get_document_type(old_soup, file)
+        new_soup, false_l = transform_xml(old_soup, abbr_dictionary, document_type)
+        tidy_xml_string = tidy_up_xml(str(new_soup), false_l, choice_matchers, document_type, correct_p)
         write_to_file(tidy_xml_string, file)
         print(file + " created.")
 
-main()
\ No newline at end of file
+# the functions of this script are also used by ingest_xml.py,
+# so only run main() when the script itself is run
+if __name__ == "__main__":
+    main()
\ No newline at end of file
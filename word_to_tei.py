@@ -0,0 +1,419 @@
+# This module converts word processor documents (DOCX and ODT)
+# into TEI XML locally, instead of sending them through
+# TEIGarage Conversion first. The result is the same kind of
+# TEI as TEIGarage produces, i.e. paragraph styles become
+# <p rend="style name">, character styles and direct formatting
+# become <hi rend="...">, headings start <div>:s, and footnotes
+# become <note place="foot"> with <p rend="footnote text">.
+# So the project's styles (Leipäteksti_ei_sisennetty, Runo,
+# Subtitle, Harvennettu, Vieraskielinen, Lisätty_marginaaliin
+# and so on) are then handled by transform_xml.transform_xml
+# just like the ones in documents converted by TEIGarage.
+
+# A DOCX is a ZIP archive containing word/document.xml,
+# word/styles.xml and word/footnotes.xml, an ODT one containing
+# content.xml and styles.xml. The documents are read straight
+# from the archive, so this works offline, and ingest_xml.py
+# uses it for transforming the documents in parallel.
+
+import io
+import re
+import html
+import zipfile
+from bs4 import BeautifulSoup
+
+# the names of the default styles, which don't need a rend
+DEFAULT_STYLES = frozenset(["Normal", "Default Paragraph Font", "Standard", "Default"])
+HEADING_PATTERN = re.compile(r"^(?:heading|Heading|Otsikko) (\d)$")
+# the values of a few DOCX properties that mean "off"
+OFF_VALUES = frozenset(["0", "false", "none"])
+
+def escape_text(text):
+    return html.escape(text, quote=False)
+
+def escape_attribute(value):
+    return html.escape(value, quote=True)
+
+# the formatting of a run or span as the rend value TEIGarage
+# gives it, e.g. "italic bold"
+def create_rend(italic, bold, underlined, strikethrough, position):
+    rend = []
+    if italic:
+        rend.append("italic")
+    if bold:
+        rend.append("bold")
+    if underlined:
+        rend.append("underlined")
+    if strikethrough:
+        rend.append("strikethrough")
+    if position is not None:
+        rend.append(position)
+    return " ".join(rend)
+
+# put the text of runs with the same character style and
+# formatting into the same <hi>, since word processors split
+# text into runs for all kinds of reasons
+# runs is a list of (character style, rend, content)
+def join_runs(runs):
+    parts = []
+    for style, rend, content in runs:
+        if content == "":
+            continue
+        key = (style, rend)
+        if len(parts) > 0 and parts[-1][0] == key:
+            parts[-1][1].append(content)
+        else:
+            parts.append((key, [content]))
+    tei_string = ""
+    for (style, rend), contents in parts:
+        content = "".join(contents)
+        if rend != "":
+            content = "<hi rend=\"" + escape_attribute(rend) + "\">" + content + "</hi>"
+        if style is not None:
+            content = "<hi rend=\"" + escape_attribute(style) + "\">" + content + "</hi>"
+        tei_string += content
+    return tei_string
+
+def create_paragraph(style, content):
+    if style is None:
+        return "<p>" + content + "</p>\n"
+    return "<p rend=\"" + escape_attribute(style) + "\">" + content + "</p>\n"
+
+def create_note(number, paragraphs):
+    content = "".join("<p rend=\"footnote text\">" + paragraph + "</p>" for paragraph in paragraphs)
+    return "<note place=\"foot\" xml:id=\"ftn" + str(number) + "\" n=\"" + str(number) + "\">" + content + "</note>"
+
+# headings divide the text into (nested) <div>:s
+# div_levels is the list of the levels of the open <div>:s
+def open_div(div_levels, level, head):
+    tei_string = ""
+    while len(div_levels) > 0 and div_levels[-1] >= level:
+        div_levels.pop()
+        tei_string += "</div>\n"
+    div_levels.append(level)
+    return tei_string + "<div>\n<head>" + head + "</head>\n"
+
+def close_divs(div_levels):
+    tei_string = "</div>\n" * len(div_levels)
+    div_levels.clear()
+    return tei_string
+
+def create_tei(body_content):
+    return "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n<TEI xmlns=\"http://www.tei-c.org/ns/1.0\"><text><body>\n" + body_content + "</body></text></TEI>\n"
+
+def read_archive_member(archive, member_name):
+    if member_name not in archive.namelist():
+        return None
+    return BeautifulSoup(archive.read(member_name), "xml")
+
+# DOCX
+
+# the names of the styles by their id
+def read_docx_styles(styles_soup):
+    style_names = {}
+    if styles_soup is None:
+        return style_names
+    for style in styles_soup.find_all("w:style"):
+        name = style.find("w:name")
+        if name is not None and "w:styleId" in style.attrs:
+            style_names[style["w:styleId"]] = name.get("w:val", style["w:styleId"])
+    return style_names
+
+# the targets of hyperlinks by their relationship id
+def read_docx_relationships(relationships_soup):
+    relationships = {}
+    if relationships_soup is None:
+        return relationships
+    for relationship in relationships_soup.find_all("Relationship"):
+        relationships[relationship.get("Id")] = relationship.get("Target", "")
+    return relationships
+
+# the value of a run property, None if it isn't set
+# a property set without a value is turned on
+def get_docx_property(properties, name):
+    if properties is None:
+        return None
+    element = properties.find("w:" + name, recursive=False)
+    if element is None:
+        return None
+    return element.get("w:val", "true")
+
+def is_docx_property_on(properties, name):
+    value = get_docx_property(properties, name)
+    return value is not None and value not in OFF_VALUES
+
+def get_docx_style_name(style_names, properties, name):
+    if properties is None:
+        return None
+    style = properties.find("w:" + name, recursive=False)
+    if style is None:
+        return None
+    style_name = style_names.get(style.get("w:val"), style.get("w:val"))
+    if style_name in DEFAULT_STYLES:
+        return None
+    return style_name
+
+def convert_docx_footnote(footnote_reference, context):
+    footnote = context["footnotes"].get(footnote_reference.get("w:id"))
+    if footnote is None:
+        return ""
+    context["note_count"] += 1
+    paragraphs = [convert_docx_inline(paragraph, context) for paragraph in footnote.find_all("w:p")]
+    return create_note(context["note_count"], paragraphs)
+
+# the content of a paragraph, consisting of runs
+# (that may be inside hyperlinks, insertions etc.)
+def convert_docx_inline(paragraph, context):
+    runs = []
+    tei_string = ""
+    for element in paragraph.children:
+        if element.name == "r":
+            properties = element.find("w:rPr", recursive=False)
+            style = get_docx_style_name(context["style_names"], properties, "rStyle")
+            position = get_docx_property(properties, "vertAlign")
+            if position != "superscript" and position != "subscript":
+                position = None
+            rend = create_rend(
+                is_docx_property_on(properties, "i"),
+                is_docx_property_on(properties, "b"),
+                is_docx_property_on(properties, "u"),
+                is_docx_property_on(properties, "strike"),
+                position
+            )
+            content = ""
+            for child in element.children:
+                if child.name == "t":
+                    content += escape_text(child.get_text())
+                elif child.name == "tab":
+                    content += " "
+                elif child.name == "br" or child.name == "cr":
+                    content += "<lb/>"
+                elif child.name == "noBreakHyphen":
+                    content += "-"
+                elif child.name == "softHyphen":
+                    content += "\u00ad"
+                # a symbol inserted from a font, with its code point
+                # as a hexadecimal number
+                elif child.name == "sym" and child.get("w:char") is not None:
+                    content += escape_text(chr(int(child["w:char"], 16)))
+                # the footnote reference has a style of its own,
+                # but the note shouldn't end up inside a <hi>
+                elif child.name == "footnoteReference":
+                    runs.append((style, rend, content))
+                    content = ""
+                    tei_string += join_runs(runs)
+                    runs = []
+                    tei_string += convert_docx_footnote(child, context)
+            runs.append((style, rend, content))
+        elif element.name == "hyperlink":
+            tei_string += join_runs(runs)
+            runs = []
+            content = convert_docx_inline(element, context)
+            target = context["relationships"].get(element.get("r:id"))
+            if target is None:
+                tei_string += content
+            else:
+                tei_string += "<ref target=\"" + escape_attribute(target) + "\">" + content + "</ref>"
+        elif element.name in ("ins", "smartTag", "sdt", "sdtContent", "customXml", "fldSimple"):
+            tei_string += join_runs(runs)
+            runs = []
+            tei_string += convert_docx_inline(element, context)
+    return tei_string + join_runs(runs)
+
+def convert_docx_table(table, context):
+    tei_string = "<table>\n"
+    for row in table.find_all("w:tr", recursive=False):
+        tei_string += "<row>"
+        for cell in row.find_all("w:tc", recursive=False):
+            paragraphs = [convert_docx_inline(paragraph, context) for paragraph in cell.find_all("w:p")]
+            tei_string += "<cell>" + "<lb/>".join(paragraphs) + "</cell>"
+        tei_string += "</row>\n"
+    return tei_string + "</table>\n"
+
+def convert_docx_blocks(parent, context, div_levels):
+    tei_string = ""
+    for element in parent.children:
+        if element.name == "p":
+            properties = element.find("w:pPr", recursive=False)
+            style = get_docx_style_name(context["style_names"], properties, "pStyle")
+            content = convert_docx_inline(element, context)
+            heading = HEADING_PATTERN.match(style) if style is not None else None
+            if heading is not None:
+                tei_string += open_div(div_levels, int(heading.group(1)), content)
+            elif content != "" or style is not None:
+                tei_string += create_paragraph(style, content)
+        elif element.name == "tbl":
+            tei_string += convert_docx_table(element, context)
+        elif element.name in ("sdt", "sdtContent", "customXml"):
+            tei_string += convert_docx_blocks(element, context, div_levels)
+    return tei_string
+
+# convert the content of a DOCX file into a TEI string
+def docx_to_tei(file_content):
+    with zipfile.ZipFile(io.BytesIO(file_content)) as archive:
+        document_soup = read_archive_member(archive, "word/document.xml")
+        styles_soup = read_archive_member(archive, "word/styles.xml")
+        footnotes_soup = read_archive_member(archive, "word/footnotes.xml")
+        relationships_soup = read_archive_member(archive, "word/_rels/document.xml.rels")
+    footnotes = {}
+    if footnotes_soup is not None:
+        for footnote in footnotes_soup.find_all("w:footnote"):
+            # the separators between the text and the footnotes
+            if footnote.get("w:type") in ("separator", "continuationSeparator", "continuationNotice"):
+                continue
+            footnotes[footnote.get("w:id")] = footnote
+    context = {
+        "style_names": read_docx_styles(styles_soup),
+        "relationships": read_docx_relationships(relationships_soup),
+        "footnotes": footnotes,
+        "note_count": 0
+    }
+    div_levels = []
+    body_content = convert_docx_blocks(document_soup.find("w:body"), context, div_levels)
+    body_content += close_divs(div_levels)
+    return create_tei(body_content)
+
+# ODT
+
+# the text formatting of an automatic style
+def read_odt_formatting(style):
+    properties = style.find("style:text-properties")
+    if properties is None:
+        return ""
+    position = None
+    text_position = properties.get("style:text-position", "0")
+    if text_position.startswith("super") or (text_position[:1].isdigit() and text_position.split()[0] not in ("0", "0%")):
+        position = "superscript"
+    elif text_position.startswith("sub") or text_position.startswith("-"):
+        position = "subscript"
+    return create_rend(
+        properties.get("fo:font-style") == "italic",
+        properties.get("fo:font-weight") == "bold",
+        properties.get("style:text-underline-style", "none") != "none",
+        properties.get("style:text-line-through-style", "none") != "none",
+        position
+    )
+
+# the display names of the named styles, and the parent style
+# and formatting of the automatic ones (P1, T1 etc.)
+def read_odt_styles(styles_soup, content_soup):
+    style_names = {}
+    automatic_styles = {}
+    for soup in (styles_soup, content_soup):
+        if soup is None:
+            continue
+        for style in soup.find_all("style:style"):
+            name = style.get("style:name")
+            if style.parent.name == "automatic-styles":
+                automatic_styles[name] = (style.get("style:parent-style-name"), read_odt_formatting(style))
+            else:
+                style_names[name] = style.get("style:display-name", name)
+    return style_names, automatic_styles
+
+# the named style and the formatting of an element
+def get_odt_style(element, context):
+    name = element.get("text:style-name")
+    formatting = ""
+    if name in context["automatic_styles"]:
+        name, formatting = context["automatic_styles"][name]
+    if name is None:
+        return None, formatting
+    style_name = context["style_names"].get(name, name)
+    if style_name in DEFAULT_STYLES:
+        return None, formatting
+    return style_name, formatting
+
+def convert_odt_inline(parent, context):
+    runs = []
+    tei_string = ""
+    for element in parent.children:
+        if element.name is None:
+            runs.append((None, "", escape_text(str(element))))
+        elif element.name == "span":
+            style, rend = get_odt_style(element, context)
+            content = convert_odt_inline(element, context)
+            runs.append((style, rend, content))
+        # extra spaces aren't wanted in the text anyway,
+        # so any number of them becomes one
+        elif element.name == "s":
+            runs.append((None, "", " "))
+        elif element.name == "tab":
+            runs.append((None, "", " "))
+        elif element.name == "line-break":
+            runs.append((None, "", "<lb/>"))
+        elif element.name == "a":
+            tei_string += join_runs(runs)
+            runs = []
+            content = convert_odt_inline(element, context)
+            tei_string += "<ref target=\"" + escape_attribute(element.get("xlink:href", "")) + "\">" + content + "</ref>"
+        elif element.name == "note" and element.get("text:note-class", "footnote") == "footnote":
+            tei_string += join_runs(runs)
+            runs = []
+            context["note_count"] += 1
+            note_body = element.find("text:note-body")
+            paragraphs = [convert_odt_inline(paragraph, context) for paragraph in note_body.find_all(["text:p", "text:h"])]
+            tei_string += create_note(context["note_count"], paragraphs)
+        elif element.name in ("bookmark", "bookmark-start", "bookmark-end", "soft-page-break", "note-citation"):
+            continue
+        elif element.name is not None:
+            tei_string += join_runs(runs)
+            runs = []
+            tei_string += convert_odt_inline(element, context)
+    return tei_string + join_runs(runs)
+
+def convert_odt_table(table, context):
+    tei_string = "<table>\n"
+    for row in table.find_all("table:table-row"):
+        tei_string += "<row>"
+        for cell in row.find_all("table:table-cell", recursive=False):
+            paragraphs = [convert_odt_inline(paragraph, context) for paragraph in cell.find_all("text:p")]
+            tei_string += "<cell>" + "<lb/>".join(paragraphs) + "</cell>"
+        tei_string += "</row>\n"
+    return tei_string + "</table>\n"
+
+def convert_odt_blocks(parent, context, div_levels):
+    tei_string = ""
+    for element in parent.children:
+        if element.name == "p":
+            style, formatting = get_odt_style(element, context)
+            content = convert_odt_inline(element, context)
+            if formatting != "" and content != "":
+                content = "<hi rend=\"" + formatting + "\">" + content + "</hi>"
+            heading = HEADING_PATTERN.match(style) if style is not None else None
+            if heading is not None:
+                tei_string += open_div(div_levels, int(heading.group(1)), content)
+            elif content != "" or style is not None:
+                tei_string += create_paragraph(style, content)
+        elif element.name == "h":
+            content = convert_odt_inline(element, context)
+            tei_string += open_div(div_levels, int(element.get("text:outline-level", "1")), content)
+        elif element.name == "table":
+            tei_string += convert_odt_table(element, context)
+        elif element.name in ("list", "list-item", "list-header", "section"):
+            tei_string += convert_odt_blocks(element, context, div_levels)
+    return tei_string
+
+# convert the content of an ODT file into a TEI string
+def odt_to_tei(file_content):
+    with zipfile.ZipFile(io.BytesIO(file_content)) as archive:
+        content_soup = read_archive_member(archive, "content.xml")
+        styles_soup = read_archive_member(archive, "styles.xml")
+    style_names, automatic_styles = read_odt_styles(styles_soup, content_soup)
+    context = {
+        "style_names": style_names,
+        "automatic_styles": automatic_styles,
+        "note_count": 0
+    }
+    div_levels = []
+    body_content = convert_odt_blocks(content_soup.find("office:text"), context, div_levels)
+    body_content += close_divs(div_levels)
+    return create_tei(body_content)
+
+# convert a DOCX or ODT file, given its content and filename,
+# and return the TEI as a soup object
+def word_to_tei(file_content, filename):
+    if filename.lower().endswith(".odt"):
+        tei_string = odt_to_tei(file_content)
+    else:
+        tei_string = docx_to_tei(file_content)
+    return BeautifulSoup(tei_string, "xml")